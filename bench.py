@@ -0,0 +1,392 @@
+import argparse
+import calendar
+import datetime
+import functools
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import core
+
+CATEGORIES = [ f"Category {i}" for i in range(20) ]
+DESCRIPTIONS = [ f"Merchant {i}" for i in range(2000) ]
+SUITE_SIZES = [ 1_000, 100_000, 1_000_000, 10_000_000 ]
+SUITE_FIRST_YEAR = 2000
+SUITE_YEARS = 26
+SUITE_CATEGORIES = [ f"Category {i}" for i in range(60) ]
+SUITE_MERCHANTS = [
+    f"{word} {i}"
+    for i in range(5000)
+    for word in ( "Grocer", "Cafe", "Fuel", "Pharmacy", "Online Store" )
+]
+
+def generate_tas(n, first_year=2010, years=10, seed=0):
+    rng = random.Random(seed)
+    return [
+        {
+            "category": rng.choice(CATEGORIES),
+            "description": rng.choice(DESCRIPTIONS),
+            "cents": rng.randint(100, 50000),
+            "year": str(first_year + rng.randrange(years)),
+            "month": str(rng.randint(1, 12)),
+            "day": str(rng.randint(1, 28)),
+        }
+        for _ in range(n)
+    ]
+
+def generate_store(n, first_year=2010, years=10, seed=0):
+    rng = np.random.default_rng(seed)
+    store = core.TaStore(capacity=max(n, 16))
+    store.columns["years"][:n] = first_year + rng.integers(years, size=n)
+    store.columns["months"][:n] = rng.integers(1, 13, size=n)
+    store.columns["days"][:n] = rng.integers(1, 29, size=n)
+    store.columns["cents"][:n] = rng.integers(100, 50000, size=n)
+    store.columns["cat_ids"][:n] = rng.integers(len(CATEGORIES), size=n)
+    store.columns["desc_ids"][:n] = rng.integers(len(DESCRIPTIONS), size=n)
+    for cat in CATEGORIES:
+        store.intern_category(cat)
+    for desc in DESCRIPTIONS:
+        store.intern_description(desc)
+    store.size = n
+    return store
+
+def loop_stats(tas, categories):
+    # the per-click loops StartStatsFrame ran before the rollup
+    months = [ 0 ] * 12
+    for ta in tas:
+        months[int(ta["month"]) - 1] += ta["cents"]
+    cats = [ 0 ] * len(categories)
+    for ta in tas:
+        cats[categories.index(ta["category"])] += ta["cents"]
+    monthly_total = sum([
+        ta["cents"] for ta in tas \
+        if ta["year"] == "2015" \
+        and calendar.month_name[int(ta["month"])] == "June"
+    ])
+    return months, cats, monthly_total
+
+def vector_stats(rollup):
+    months = rollup.sums.sum(axis=(0, 2))
+    cats = rollup.sums.sum(axis=(0, 1))
+    monthly_total = rollup.query(2015, month=6)[1]
+    return months, cats, monthly_total
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def traced(func):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, size, elapsed
+
+def bench_memory(n):
+    text = json.dumps(generate_tas(n))
+    _, list_size, list_time = traced(lambda: json.loads(text))
+    _, store_size, store_time = traced(
+        lambda: core.TaStore.from_json(json.loads(text))
+    )
+    print(f"{n} transactions")
+    print("  list of dicts: {:8.1f} MiB  {:6.2f}s load".format(
+        list_size / 2**20,
+        list_time,
+    ))
+    print("  TaStore:       {:8.1f} MiB  {:6.2f}s load".format(
+        store_size / 2**20,
+        store_time,
+    ))
+    print("  {:.1f}x smaller".format(list_size / store_size))
+
+def bench_aggregate(n, chunk=1_000_000):
+    store = generate_store(n)
+    # the loops need dict rows; build them a chunk at a time, untimed, so
+    # 10M rows fit in memory
+    loop_time = 0
+    for start in range(0, n, chunk):
+        rows = [ store.row(i) for i in range(start, min(n, start + chunk)) ]
+        loop_time += timed(functools.partial(loop_stats, rows, CATEGORIES))[1]
+        del rows
+    rollup = core.Rollup()
+    build_time = timed(lambda: rollup.build(store))[1]
+    query_time = timed(lambda: vector_stats(rollup))[1]
+    print(f"{n} transactions")
+    print("  loops:        {:10.4f}s for both graphs and a monthly total".format(loop_time))
+    print("  rollup build: {:10.4f}s once per load".format(build_time))
+    print("  rollup query: {:10.6f}s for the same three".format(query_time))
+
+def generate_suite_store(n, seed=0):
+    # a few merchants account for most rows, as in real statements, with
+    # log-normal amounts and rows in date order like a file grown by hand
+    rng = np.random.default_rng(seed)
+    store = core.TaStore(capacity=max(n, 16))
+    years = SUITE_FIRST_YEAR + rng.integers(SUITE_YEARS, size=n)
+    months = rng.integers(1, 13, size=n)
+    days = rng.integers(1, 29, size=n)
+    order = np.lexsort((days, months, years))
+    store.columns["years"][:n] = years[order]
+    store.columns["months"][:n] = months[order]
+    store.columns["days"][:n] = days[order]
+    store.columns["cents"][:n] = np.minimum(
+        rng.lognormal(7, 1.2, size=n).astype(np.int64) + 1,
+        10_000_000,
+    )
+    store.columns["cat_ids"][:n] = rng.zipf(1.3, size=n) \
+        % len(SUITE_CATEGORIES)
+    store.columns["desc_ids"][:n] = rng.zipf(1.1, size=n) \
+        % len(SUITE_MERCHANTS)
+    for cat in SUITE_CATEGORIES:
+        store.intern_category(cat)
+    for desc in SUITE_MERCHANTS:
+        store.intern_description(desc)
+    store.size = n
+    return store
+
+def suite_data_file(data_dir, n, seed=0):
+    # generated once per size and seed, then reused by later runs
+    path = os.path.join(data_dir, f"data-{n}-{seed}.json")
+    if not os.path.exists(path):
+        os.makedirs(data_dir, exist_ok=True)
+        store = generate_suite_store(n, seed)
+        years = sorted(set(store.column("years").tolist()))
+        core.write_json_file(
+            path,
+            {
+                "categories": list(SUITE_CATEGORIES),
+                "years": [ str(year) for year in years ],
+            },
+            store,
+        )
+    return path
+
+def best_of(func, repeat):
+    # median seconds of repeat calls
+    return statistics.median(timed(func)[1] for _ in range(repeat))
+
+def bench_suite(n, storage, data_dir, repeat, seed=0):
+    # seconds per step with n transactions, each step being what a click
+    # in the window does minus Tk
+    source = suite_data_file(data_dir, n, seed)
+    work_dir = os.path.join(data_dir, f"{storage}-{n}-{seed}")
+    shutil.rmtree(work_dir, ignore_errors=True)
+    os.makedirs(work_dir)
+    shutil.copyfile(source, os.path.join(work_dir, core.DATA_FILE))
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    try:
+        core.STORAGE = storage
+        # untimed, so the one-off migration to other storages is left out
+        if storage == "binary":
+            core.convert_json_to_binary()
+        else:
+            core.load_data()
+            core.close_data()
+
+        results = {}
+        results["load"] = timed(core.load_data)[1]
+        years = [ int(year) for year in core.data["years"] ]
+        year = years[len(years) // 2]
+        cat = core.data["categories"][0]
+        start, end = year * 10000 + 315, (year + 1) * 10000 + 610
+        for name, func in (
+            ( "yearly total", lambda: core.query_stats(year) ),
+            ( "yearly average", lambda: core.query_average(year) ),
+            ( "yearly category total",
+                lambda: core.query_stats(year, cat=cat) ),
+            ( "yearly category average",
+                lambda: core.query_average(year, cat=cat) ),
+            ( "monthly total", lambda: core.query_stats(year, 6) ),
+            ( "monthly average", lambda: core.query_average(year, 6) ),
+            ( "monthly category total",
+                lambda: core.query_stats(year, 6, cat) ),
+            ( "monthly category average",
+                lambda: core.query_average(year, 6, cat) ),
+            ( "range total", lambda: core.query_range(start, end) ),
+            ( "range category total",
+                lambda: core.query_range(start, end, cat) ),
+        ):
+            results[name] = best_of(func, repeat)
+        for name, chart, chart_year in (
+            ( "monthly graph", "monthly", year ),
+            ( "monthly graph all years", "monthly", None ),
+            ( "categories graph", "categories", None ),
+        ):
+            def prepare():
+                core.forget_charts()
+                core.chart_series(chart, chart_year)
+            results[name] = best_of(prepare, repeat)
+        def month_view():
+            # the ids behind the table and the rows of its first screen
+            ta_ids = core.month_ta_ids(year, 6)
+            return [ core.get_ta(ta_id) for ta_id in ta_ids[:10] ]
+        results["month view"] = best_of(month_view, repeat)
+        results["search"] = best_of(
+            lambda: core.search_tas("grocer 12", None, None, None),
+            repeat,
+        )
+        results["add"] = timed(lambda: core.record_ta({
+            "category": cat,
+            "description": "Benchmark",
+            "cents": 1234,
+            "year": str(year),
+            "month": "6",
+            "day": "15",
+        }))[1]
+        def save():
+            core.save_data()
+            core.storage.flush()
+        results["save"] = timed(save)[1]
+        results["close"] = timed(core.close_data)[1]
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    return results
+
+def find_regressions(results, baseline, tolerance, floor):
+    # (size, step, old seconds, new seconds) slower than baseline by more
+    # than tolerance, ignoring steps faster than floor seconds either way
+    regressions = []
+    for size, steps in results["results"].items():
+        for step, seconds in steps.items():
+            old = baseline["results"].get(size, {}).get(step)
+            if old is None or max(old, seconds) < floor:
+                continue
+            if seconds > old * (1 + tolerance):
+                regressions.append((size, step, old, seconds))
+    return regressions
+
+def run_suite(args):
+    sizes = args.rows or SUITE_SIZES
+    results = {
+        "meta": {
+            "date": datetime.datetime.now().isoformat(timespec="seconds"),
+            "storage": args.storage,
+            "repeat": args.repeat,
+            "seed": args.seed,
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+        },
+        "results": {},
+    }
+    for n in sizes:
+        steps = bench_suite(
+            n,
+            args.storage,
+            args.data_dir,
+            args.repeat,
+            args.seed,
+        )
+        results["results"][str(n)] = steps
+        print(f"{n} transactions, {args.storage} storage")
+        for step, seconds in steps.items():
+            print("  {:26} {:12.6f}s".format(step, seconds))
+    with open(args.out, "w") as file:
+        json.dump(results, file, indent=4)
+    print(f"Wrote {args.out}")
+    if args.baseline is None:
+        return
+    with open(args.baseline, "r") as file:
+        baseline = json.load(file)
+    if baseline["meta"]["storage"] != args.storage:
+        sys.exit("The baseline is for the {} storage, not {}!".format(
+            baseline["meta"]["storage"],
+            args.storage,
+        ))
+    regressions = find_regressions(
+        results,
+        baseline,
+        args.tolerance,
+        args.floor,
+    )
+    for size, step, old, new in regressions:
+        print("REGRESSION {} at {} transactions: {:.6f}s -> {:.6f}s"
+            " ({:+.0%})".format(step, size, old, new, new / old - 1),
+            file=sys.stderr)
+    if regressions:
+        sys.exit(1)
+    print(f"No regressions against {args.baseline}")
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Time the expense tracker on generated transactions.",
+    )
+    parser.add_argument(
+        "bench",
+        choices=[ "memory", "aggregate", "suite" ],
+        help="suite times load, save, every statistic, graph and the"
+            " month view and writes the results as JSON",
+    )
+    parser.add_argument(
+        "rows",
+        type=int,
+        nargs="*",
+        help="transaction counts, default 1000000, or "
+            + " ".join(str(n) for n in SUITE_SIZES) + " for suite",
+    )
+    parser.add_argument(
+        "--storage",
+        choices=[ "json", "binary", "sqlite", "shards" ],
+        default="json",
+    )
+    parser.add_argument(
+        "--data-dir",
+        default="bench-data",
+        help="where generated data.json files are kept between runs,"
+            " default %(default)s",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=5,
+        help="runs of each query, the median counts, default %(default)s",
+    )
+    parser.add_argument(
+        "--out",
+        default="bench-results.json",
+        help="default %(default)s",
+    )
+    parser.add_argument(
+        "--baseline",
+        help="results of an earlier run; exit 1 if a step got slower",
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.5,
+        help="how much slower than the baseline is a regression,"
+            " default %(default)s for 50%%",
+    )
+    parser.add_argument(
+        "--floor",
+        type=float,
+        default=0.001,
+        help="steps under this many seconds are too noisy to compare,"
+            " default %(default)s",
+    )
+    return parser
+
+def run():
+    args = build_parser().parse_args()
+    if args.bench == "suite":
+        run_suite(args)
+        return
+    benches = { "memory": bench_memory, "aggregate": bench_aggregate }
+    for n in args.rows or [ 1_000_000 ]:
+        benches[args.bench](n)
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,325 @@
+import argparse
+import datetime
+import json
+import os
+import sys
+
+import core # never tkinter, tkcalendar or matplotlib, so this starts fast
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Expense Tracker without the window, for scripts.",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("categories", help="list the categories")
+    commands.add_parser("years", help="list the years with transactions")
+
+    add_cat = commands.add_parser("add-category", help="create a category")
+    add_cat.add_argument("name")
+
+    add = commands.add_parser("add", help="add a transaction")
+    add.add_argument("category")
+    add.add_argument("description")
+    add.add_argument("amount")
+    add.add_argument("date", type=core.parse_date, help="YYYY-MM-DD")
+    add.add_argument(
+        "--force",
+        action="store_true",
+        help="add it even if it looks like a duplicate",
+    )
+
+    edit = commands.add_parser(
+        "edit",
+        help="change a transaction, ids come from month and search",
+    )
+    edit.add_argument("id", type=int)
+    edit.add_argument("--category")
+    edit.add_argument("--description")
+    edit.add_argument("--amount")
+    edit.add_argument("--date", type=core.parse_date, help="YYYY-MM-DD")
+
+    delete = commands.add_parser("delete", help="delete a transaction")
+    delete.add_argument("id", type=int)
+
+    stats = commands.add_parser(
+        "stats",
+        help="count, total and average of a year, month or category",
+    )
+    stats.add_argument("year", type=int)
+    stats.add_argument("--month", type=month_arg)
+    stats.add_argument("--category")
+
+    range_ = commands.add_parser(
+        "range",
+        help="count, total and average between two dates, both included",
+    )
+    range_.add_argument(
+        "--from",
+        dest="start",
+        type=core.parse_date,
+        default="",
+    )
+    range_.add_argument("--to", dest="end", type=core.parse_date, default="")
+    range_.add_argument(
+        "--last",
+        type=int,
+        metavar="DAYS",
+        help="the last DAYS days up to today, instead of --from and --to",
+    )
+    range_.add_argument("--category")
+
+    month = commands.add_parser(
+        "month",
+        help="list a month's transactions as JSON Lines",
+    )
+    month.add_argument("year", type=int)
+    month.add_argument("month", type=month_arg)
+
+    search = commands.add_parser(
+        "search",
+        help="list the transactions whose description holds every term"
+            " as JSON Lines",
+    )
+    search.add_argument("query")
+    search.add_argument(
+        "--from",
+        dest="start",
+        type=core.parse_date,
+        default="",
+    )
+    search.add_argument("--to", dest="end", type=core.parse_date, default="")
+    search.add_argument(
+        "--category",
+        dest="cats",
+        action="append",
+        help="repeat for several categories, default all",
+    )
+
+    import_ = commands.add_parser(
+        "import",
+        help="import a CSV or OFX bank statement",
+    )
+    import_.add_argument("path")
+    import_.add_argument(
+        "--category",
+        default="Imported",
+        help="for rows without one, default %(default)s",
+    )
+
+    convert = commands.add_parser(
+        "convert",
+        help="rewrite data.json as data.bin or the other way around",
+    )
+    convert.add_argument("to", choices=[ "binary", "json" ])
+
+    export = commands.add_parser(
+        "export",
+        help="export transactions or monthly totals per category"
+            " to CSV, or to JSON Lines for .jsonl paths",
+    )
+    export.add_argument("path")
+    export.add_argument(
+        "--kind",
+        choices=list(core.EXPORT_FIELDS),
+        default="transactions",
+    )
+    export.add_argument(
+        "--from",
+        dest="start",
+        type=core.parse_date,
+        default="",
+    )
+    export.add_argument("--to", dest="end", type=core.parse_date, default="")
+    export.add_argument(
+        "--category",
+        dest="cats",
+        action="append",
+        help="repeat for several categories, default all",
+    )
+    return parser
+
+def month_arg(text):
+    # 1 to 12 or a month name
+    if text.isdigit() and 1 <= int(text) <= 12:
+        return int(text)
+    if text.capitalize() in core.month_numbers:
+        return core.month_numbers[text.capitalize()]
+    raise argparse.ArgumentTypeError(f"not a month: {text!r}")
+
+def run_categories(args):
+    for cat in core.data["categories"]:
+        print(cat)
+
+def run_years(args):
+    for year in core.data["years"]:
+        print(year)
+
+def run_add_category(args):
+    if args.name in core.data["categories"]:
+        sys.exit(f"Category {args.name!r} already exists!")
+    errmsg = core.check_valid_str(args.name)
+    if errmsg:
+        sys.exit(errmsg)
+    core.record_cat(args.name)
+
+def run_add(args):
+    if args.category not in core.data["categories"]:
+        sys.exit(f"Create the category {args.category!r} first!")
+    errmsg = core.check_ta(args.description, args.amount)
+    if errmsg:
+        sys.exit(errmsg)
+    ta = {
+        "category": args.category,
+        "description": args.description,
+        "cents": core.parse_cents(args.amount),
+        "year": str(args.date // 10000),
+        "month": str(args.date // 100 % 100),
+        "day": str(args.date % 100),
+    }
+    if core.find_dupe(ta) is not None and not args.force:
+        sys.exit("A transaction with the same date, amount, description and"
+            " category already exists, use --force to add it anyway.")
+    core.record_ta(ta)
+
+def check_id(ta_id):
+    if not core.has_ta(ta_id):
+        sys.exit(f"No transaction with id {ta_id}!")
+
+def run_edit(args):
+    check_id(args.id)
+    ta = dict(core.get_ta(args.id))
+    if args.category is not None:
+        if args.category not in core.data["categories"]:
+            sys.exit(f"Create the category {args.category!r} first!")
+        ta["category"] = args.category
+    if args.description is not None:
+        ta["description"] = args.description
+    if args.date is not None:
+        ta["year"] = str(args.date // 10000)
+        ta["month"] = str(args.date // 100 % 100)
+        ta["day"] = str(args.date % 100)
+    amount = core.cents_to_str(ta["cents"]) \
+        if args.amount is None else args.amount
+    errmsg = core.check_ta(ta["description"], amount)
+    if errmsg:
+        sys.exit(errmsg)
+    ta["cents"] = core.parse_cents(amount)
+    print(core.update_ta(args.id, ta))
+
+def run_delete(args):
+    check_id(args.id)
+    core.delete_ta(args.id)
+
+def run_stats(args):
+    count, total = core.query_stats(args.year, args.month, args.category)
+    average = core.query_average(args.year, args.month, args.category)
+    print(json.dumps({
+        "year": args.year,
+        "month": args.month,
+        "category": args.category,
+        "count": count,
+        "total": core.cents_to_str(total),
+        "average": None if average is None else core.cents_to_str(average),
+    }))
+
+def run_range(args):
+    if args.last is not None:
+        today = datetime.date.today()
+        start = today - datetime.timedelta(days=args.last - 1)
+        args.start = int(start.strftime("%Y%m%d"))
+        args.end = int(today.strftime("%Y%m%d"))
+    count, total = core.query_range(args.start, args.end, args.category)
+    print(json.dumps({
+        "from": args.start,
+        "to": args.end,
+        "category": args.category,
+        "count": count,
+        "total": core.cents_to_str(total),
+        "average": None if count == 0 \
+            else core.cents_to_str(core.average_cents(total, count)),
+    }))
+
+def run_month(args):
+    for ta_id in core.month_ta_ids(args.year, args.month):
+        print(json.dumps({ "id": ta_id, **core.get_ta(ta_id) }))
+
+def run_search(args):
+    for ta_id in core.search_tas(
+        args.query,
+        args.start,
+        args.end,
+        None if args.cats is None else set(args.cats),
+    ):
+        print(json.dumps({ "id": ta_id, **core.get_ta(ta_id) }))
+
+def run_import(args):
+    for result in core.import_statement(args.path, args.category):
+        pass
+    print("Imported {} transactions ({} skipped, {} duplicates)".format(
+        result["rows"],
+        result["skipped"],
+        result["duplicates"],
+    ))
+    for error in result["errors"]:
+        print(error, file=sys.stderr)
+
+def run_export(args):
+    for result in core.export_data(
+        args.path,
+        args.kind,
+        args.start,
+        args.end,
+        None if args.cats is None else set(args.cats),
+    ):
+        pass
+    print("Exported {} rows to {}".format(result["rows"], args.path))
+
+def run_convert(args):
+    if args.to == "binary":
+        core.convert_json_to_binary()
+        print(f"Converted {core.DATA_FILE} to {core.BINARY_FILE}")
+    else:
+        core.convert_binary_to_json()
+        print(f"Converted {core.BINARY_FILE} to {core.DATA_FILE}")
+
+runners = {
+    "categories": run_categories,
+    "years": run_years,
+    "add-category": run_add_category,
+    "add": run_add,
+    "edit": run_edit,
+    "delete": run_delete,
+    "stats": run_stats,
+    "range": run_range,
+    "month": run_month,
+    "search": run_search,
+    "import": run_import,
+    "export": run_export,
+    "convert": run_convert,
+}
+unloaded = { "convert" } # load the files themselves
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if os.environ.get("EXPENSE_TRACKER_TIMING"):
+        core.timing_hook = core.print_timing
+    if os.environ.get("EXPENSE_TRACKER_DIAGNOSTICS"):
+        # written to core.DIAGNOSTICS_FILE once the command is done
+        core.enable_diagnostics()
+    run = core.instrumented(runners[args.command], f"cli {args.command}")
+    try:
+        if args.command in unloaded:
+            run(args)
+            return
+        core.load_data()
+        try:
+            run(args)
+        finally:
+            core.close_data()
+    finally:
+        if core.diagnostics is not None:
+            core.diagnostics.dump()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,3384 @@
+import bisect
+import calendar
+import collections
+import copy
+import cProfile
+import csv
+import datetime
+import decimal
+import functools
+import hashlib
+import http.client
+import io
+import json
+import mmap
+import numpy as np
+import os
+import pstats
+import queue
+import re
+import sqlite3
+import threading
+import time
+import tracemalloc
+import urllib.parse
+
+DATA_FILE = "data.json"
+JOURNAL_FILE = "data.journal" # append-only log of changes since DATA_FILE
+JOURNAL_COMPACT_THRESHOLD = 1000 # entries before folding into DATA_FILE
+DUPES_FILE = "data.dupes" # duplicate keys of the rows in DATA_FILE
+WRITE_QUEUE_SIZE = 10000 # pending writes before record_ta() and co. block
+IMPORT_BATCH_SIZE = 5000 # statement rows applied per UI tick
+EXPORT_BATCH_SIZE = 5000 # rows written per UI tick and read per SQL query
+DB_FILE = "data.db" # used instead of DATA_FILE by the sqlite storage
+BINARY_FILE = "data.bin" # used instead of DATA_FILE by the binary storage
+BINARY_JOURNAL_FILE = "data.bin.journal" # JOURNAL_FILE for BINARY_FILE
+SHARDS_DIR = "data" # used instead of DATA_FILE by the shards storage
+MANIFEST_FILE = os.path.join(SHARDS_DIR, "manifest.json")
+SHARD_CACHE_SIZE = 3 # years of transactions the shards storage keeps loaded
+PENDING_FILE = "data.pending" # transactions recorded while still loading
+DIAGNOSTICS_FILE = "diagnostics.json" # see Diagnostics.dump()
+PROFILE_FILE = "interaction.prof" # pstats of one profiled interaction
+DIAGNOSTICS_WINDOW = 1000 # latest calls per name the histograms cover
+DIAGNOSTICS_BUCKETS = [ 0.001, 0.01, 0.05, 0.1, 0.5, 1, 5 ]
+    # upper bounds in seconds, the last bucket holding everything slower
+WORD_PATTERN = re.compile(rb"[0-9A-Za-z_\x80-\xff]+") # in UTF-8 text
+WORD_BYTES = np.array([ # the same as a lookup table
+    WORD_PATTERN.fullmatch(bytes([ b ])) is not None for b in range(256)
+])
+STORAGE = os.environ.get("EXPENSE_TRACKER_STORAGE", "json")
+    # or "sqlite", "shards", "binary" or "remote" for a server.py
+SERVER_ADDRESS = os.environ.get("EXPENSE_TRACKER_SERVER", "127.0.0.1:8765")
+    # host:port server.py listens on and the remote storage connects to
+SERVER_TIMEOUT = 60 # seconds the remote storage waits for an answer
+data = {
+    "categories": [], # required for tk.OptionMenu()
+    "years": [], # will be sorted in non-descending order
+    "transactions": [],
+        # TaStore once loaded by JsonStorage, list of dicts inside data.json
+        # contains { category, year, month, day, cents, description }
+}
+storage = None # picked by load_data()
+loader = None # thread running storage.load(), see load_data_in_background()
+chart_cache = {} # (chart, year) => (labels, dollars), see chart_series()
+month_numbers = { calendar.month_name[i]: i for i in range(1, 13) }
+listeners = {} # event => [ callbacks ], see notify() for the events
+timing_hook = None # called as timing_hook(event, seconds), see report_timing()
+diagnostics = None # Diagnostics while enabled, see enable_diagnostics()
+
+AMOUNT_PATTERN = re.compile(r"([+-]?)([0-9]*)(?:\.([0-9]*))?")
+
+def check_ta(description, amount):
+    if not description:
+        return "Please provide a description for this transaction!"
+    return check_amount(amount)
+
+def check_amount(amount):
+    # the digits themselves, so no binary float rounding gets a say
+    match = AMOUNT_PATTERN.fullmatch(amount.strip())
+    if match is None or not (match[2] or match[3]):
+        return "The transaction amount must be a decimal number" \
+            + " (without units)!"
+    if (match[3] or "")[2:].strip("0"):
+        return "There can only be two digits after the decimal!"
+    return ""
+
+def parse_cents(amount):
+    # exact cents of an amount as typed, "12.5" being 1250; ValueError for
+    # what check_amount() rejects
+    errmsg = check_amount(amount)
+    if errmsg:
+        raise ValueError(errmsg)
+    sign, units, decimals = AMOUNT_PATTERN.fullmatch(amount.strip()).groups()
+    cents = int(units or "0") * 100 + int((decimals or "")[:2].ljust(2, "0"))
+    return -cents if sign == "-" else cents
+
+def check_valid_str(test):
+    if re.match("^[A-Za-z0-9_\- ]+$", test):
+        return ""
+    return "Strings must only contain alphanumeric characters, underscores," \
+        + " dashes, and/or spaces!"
+
+class TaStore:
+    # transactions as typed columns, amounts in cents, with categories and
+    # descriptions interned into tables and referenced by id
+    column_types = {
+        "years": np.int16,
+        "months": np.int8,
+        "days": np.int8,
+        "cents": np.int64,
+        "cat_ids": np.int32,
+        "desc_ids": np.int32,
+    }
+
+    def __init__(self, capacity=16):
+        self.size = 0
+        self.columns = {
+            name: np.zeros(capacity, dtype=dtype)
+            for name, dtype in self.column_types.items()
+        }
+        self.categories = []
+        self.category_ids = {}
+        self.descriptions = []
+        self.description_ids = {}
+        self.shared = False # columns handed out by view()
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        for i in range(self.size):
+            yield self.row(i)
+
+    def column(self, name):
+        return self.columns[name][:self.size]
+
+    def view(self):
+        # reserve() swaps in new arrays rather than resizing and set_row()
+        # copies the columns before changing a row a view can see, so this
+        # stays a stable snapshot while the original changes
+        store = copy.copy(self)
+        store.columns = dict(self.columns)
+        self.shared = True
+        return store
+
+    def reserve(self, capacity):
+        for name, column in self.columns.items():
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            self.columns[name] = grown
+
+    def intern_category(self, cat):
+        if cat not in self.category_ids:
+            self.category_ids[cat] = len(self.categories)
+            self.categories.append(cat)
+        return self.category_ids[cat]
+
+    def intern_description(self, desc):
+        if self.description_ids is None:
+            # left for the first append by from_snapshot()
+            self.description_ids = {
+                desc: i for i, desc in enumerate(self.descriptions)
+            }
+        if desc not in self.description_ids:
+            self.description_ids[desc] = len(self.descriptions)
+            self.descriptions.append(desc)
+        return self.description_ids[desc]
+
+    def append(self, ta):
+        if self.size == len(self.columns["years"]):
+            self.reserve(2 * self.size or 16)
+        self.set_row(self.size, ta)
+        self.size += 1
+
+    def set_row(self, i, ta):
+        if self.shared and i < self.size:
+            self.columns = {
+                name: column.copy() for name, column in self.columns.items()
+            }
+            self.shared = False
+        self.columns["years"][i] = int(ta["year"])
+        self.columns["months"][i] = int(ta["month"])
+        self.columns["days"][i] = int(ta["day"])
+        self.columns["cents"][i] = ta_cents(ta)
+        self.columns["cat_ids"][i] = self.intern_category(ta["category"])
+        self.columns["desc_ids"][i] = self.intern_description(
+            ta["description"]
+        )
+
+    def compact(self, keep):
+        # a copy with the rows where the boolean array keep is set, sharing
+        # the category and description tables
+        store = copy.copy(self)
+        store.columns = {
+            name: column[:self.size][keep]
+            for name, column in self.columns.items()
+        }
+        store.size = int(np.count_nonzero(keep))
+        return store
+
+    def row(self, i):
+        # same shape as a transaction in data.json
+        return {
+            "category": self.categories[self.columns["cat_ids"][i]],
+            "description": self.descriptions[self.columns["desc_ids"][i]],
+            "cents": int(self.columns["cents"][i]),
+            "year": str(self.columns["years"][i]),
+            "month": str(self.columns["months"][i]),
+            "day": str(self.columns["days"][i]),
+        }
+
+    @classmethod
+    def from_json(cls, tas):
+        store = cls(capacity=max(len(tas), 16))
+        n = len(tas)
+        store.columns["years"][:n] = [ int(ta["year"]) for ta in tas ]
+        store.columns["months"][:n] = [ int(ta["month"]) for ta in tas ]
+        store.columns["days"][:n] = [ int(ta["day"]) for ta in tas ]
+        store.columns["cents"][:n] = [ ta_cents(ta) for ta in tas ]
+        store.columns["cat_ids"][:n] = [
+            store.intern_category(ta["category"]) for ta in tas
+        ]
+        store.columns["desc_ids"][:n] = [
+            store.intern_description(ta["description"]) for ta in tas
+        ]
+        store.size = n
+        return store
+
+    @classmethod
+    def from_snapshot(cls, records, size, categories, descriptions):
+        # columns are views of a binary snapshot's records, see
+        # read_binary_snapshot()
+        store = cls(capacity=0)
+        store.columns = { name: records[name] for name in cls.column_types }
+        store.size = size
+        for cat in categories:
+            store.intern_category(cat)
+        store.descriptions = descriptions
+        store.description_ids = None
+        return store
+
+class HeapStrings:
+    # read-only strings from a binary snapshot's heap, decoded on access,
+    # followed by the ones appended since
+    def __init__(self, offsets, heap):
+        self.offsets = offsets
+        self.heap = heap
+        self.added = []
+
+    def __len__(self):
+        return len(self.offsets) - 1 + len(self.added)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ self[j] for j in range(*i.indices(len(self))) ]
+        if i < len(self.offsets) - 1:
+            return bytes(self.heap[self.offsets[i]:self.offsets[i + 1]]) \
+                .decode()
+        return self.added[i - len(self.offsets) + 1]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def append(self, text):
+        self.added.append(text)
+
+def ta_cents(ta):
+    # files written before amounts were kept in cents hold an "amount"
+    # string in dollars instead, rewritten in cents on the next save
+    if "cents" in ta:
+        return int(ta["cents"])
+    return int(decimal.Decimal(ta["amount"]).scaleb(2).to_integral_value(
+        decimal.ROUND_HALF_EVEN,
+    ))
+
+def cents_to_str(cents):
+    sign = "-" if cents < 0 else ""
+    return "{}{}.{:02d}".format(sign, abs(cents) // 100, abs(cents) % 100)
+
+def subscribe(event, callback):
+    listeners.setdefault(event, []).append(callback)
+
+def unsubscribe(event, callback):
+    listeners[event].remove(callback)
+
+def notify(event, *args):
+    # events:
+    #   "cat_added" (category, index in data["categories"])
+    #   "year_added" (year, index in data["years"])
+    #   "ta_added" (transaction id, see get_ta())
+    #   "ta_updated" (old transaction id, new one, see update_ta())
+    #   "ta_deleted" (transaction id)
+    #   "tas_imported" (transactions added by one import batch)
+    #   "write_done" (jobs written, seconds, exception or None)
+    #   "data_loaded" (no arguments, see load_data_in_background())
+    start = time.perf_counter()
+    for callback in list(listeners.get(event, [])):
+        callback(*args)
+    report_timing(event, time.perf_counter() - start)
+
+def report_timing(event, seconds):
+    if timing_hook:
+        timing_hook(event, seconds)
+    if diagnostics is not None:
+        diagnostics.record(event, seconds)
+
+def report_gauge(name, value):
+    # a level such as a queue depth, seen by diagnostics only
+    if diagnostics is not None:
+        diagnostics.gauge(name, value)
+
+def print_timing(event, seconds):
+    print(f"[timing] {event}: {seconds * 1000:.2f} ms")
+
+class CallStats:
+    # calls of one name since enabled, plus a rolling window of the latest
+    # DIAGNOSTICS_WINDOW for the histogram and percentiles
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.slowest = 0.0
+        self.recent = collections.deque(maxlen=DIAGNOSTICS_WINDOW)
+        self.peak = None # most bytes tracemalloc saw one call allocate
+
+    def add(self, seconds, peak=None):
+        self.calls += 1
+        self.seconds += seconds
+        self.slowest = max(self.slowest, seconds)
+        self.recent.append(seconds)
+        if peak is not None:
+            self.peak = max(self.peak or 0, peak)
+
+    def histogram(self):
+        counts = [ 0 ] * (len(DIAGNOSTICS_BUCKETS) + 1)
+        for seconds in self.recent:
+            counts[bisect.bisect_left(DIAGNOSTICS_BUCKETS, seconds)] += 1
+        return counts
+
+    def summary(self):
+        recent = sorted(self.recent)
+        return {
+            "calls": self.calls,
+            "seconds": self.seconds,
+            "mean": self.seconds / self.calls,
+            "p50": recent[len(recent) // 2],
+            "p95": recent[min(len(recent) - 1, len(recent) * 95 // 100)],
+            "max": self.slowest,
+            "peak_bytes": self.peak,
+            "histogram": self.histogram(),
+        }
+
+class Diagnostics:
+    # wall time and call counts of every instrumented() call and every
+    # report_timing() event, optionally with tracemalloc peaks, and an
+    # opt-in cProfile capture of one interaction
+    def __init__(self, trace_memory=False):
+        self.stats = {} # name => CallStats
+        self.gauges = {} # name => [ latest value, highest value ]
+        self.lock = threading.Lock() # loading records from its thread
+        self.local = threading.local() # depth of instrumented() calls
+        self.trace_memory = False
+        self.set_trace_memory(trace_memory)
+        self.profile_after = None # seconds, see profile_next()
+        self.profile = None # (name, seconds, pstats text) once captured
+
+    def set_trace_memory(self, on):
+        # tracemalloc slows every allocation down, so only while asked for
+        if on and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        elif not on and self.trace_memory and tracemalloc.is_tracing():
+            tracemalloc.stop()
+        self.trace_memory = on
+
+    def profile_next(self, slower_than=0.0):
+        # profiles outermost calls until one takes at least slower_than
+        # seconds, then keeps that one in PROFILE_FILE and self.profile
+        self.profile = None
+        self.profile_after = slower_than
+
+    def record(self, name, seconds, peak=None):
+        with self.lock:
+            if name not in self.stats:
+                self.stats[name] = CallStats()
+            self.stats[name].add(seconds, peak)
+
+    def gauge(self, name, value):
+        with self.lock:
+            if name not in self.gauges:
+                self.gauges[name] = [ value, value ]
+            self.gauges[name][0] = value
+            self.gauges[name][1] = max(self.gauges[name][1], value)
+
+    def gauge_summary(self):
+        with self.lock:
+            return {
+                name: { "latest": latest, "max": highest }
+                for name, ( latest, highest ) in sorted(self.gauges.items())
+            }
+
+    def call(self, name, func, args, kwargs):
+        depth = getattr(self.local, "depth", 0)
+        # nested calls count towards their own name, but memory peaks and
+        # profiles belong to the outermost call on the main thread
+        outermost = depth == 0 \
+            and threading.current_thread() is threading.main_thread()
+        trace = outermost and self.trace_memory and tracemalloc.is_tracing()
+        profile = None
+        if outermost and self.profile_after is not None:
+            profile = cProfile.Profile()
+        if trace:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        self.local.depth = depth + 1
+        start = time.perf_counter()
+        try:
+            if profile is None:
+                return func(*args, **kwargs)
+            return profile.runcall(func, *args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            self.local.depth = depth
+            peak = None
+            if trace:
+                peak = max(0, tracemalloc.get_traced_memory()[1] - before)
+            self.record(name, seconds, peak)
+            if profile is not None and self.profile_after is not None \
+                    and seconds >= self.profile_after:
+                self.keep_profile(name, seconds, profile)
+
+    def keep_profile(self, name, seconds, profile):
+        self.profile_after = None
+        profile.dump_stats(PROFILE_FILE)
+        text = io.StringIO()
+        pstats.Stats(profile, stream=text) \
+            .sort_stats("cumulative").print_stats(30)
+        self.profile = (name, seconds, text.getvalue())
+
+    def summary(self):
+        # name => CallStats.summary(), slowest in total first
+        with self.lock:
+            stats = sorted(
+                self.stats.items(),
+                key=lambda item: item[1].seconds,
+                reverse=True,
+            )
+            return { name: call_stats.summary() for name, call_stats in stats }
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+            self.gauges.clear()
+
+    def dump(self, path=DIAGNOSTICS_FILE):
+        with open(path, "w") as file:
+            json.dump({
+                "buckets": DIAGNOSTICS_BUCKETS,
+                "window": DIAGNOSTICS_WINDOW,
+                "trace_memory": self.trace_memory,
+                "stats": self.summary(),
+                "gauges": self.gauge_summary(),
+            }, file, indent=4)
+
+def enable_diagnostics(trace_memory=False):
+    global diagnostics
+    if diagnostics is None:
+        diagnostics = Diagnostics(trace_memory)
+    return diagnostics
+
+def disable_diagnostics():
+    global diagnostics
+    if diagnostics is not None:
+        diagnostics.set_trace_memory(False)
+    diagnostics = None
+
+def instrumented(func, name=None):
+    # func timed by diagnostics under name, default its qualified name;
+    # while disabled a call costs one global lookup more
+    name = name or func.__qualname__
+    @functools.wraps(func)
+    def call(*args, **kwargs):
+        if diagnostics is None:
+            return func(*args, **kwargs)
+        return diagnostics.call(name, func, args, kwargs)
+    return call
+
+def add_year(year):
+    if year in data["years"]:
+        return None
+    for i, v in enumerate(data["years"]):
+        if int(year) < int(v):
+            data["years"].insert(i, year)
+            return i
+    data["years"].append(year)
+    return len(data["years"]) - 1
+
+class JsonStorage:
+    # DATA_FILE snapshot plus an append-only JOURNAL_FILE, with every
+    # transaction held in memory as a TaStore; transaction ids are rows,
+    # and deleted rows stay behind as tombstones until the process ends,
+    # so ids hold for a whole session while snapshots leave them out
+    journal_file = JOURNAL_FILE
+
+    def __init__(self):
+        self.journal_seq = 0 # newest change, whether journaled or compacted
+        self.journal_len = 0 # changes in JOURNAL_FILE not in DATA_FILE
+        self.tombstones = set() # deleted rows
+        self.unjournaled = False # add_tas() applied rows since save()
+        self.rollup = Rollup()
+        self.date_index = DateIndex()
+        self.dupes = DupeIndex()
+        self.day_totals = DayTotals()
+        self.text_index = TextIndex()
+        self.writer = None
+        self.legacy = False # DATA_FILE holds dollar strings, see ta_cents()
+
+    def load(self):
+        self.load_snapshot()
+        self.replay_journal()
+        self.writer = self.new_writer()
+        self.writer.start()
+        if self.legacy:
+            self.save()
+
+    def load_head(self):
+        # categories and years without parsing a single transaction, for
+        # the window to show while load() runs on a thread
+        head = self.read_head()
+        data["categories"][:] = head["categories"]
+        data["years"][:] = head["years"]
+        try:
+            file = open(self.journal_file, "rb")
+        except FileNotFoundError:
+            return
+        with file:
+            for line in file:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("torn journal entry")
+                    change = json.loads(line)
+                except ValueError:
+                    break
+                if change["seq"] <= head.get("seq", 0):
+                    continue
+                if change["op"] == "cat":
+                    data["categories"].append(change["cat"])
+                elif change["op"] in ( "ta", "edit" ):
+                    add_year(change["ta"]["year"])
+                # a "delete" carries no transaction and adds no year
+
+    def read_head(self):
+        return read_json_head(DATA_FILE)
+
+    def new_writer(self):
+        return JsonWriter(self.journal_file)
+
+    def load_snapshot(self):
+        loaded = { "categories": [], "years": [], "transactions": [] }
+        try:
+            with open(DATA_FILE, "r") as file:
+                loaded = json.load(file)
+        except FileNotFoundError:
+            pass
+        data["categories"][:] = loaded["categories"]
+        data["years"][:] = loaded["years"]
+        data["transactions"] = TaStore.from_json(loaded["transactions"])
+        self.legacy = any( "cents" not in ta for ta in loaded["transactions"] )
+        self.journal_seq = loaded.get("seq", 0)
+        self.journal_len = 0
+        del loaded
+        self.rollup.build(data["transactions"])
+        self.date_index.build(data["transactions"])
+        self.dupes.build(data["transactions"], self.load_dupe_keys())
+        self.day_totals.build_tas(data["transactions"])
+        self.text_index.build(data["transactions"].descriptions)
+
+    def load_dupe_keys(self):
+        # None when missing or not written for the snapshot just loaded
+        try:
+            with np.load(DUPES_FILE) as dupes:
+                if int(dupes["seq"]) == self.journal_seq \
+                        and len(dupes["keys"]) == len(data["transactions"]):
+                    return dupes["keys"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def replay_journal(self):
+        try:
+            file = open(self.journal_file, "rb+")
+        except FileNotFoundError:
+            return
+        with file:
+            good_size = 0
+            for line in file:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("torn journal entry")
+                    change = json.loads(line)
+                except ValueError:
+                    break
+                good_size += len(line)
+                # a crash between the snapshot rename and the journal
+                # truncate leaves changes that are already in the snapshot
+                if change["seq"] <= self.journal_seq:
+                    continue
+                if "id" in change:
+                    try:
+                        self.check_id(change["id"])
+                    except KeyError:
+                        raise ValueError(
+                            f"{self.journal_file} changes transaction"
+                            f" {change['id']}, which was never stored"
+                            " or is deleted"
+                        ) from None
+                self.apply(change)
+                self.journal_seq = change["seq"]
+                self.journal_len += 1
+            # drop a torn tail so later appends start on a fresh line
+            file.truncate(good_size)
+
+    def save(self):
+        self.journal_len = 0
+        tas, dropped = self.compacted()
+        self.writer.submit((
+            "snapshot",
+            {
+                "categories": list(data["categories"]),
+                "years": list(data["years"]),
+                "seq": self.journal_seq,
+            },
+            tas,
+            self.dupes.hash_tables(data["transactions"]),
+            dropped,
+            not self.unjournaled,
+        ))
+        self.unjournaled = False
+
+    def compacted(self):
+        # the rows for a snapshot, a copy without the tombstones if any,
+        # and the sorted rows left out
+        tas = data["transactions"]
+        if not self.tombstones:
+            return tas.view(), np.zeros(0, dtype=np.int64)
+        keep = np.ones(len(tas), dtype=bool)
+        keep[list(self.tombstones)] = False
+        return tas.compact(keep), np.flatnonzero(~keep)
+
+    def record(self, change):
+        self.journal_seq += 1
+        self.journal_len += 1
+        change["seq"] = self.journal_seq
+        # a copy, as the writer encodes it on its own thread; a snapshot
+        # queued after it leaves it out unless that snapshot fails
+        line = dict(change)
+        if "ta" in change:
+            line["ta"] = dict(change["ta"])
+        self.writer.submit(( "journal", line ))
+        result = self.apply(change)
+        if self.journal_len >= JOURNAL_COMPACT_THRESHOLD:
+            self.save()
+        return result
+
+    def close(self):
+        # rows from add_tas() only reach the files through a snapshot
+        if self.unjournaled:
+            self.save()
+        self.writer.stop()
+
+    def flush(self):
+        # until everything submitted so far is on disk
+        self.writer.jobs.join()
+
+    def poll(self):
+        return self.writer.poll()
+
+    def apply(self, change):
+        # journal changes are "cat", "ta", "edit" and "delete", the last
+        # two with the id of the row they change
+        if change["op"] == "cat":
+            data["categories"].append(change["cat"])
+            return None
+        tas = data["transactions"]
+        if change["op"] == "delete":
+            self.unindex_row(change["id"])
+            self.tombstones.add(change["id"])
+            return change["id"], None
+        year_index = add_year(change["ta"]["year"])
+        if change["op"] == "edit":
+            i = change["id"]
+            self.unindex_row(i)
+            tas.set_row(i, change["ta"])
+        else:
+            tas.append(change["ta"])
+            i = len(tas) - 1
+        self.index_row(i)
+        self.text_index.update()
+        return i, year_index
+
+    def index_row(self, i):
+        tas = data["transactions"]
+        self.rollup.add(tas, i)
+        self.date_index.add(tas, i)
+        self.dupes.add(tas, i)
+        self.day_totals.add(
+            row_date(tas, i),
+            int(tas.columns["cat_ids"][i]),
+            int(tas.columns["cents"][i]),
+        )
+
+    def unindex_row(self, i):
+        # index_row() undone, by the same amounts
+        tas = data["transactions"]
+        self.rollup.add_cell(
+            int(tas.columns["years"][i]),
+            int(tas.columns["months"][i]),
+            int(tas.columns["cat_ids"][i]),
+            -int(tas.columns["cents"][i]),
+            count=-1,
+        )
+        self.date_index.remove(tas, i)
+        self.dupes.remove(tas, i)
+        self.day_totals.add(
+            row_date(tas, i),
+            int(tas.columns["cat_ids"][i]),
+            -int(tas.columns["cents"][i]),
+            count=-1,
+        )
+
+    def add_cat(self, cat):
+        self.record({ "op": "cat", "cat": cat })
+
+    def add_ta(self, ta):
+        return self.record({ "op": "ta", "ta": ta })
+
+    def update_ta(self, ta_id, ta):
+        # (ta_id, index of a new year or None), the id never changes here
+        self.check_id(ta_id)
+        return self.record({ "op": "edit", "id": ta_id, "ta": ta })
+
+    def delete_ta(self, ta_id):
+        self.check_id(ta_id)
+        self.record({ "op": "delete", "id": ta_id })
+
+    def check_id(self, ta_id):
+        # before journaling a change to it
+        if ta_id in self.tombstones \
+                or not 0 <= ta_id < len(data["transactions"]):
+            raise KeyError(f"no transaction {ta_id}")
+
+    def add_tas(self, tas):
+        # imports skip the journal; import_statement() saves once at the end
+        self.unjournaled = True
+        new_years = []
+        for ta in tas:
+            _, year_index = self.apply({ "op": "ta", "ta": ta })
+            if year_index is not None:
+                new_years.append((ta["year"], year_index))
+        return new_years
+
+    def stats(self, year, month=None, cat=None):
+        cat_id = None
+        if cat is not None:
+            if cat not in data["transactions"].category_ids:
+                return 0, 0
+            cat_id = data["transactions"].category_ids[cat]
+        return self.rollup.query(year, month, cat_id)
+
+    def range_stats(self, start=None, end=None, cat=None):
+        cat_id = None
+        if cat is not None:
+            if cat not in data["transactions"].category_ids:
+                return 0, 0
+            cat_id = data["transactions"].category_ids[cat]
+        return self.day_totals.query(start, end, cat_id)
+
+    def month_sums(self, year=None):
+        return self.rollup.month_sums(year)
+
+    def category_sums(self):
+        tas = data["transactions"]
+        cat_sums = self.rollup.sums.sum(axis=(0, 1))
+        return [
+            int(cat_sums[tas.category_ids[cat]])
+                if cat in tas.category_ids else 0
+            for cat in data["categories"]
+        ]
+
+    def month_ta_ids(self, year, month):
+        return np.asarray(self.date_index.lookup(year, month)).tolist()
+
+    def iter_tas(self, start=None, end=None, cats=None):
+        # one month bucket in memory at a time, see SqliteStorage.iter_tas()
+        for _, ta in iter_index_tas(
+            data["transactions"],
+            self.date_index,
+            start,
+            end,
+            cats,
+        ):
+            yield ta
+
+    def month_cat_stats(self, start=None, end=None, cats=None):
+        return rollup_month_cat_stats(
+            self.rollup,
+            data["transactions"].category_ids,
+            start,
+            end,
+            cats,
+        )
+
+    def search(self, query, start=None, end=None, cats=None):
+        return search_rows(
+            data["transactions"],
+            self.text_index,
+            query,
+            start,
+            end,
+            cats,
+            self.tombstones,
+        ).tolist()
+
+    def mark(self):
+        # see find_dupe()
+        return len(data["transactions"])
+
+    def find_dupe(self, ta, before=None):
+        # first stored duplicate of ta, only counting rows stored before
+        # mark() returned before
+        ta_id = self.dupes.lookup(ta_dupe_key(ta))
+        if ta_id is None or (before is not None and ta_id >= before):
+            return None
+        return ta_id
+
+    def get_ta(self, ta_id):
+        return data["transactions"].row(ta_id)
+
+    def load_year(self, year):
+        pass # always loaded
+
+def iter_index_tas(tas, date_index, start=None, end=None, cats=None):
+    # (row, transaction) in date order, see JsonStorage.iter_tas()
+    if cats is not None:
+        cat_ids = [
+            tas.category_ids[cat] for cat in cats if cat in tas.category_ids
+        ]
+    for year, month in sorted(date_index.buckets):
+        if not month_in_range(year, month, start, end):
+            continue
+        ids = np.array(date_index.lookup(year, month), dtype=np.int64)
+        dates = year * 10000 + month * 100 \
+            + tas.columns["days"][ids].astype(np.int64)
+        keep = np.ones(len(ids), dtype=bool)
+        if start is not None:
+            keep &= dates >= start
+        if end is not None:
+            keep &= dates <= end
+        if cats is not None:
+            keep &= np.isin(tas.columns["cat_ids"][ids], cat_ids)
+        for i in ids[keep].tolist():
+            yield i, tas.row(i)
+
+def rollup_month_cat_stats(rollup, category_ids, start=None, end=None,
+        cats=None):
+    # non-empty (year, month, category, count, cents) cells in the order
+    # of data["categories"], with category_ids giving the rollup's ids
+    for year in sorted(rollup.years):
+        counts = rollup.counts[rollup.year_ids[year]]
+        sums = rollup.sums[rollup.year_ids[year]]
+        for month in range(1, 13):
+            if not month_in_range(year, month, start, end):
+                continue
+            for cat in data["categories"]:
+                cat_id = category_ids.get(cat)
+                if cat_id is None or cat_id >= counts.shape[1] \
+                        or not counts[month - 1, cat_id] \
+                        or (cats is not None and cat not in cats):
+                    continue
+                yield (
+                    year,
+                    month,
+                    cat,
+                    int(counts[month - 1, cat_id]),
+                    int(sums[month - 1, cat_id]),
+                )
+
+class JsonWriter(threading.Thread):
+    # writes JsonStorage's journal lines and snapshots off the Tk thread;
+    # whatever queued up during one write goes out together as the next
+    def __init__(self, journal_file=JOURNAL_FILE):
+        threading.Thread.__init__(self, daemon=True)
+        self.journal_file = journal_file
+        self.jobs = queue.Queue(maxsize=WRITE_QUEUE_SIZE)
+        self.results = queue.Queue()
+        self.dropped = np.zeros(0, dtype=np.int64)
+            # sorted rows the snapshot on disk left out, see file_row()
+        self.failed = None # the newest snapshot job whose write failed
+        self.since = [] # the changes queued after it
+        self.appendable = True
+            # whether the journal alone can stand in for the failed
+            # snapshots, which it cannot once one covered add_tas() rows
+
+    def submit(self, job):
+        self.jobs.put(( time.perf_counter(), job ))
+        report_gauge("write queue depth", self.jobs.qsize())
+
+    def stop(self):
+        self.jobs.put(None)
+        self.join()
+
+    def poll(self):
+        # (jobs, seconds, error) per finished write, for the Tk thread;
+        # poll_writes() reports the seconds as the "write" timing, while
+        # run() reports each job's wait until written as "write latency"
+        results = []
+        while not self.results.empty():
+            results.append(self.results.get())
+        return results
+
+    def run(self):
+        while True:
+            batch = [ self.jobs.get() ]
+            while not self.jobs.empty():
+                batch.append(self.jobs.get())
+            queued = [ item[0] for item in batch if item is not None ]
+            jobs = [ item[1] for item in batch if item is not None ]
+            # a failed snapshot is tried again with every write, the last
+            # time when stopping
+            if jobs or (None in batch and self.failed is not None):
+                start = time.perf_counter()
+                error = None
+                try:
+                    self.write(jobs)
+                except Exception as e:
+                    error = e
+                end = time.perf_counter()
+                for submitted in queued:
+                    report_timing("write latency", end - submitted)
+                self.results.put((len(jobs), end - start, error))
+            for _ in batch:
+                self.jobs.task_done()
+            if None in batch:
+                return
+
+    def write(self, jobs):
+        # "file" jobs replace a whole file, so only the last one per path
+        # is written, in the order the paths were first queued
+        files = {}
+        for job in jobs:
+            if job[0] == "file":
+                files[job[1]] = job
+        for _, path, head, tas in files.values():
+            write_json_file(path, head, tas)
+        jobs = [ job for job in jobs if job[0] != "file" ]
+        new_changes = [ job[1] for job in jobs if job[0] == "journal" ]
+        if self.failed is not None:
+            jobs = [ self.failed ] \
+                + [ ( "journal", change ) for change in self.since ] + jobs
+        # a snapshot covers every change queued before it
+        snapshots = [ i for i, job in enumerate(jobs) if job[0] == "snapshot" ]
+        if not snapshots:
+            self.append(new_changes)
+            return
+        snapshot = jobs[snapshots[-1]]
+        after = [ job[1] for job in jobs[snapshots[-1] + 1:] ]
+        try:
+            self.write_snapshot(*snapshot[1:4])
+        except Exception:
+            # keep it for the next write and meanwhile journal what it
+            # covers, as numbered by the files still on disk
+            self.failed, self.since = snapshot, after
+            self.appendable = self.appendable and snapshot[5]
+            if self.appendable:
+                self.append(new_changes)
+            raise
+        self.dropped = snapshot[4]
+        self.failed, self.since = None, []
+        self.appendable = True
+        self.append(after)
+
+    def append(self, changes):
+        if not changes:
+            return
+        lines = []
+        for change in changes:
+            if "id" in change:
+                change = dict(change, id=self.file_row(change["id"]))
+            lines.append(json.dumps(change) + "\n")
+        # one fsynced append, so a crash can only tear the last line
+        with open(self.journal_file, "a") as file:
+            file.write("".join(lines))
+            file.flush()
+            os.fsync(file.fileno())
+
+    def file_row(self, ta_id):
+        # ta_id as numbered by the files, which the last snapshot compacted
+        return ta_id - int(np.searchsorted(self.dropped, ta_id))
+
+    def write_snapshot(self, head, tas, hash_tables):
+        write_json_file(DATA_FILE, head, tas)
+        # a crash before this rename only leaves a stale DUPES_FILE, which
+        # the seq check in load_dupe_keys() rejects
+        tmp_file = DUPES_FILE + ".tmp"
+        with open(tmp_file, "wb") as file:
+            np.savez(
+                file,
+                seq=head["seq"],
+                keys=dupe_keys(tas, 0, len(tas), *hash_tables),
+            )
+        os.replace(tmp_file, DUPES_FILE)
+        open(self.journal_file, "w").close()
+
+def read_json_head(path):
+    # the keys before "transactions", which save_data() and write_json_file()
+    # both put last, read line by line up to it instead of parsing it all
+    lines = []
+    try:
+        with open(path, "r") as file:
+            for line in file:
+                if line.lstrip().startswith('"transactions"'):
+                    text = "".join(lines).rstrip().rstrip(",") + "\n}"
+                    return json.loads(text)
+                lines.append(line)
+    except FileNotFoundError:
+        return { "categories": [], "years": [] }
+    with open(path, "r") as file:
+        return json.load(file)
+
+def write_json_file(path, head, tas=None):
+    # write the file aside and rename it over path so a crash leaves either
+    # the old or the new file, never half of one
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "w") as file:
+        if tas is None:
+            json.dump(head, file, indent=4)
+        else:
+            # stream transactions one per line instead of building the
+            # whole document as a list of dicts first
+            file.write(json.dumps(head, indent=4)[:-2])
+            file.write(',\n    "transactions": [')
+            for i, ta in enumerate(tas):
+                file.write(("," if i else "") + "\n        " + json.dumps(ta))
+            file.write("\n    ]\n}")
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_file, path)
+
+class Rollup:
+    # count and cents per (year, month, category) cell, with categories
+    # indexed by their TaStore id
+    def __init__(self):
+        self.years = []
+        self.year_ids = {}
+        self.counts = np.zeros((0, 12, 0), dtype=np.int64)
+        self.sums = np.zeros((0, 12, 0), dtype=np.int64)
+
+    def build(self, tas):
+        years, year_ids = np.unique(tas.column("years"), return_inverse=True)
+        self.years = years.tolist()
+        self.year_ids = { year: i for i, year in enumerate(self.years) }
+        shape = (len(self.years), 12, len(tas.categories))
+        keys = np.ravel_multi_index(
+            (year_ids, tas.column("months") - 1, tas.column("cat_ids")),
+            shape,
+        )
+        self.counts, self.sums = group_by(keys, tas.column("cents"), shape)
+
+    def reserve(self, n_years, n_cats):
+        pad = (
+            (0, max(0, n_years - self.counts.shape[0])),
+            (0, 0),
+            (0, max(0, n_cats - self.counts.shape[2])),
+        )
+        if pad[0][1] or pad[2][1]:
+            self.counts = np.pad(self.counts, pad)
+            self.sums = np.pad(self.sums, pad)
+
+    def add(self, tas, i):
+        self.add_cell(
+            int(tas.columns["years"][i]),
+            int(tas.columns["months"][i]),
+            int(tas.columns["cat_ids"][i]),
+            int(tas.columns["cents"][i]),
+        )
+
+    def add_cell(self, year, month, cat_id, cents, count=1):
+        if year not in self.year_ids:
+            self.year_ids[year] = len(self.years)
+            self.years.append(year)
+        self.reserve(len(self.years), cat_id + 1)
+        cell = (self.year_ids[year], month - 1, cat_id)
+        self.counts[cell] += count
+        self.sums[cell] += cents
+
+    def month_sums(self, year=None):
+        # cents per calendar month of one year, or summed over all years
+        if year is None:
+            return self.sums.sum(axis=(0, 2)).tolist()
+        if year not in self.year_ids:
+            return [ 0 ] * 12
+        return self.sums[self.year_ids[year]].sum(axis=1).tolist()
+
+    def set_year(self, year, counts, sums):
+        # replaces a year's cells with (12, categories) arrays
+        if year not in self.year_ids:
+            self.year_ids[year] = len(self.years)
+            self.years.append(year)
+        self.reserve(len(self.years), counts.shape[1])
+        y = self.year_ids[year]
+        self.counts[y] = 0
+        self.sums[y] = 0
+        self.counts[y, :, :counts.shape[1]] = counts
+        self.sums[y, :, :sums.shape[1]] = sums
+
+    def query(self, year, month=None, cat_id=None):
+        if year not in self.year_ids:
+            return 0, 0
+        cells = (
+            self.year_ids[year],
+            slice(None) if month is None else month - 1,
+            slice(None) if cat_id is None else cat_id,
+        )
+        return int(self.counts[cells].sum()), int(self.sums[cells].sum())
+
+class DateIndex:
+    # row ids per (year, month), ordered by day and then by insertion
+    def __init__(self):
+        self.buckets = {}
+
+    def build(self, tas):
+        years = tas.column("years")
+        months = tas.column("months")
+        # lexsort is stable, so equal days keep their insertion order
+        order = np.lexsort((tas.column("days"), months, years))
+        keys = years[order].astype(np.int32) * 16 + months[order]
+        starts = np.flatnonzero(np.diff(keys)) + 1
+        self.buckets = {
+            (int(years[ids[0]]), int(months[ids[0]])): ids.tolist()
+            for ids in np.split(order, starts) if len(ids)
+        }
+
+    def load(self, order, bounds):
+        # buckets stay slices of order, a binary snapshot's row ids sorted
+        # like build() sorts them, until rows are added to them
+        self.buckets = {
+            key: order[start:stop] for key, (start, stop) in bounds.items()
+        }
+
+    def add(self, tas, i):
+        key = (int(tas.columns["years"][i]), int(tas.columns["months"][i]))
+        bucket = self.buckets.setdefault(key, [])
+        if isinstance(bucket, np.ndarray):
+            bucket = self.buckets[key] = bucket.tolist()
+        bucket.insert(self.position(tas, bucket, i), i)
+
+    def remove(self, tas, i):
+        key = (int(tas.columns["years"][i]), int(tas.columns["months"][i]))
+        bucket = self.buckets[key]
+        if isinstance(bucket, np.ndarray):
+            bucket = self.buckets[key] = bucket.tolist()
+        del bucket[self.position(tas, bucket, i)]
+        if not bucket:
+            del self.buckets[key]
+
+    def position(self, tas, bucket, i):
+        # where row i goes in bucket or is found in it, by day then row,
+        # as build() orders them
+        days = tas.columns["days"]
+        return bisect.bisect_left(
+            bucket,
+            (days[i], i),
+            key=lambda j: (days[j], j),
+        )
+
+    def lookup(self, year, month):
+        return self.buckets.get((year, month), [])
+
+class DupeIndex:
+    # first transaction id per duplicate key, see dupe_keys()
+    def __init__(self):
+        self.first_ids = {}
+        self.later_ids = {} # key => sorted later ids, for remove()
+        self.desc_hashes = []
+        self.cat_hashes = []
+
+    def hash_tables(self, tas):
+        # text hashes for every description and category in tas, by id
+        for desc in tas.descriptions[len(self.desc_hashes):]:
+            self.desc_hashes.append(text_hash(normalize_description(desc)))
+        for cat in tas.categories[len(self.cat_hashes):]:
+            self.cat_hashes.append(text_hash(cat))
+        return (
+            np.array(self.desc_hashes, dtype=np.uint64),
+            np.array(self.cat_hashes, dtype=np.uint64),
+        )
+
+    def build(self, tas, keys=None, lazy=False):
+        # lazy leaves the dict for the first lookup(), given keys
+        if keys is None:
+            keys = dupe_keys(tas, 0, len(tas), *self.hash_tables(tas))
+        self.first_ids = None
+        self.keys = keys
+        if not lazy:
+            self.build_ids()
+
+    def build_ids(self):
+        # reversed, so the first row with a key is the one that sticks
+        self.first_ids = dict(zip(
+            self.keys[::-1].tolist(),
+            range(len(self.keys) - 1, -1, -1),
+        ))
+        # a stable sort keeps each key's rows in order after the first
+        order = np.argsort(self.keys, kind="stable")
+        repeats = order[1:][self.keys[order][1:] == self.keys[order][:-1]]
+        self.later_ids = {}
+        for key, i in zip(self.keys[repeats].tolist(), repeats.tolist()):
+            self.later_ids.setdefault(key, []).append(i)
+        self.keys = None
+
+    def lookup(self, key):
+        if self.first_ids is None:
+            self.build_ids()
+        return self.first_ids.get(key)
+
+    def add(self, tas, i):
+        if self.first_ids is None:
+            self.build_ids()
+        key = ta_dupe_key(tas.row(i))
+        first = self.first_ids.setdefault(key, i)
+        if first != i:
+            bisect.insort(self.later_ids.setdefault(key, []), max(first, i))
+            self.first_ids[key] = min(first, i)
+
+    def remove(self, tas, i):
+        if self.first_ids is None:
+            self.build_ids()
+        key = ta_dupe_key(tas.row(i))
+        later = self.later_ids.get(key, [])
+        if self.first_ids.get(key) == i:
+            if later:
+                self.first_ids[key] = later.pop(0)
+            else:
+                del self.first_ids[key]
+        elif i in later:
+            later.remove(i)
+        if key in self.later_ids and not later:
+            del self.later_ids[key]
+
+def normalize_description(desc):
+    return " ".join(desc.lower().split())
+
+def text_hash(text):
+    # stable across runs, unlike hash(), so keys can be stored on disk
+    digest = hashlib.blake2b(text.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+def mix_dupe_key(dates, cents, desc_hashes, cat_hashes):
+    # 64-bit key of (date, amount, normalized description, category),
+    # returned as int64 so it also fits an SQLite INTEGER
+    key = dates.astype(np.uint64)
+    for part in ( cents.astype(np.uint64), desc_hashes, cat_hashes ):
+        key = (key ^ part) * np.uint64(0x9E3779B97F4A7C15)
+        key ^= key >> np.uint64(31)
+    return key.view(np.int64)
+
+def dupe_keys(tas, start, stop, desc_hashes, cat_hashes):
+    years = tas.columns["years"][start:stop].astype(np.int64)
+    months = tas.columns["months"][start:stop].astype(np.int64)
+    days = tas.columns["days"][start:stop].astype(np.int64)
+    return mix_dupe_key(
+        years * 10000 + months * 100 + days,
+        tas.columns["cents"][start:stop],
+        desc_hashes[tas.columns["desc_ids"][start:stop]],
+        cat_hashes[tas.columns["cat_ids"][start:stop]],
+    )
+
+def ta_dupe_key(ta):
+    return int(mix_dupe_key(
+        np.array([
+            int(ta["year"]) * 10000 + int(ta["month"]) * 100 + int(ta["day"])
+        ]),
+        np.array([ ta_cents(ta) ]),
+        np.array(
+            [ text_hash(normalize_description(ta["description"])) ],
+            dtype=np.uint64,
+        ),
+        np.array([ text_hash(ta["category"]) ], dtype=np.uint64),
+    )[0])
+
+class TextIndex:
+    # an inverted index over a sequence of texts such as TaStore.descriptions,
+    # by position, on their case folded UTF-8 bytes: each three-byte gram,
+    # and each word's first one and two bytes, to the sorted ids of the
+    # texts holding it; keys are the bytes big-endian, tagged above 2**24
+    # with their length for the word starts
+    def __init__(self):
+        self.texts = None # None until build()
+        self.size = 0
+        self.keys = np.zeros(0, dtype=np.int64)
+        self.offsets = np.zeros(1, dtype=np.int64)
+        self.ids = np.zeros(0, dtype=np.int64)
+        self.added = {} # key => [ ids ] of the texts since build()
+
+    def build(self, texts):
+        # all texts at once, joined by NUL bytes that no key may hold
+        self.texts = texts
+        self.size = len(texts)
+        encoded = [ text.casefold().encode() for text in texts ]
+        lengths = np.fromiter(map(len, encoded), dtype=np.int64, count=self.size)
+        blob = np.frombuffer(b"\0".join(encoded), dtype=np.uint8) \
+            .astype(np.int64)
+        ids = np.repeat(np.arange(self.size), lengths + 1)[:len(blob)]
+        grams = blob[:-2] << 16 | blob[1:-1] << 8 | blob[2:]
+        whole = (blob[:-2] != 0) & (blob[1:-1] != 0) & (blob[2:] != 0)
+        word = WORD_BYTES[blob]
+        first = word & ~np.append(False, word[:-1])
+        second = first[:-1] & word[1:]
+        self.keys, self.offsets, self.ids = posting_lists(
+            np.concatenate((
+                grams[whole],
+                1 << 24 | blob[first],
+                2 << 24 | blob[:-1][second] << 8 | blob[1:][second],
+            )),
+            np.concatenate((ids[:-2][whole], ids[first], ids[:-1][second])),
+        )
+        self.added = {}
+
+    def update(self):
+        # indexes the texts appended since, nothing before build()
+        if self.texts is None:
+            return
+        for i in range(self.size, len(self.texts)):
+            for key in set(text_keys(self.texts[i].casefold().encode())):
+                self.added.setdefault(key, []).append(i)
+        self.size = len(self.texts)
+
+    def lookup(self, key):
+        i = np.searchsorted(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            ids = self.ids[self.offsets[i]:self.offsets[i + 1]]
+        else:
+            ids = self.ids[:0]
+        if key in self.added:
+            # all above the built ids, so still sorted
+            ids = np.concatenate((ids, self.added[key]))
+        return ids
+
+    def find(self, term):
+        # sorted ids of the texts holding a case folded term; terms too
+        # short for a gram match the start of a word instead
+        encoded = term.encode()
+        if len(encoded) < 3:
+            return self.lookup(len(encoded) << 24 | int.from_bytes(encoded, "big"))
+        ids = None
+        for key in set(text_keys(encoded, starts=False)):
+            found = self.lookup(key)
+            ids = found if ids is None \
+                else np.intersect1d(ids, found, assume_unique=True)
+        if len(encoded) > 3:
+            # holding each gram of term does not mean holding term
+            ids = np.array(
+                [ i for i in ids.tolist() if term in self.texts[i].casefold() ],
+                dtype=np.int64,
+            )
+        return ids
+
+    def search(self, query):
+        # sorted ids of the texts holding every whitespace separated term
+        # of query, ignoring case, or None without any terms
+        ids = None
+        for term in query.casefold().split():
+            found = self.find(term)
+            ids = found if ids is None \
+                else np.intersect1d(ids, found, assume_unique=True)
+        return ids
+
+def posting_lists(keys, ids):
+    # (sorted distinct keys, offsets, ids) with the ids of keys[i] sorted
+    # and distinct in ids[offsets[i]:offsets[i + 1]]; a sort of the pairs
+    # as one int64 each, as np.unique() is far slower at this
+    pairs = np.sort(keys << 32 | ids)
+    pairs = pairs[np.append(True, pairs[1:] != pairs[:-1])[:len(pairs)]]
+    keys = pairs >> 32
+    first = np.flatnonzero(np.append(True, keys[1:] != keys[:-1])[:len(keys)])
+    return keys[first], np.append(first, len(pairs)), pairs & 0xFFFFFFFF
+
+def text_keys(encoded, starts=True):
+    # TextIndex keys of one case folded, encoded text
+    keys = [
+        encoded[i] << 16 | encoded[i + 1] << 8 | encoded[i + 2]
+        for i in range(len(encoded) - 2)
+    ]
+    if starts:
+        for word in WORD_PATTERN.findall(encoded):
+            keys.append(1 << 24 | word[0])
+            if len(word) > 1:
+                keys.append(2 << 24 | word[0] << 8 | word[1])
+    return keys
+
+def text_matches(text, terms):
+    # whether text holds every case folded term the way TextIndex.find()
+    # matches them, for rows searched without a TextIndex
+    encoded = text.casefold().encode()
+    words = None
+    for term in terms:
+        term = term.encode()
+        if len(term) >= 3:
+            if term not in encoded:
+                return False
+            continue
+        if words is None:
+            words = WORD_PATTERN.findall(encoded)
+        if not any(word.startswith(term) for word in words):
+            return False
+    return True
+
+def search_rows(
+    tas,
+    text_index,
+    query,
+    start=None,
+    end=None,
+    cats=None,
+    deleted=(),
+):
+    # rows of tas with a description matching query, see TextIndex.search(),
+    # in date then entry order, leaving out the deleted rows; start, end and
+    # cats as for iter_tas()
+    if text_index.texts is None:
+        text_index.build(tas.descriptions)
+    mask = np.ones(len(tas), dtype=bool)
+    desc_ids = text_index.search(query)
+    if desc_ids is not None:
+        mask = np.isin(tas.column("desc_ids"), desc_ids)
+    mask[list(deleted)] = False
+    dates = tas.column("years").astype(np.int64) * 10000 \
+        + tas.column("months").astype(np.int64) * 100 \
+        + tas.column("days")
+    if start is not None:
+        mask &= dates >= start
+    if end is not None:
+        mask &= dates <= end
+    if cats is not None:
+        mask &= np.isin(tas.column("cat_ids"), [
+            tas.category_ids[cat] for cat in cats if cat in tas.category_ids
+        ])
+    rows = np.flatnonzero(mask)
+    return rows[np.argsort(dates[rows], kind="stable")]
+
+class DayTotals:
+    # count and cents per day as Fenwick trees, row 0 for all categories
+    # and row cat_id + 1 per category, so summing any date range and
+    # adding a transaction both take O(log days)
+    def __init__(self):
+        self.first_day = 0 # day number of tree position 1
+        self.counts = np.zeros((1, 1), dtype=np.int64)
+        self.sums = np.zeros((1, 1), dtype=np.int64)
+
+    def build(self, days, cat_ids, cents, counts=None):
+        # days as from day_numbers(), counts per row if rows are groups
+        if counts is None:
+            counts = np.ones(len(days), dtype=np.int64)
+        if len(days) == 0:
+            self.__init__()
+            return
+        self.first_day = year_start(int(days.min()))
+        size = fenwick_size(int(days.max()) - self.first_day + 1)
+        shape = (int(cat_ids.max()) + 2, size + 1)
+        keys = np.ravel_multi_index(
+            (cat_ids.astype(np.int64) + 1, days - self.first_day + 1),
+            shape,
+        )
+        self.counts = sum_by(keys, counts, shape[0] * shape[1]).reshape(shape)
+        self.sums = sum_by(keys, cents, shape[0] * shape[1]).reshape(shape)
+        self.counts[0] = self.counts[1:].sum(axis=0)
+        self.sums[0] = self.sums[1:].sum(axis=0)
+        fenwick_build(self.counts)
+        fenwick_build(self.sums)
+
+    def build_tas(self, tas):
+        self.build(
+            day_numbers(
+                tas.column("years"),
+                tas.column("months"),
+                tas.column("days"),
+            ),
+            tas.column("cat_ids"),
+            tas.column("cents"),
+        )
+
+    def reserve(self, day, n_rows):
+        # regrows around day and n_rows, which is O(days) but only happens
+        # for a new category or for a day outside the trees
+        size = self.counts.shape[1] - 1
+        if size and self.first_day <= day < self.first_day + size \
+                and n_rows <= self.counts.shape[0]:
+            return
+        first_day = year_start(day)
+        end_day = day + 1
+        if size:
+            first_day = min(first_day, self.first_day)
+            end_day = max(end_day, self.first_day + size)
+        new_size = fenwick_size(end_day - first_day)
+        shape = (max(n_rows, self.counts.shape[0]), new_size + 1)
+        offset = self.first_day - first_day
+        for name in ( "counts", "sums" ):
+            points = getattr(self, name)
+            fenwick_unbuild(points)
+            tree = np.zeros(shape, dtype=np.int64)
+            tree[:points.shape[0], offset + 1:offset + size + 1] = \
+                points[:, 1:]
+            fenwick_build(tree)
+            setattr(self, name, tree)
+        self.first_day = first_day
+
+    def add(self, date, cat_id, cents, count=1):
+        day = date_day(date)
+        self.reserve(day, cat_id + 2)
+        rows = [ 0, cat_id + 1 ]
+        i = day - self.first_day + 1
+        while i < self.counts.shape[1]:
+            self.counts[rows, i] += count
+            self.sums[rows, i] += cents
+            i += i & -i
+
+    def prefix(self, row, i):
+        # count and cents in tree positions 1 to i
+        count = cents = 0
+        while i > 0:
+            count += self.counts[row, i]
+            cents += self.sums[row, i]
+            i &= i - 1
+        return int(count), int(cents)
+
+    def query(self, start=None, end=None, cat_id=None):
+        # start and end are dates as year * 10000 + month * 100 + day,
+        # both included, None for no limit
+        row = 0 if cat_id is None else cat_id + 1
+        size = self.counts.shape[1] - 1
+        if row >= self.counts.shape[0] or not size:
+            return 0, 0
+        lo = 1 if start is None \
+            else max(1, date_day(start) - self.first_day + 1)
+        hi = size if end is None \
+            else min(size, date_day(end) - self.first_day + 1)
+        if lo > hi:
+            return 0, 0
+        count, cents = self.prefix(row, hi)
+        before_count, before_cents = self.prefix(row, lo - 1)
+        return count - before_count, cents - before_cents
+
+def fenwick_size(days):
+    # room for twice as many days, as a power of two
+    return 1 << max(9, (2 * days - 1).bit_length())
+
+def fenwick_build(tree):
+    # turns per-position values into Fenwick trees in place, one per row;
+    # position 0 is unused
+    size = tree.shape[1] - 1
+    for i in range(1, size + 1):
+        parent = i + (i & -i)
+        if parent <= size:
+            tree[:, parent] += tree[:, i]
+
+def fenwick_unbuild(tree):
+    # inverse of fenwick_build()
+    size = tree.shape[1] - 1
+    for i in range(size, 0, -1):
+        parent = i + (i & -i)
+        if parent <= size:
+            tree[:, parent] -= tree[:, i]
+
+EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+def day_numbers(years, months, days):
+    # days since 1970-01-01 for columns of years, months and days
+    months = (years.astype(np.int64) - 1970) * 12 + months - 1
+    return months.astype("datetime64[M]").astype("datetime64[D]") \
+        .astype(np.int64) + days - 1
+
+def date_day(date):
+    # the same for one year * 10000 + month * 100 + day date
+    return datetime.date(date // 10000, date // 100 % 100, date % 100) \
+        .toordinal() - EPOCH_ORDINAL
+
+def year_start(day):
+    year = datetime.date.fromordinal(day + EPOCH_ORDINAL).year
+    return datetime.date(year, 1, 1).toordinal() - EPOCH_ORDINAL
+
+def group_by(keys, values, shape):
+    # counts and integer sums of values per flat key, shaped into a cube
+    size = int(np.prod(shape))
+    counts = np.bincount(keys, minlength=size)
+    return counts.reshape(shape), sum_by(keys, values, size).reshape(shape)
+
+def sum_by(keys, values, size):
+    # exact int64 sums of values per flat key; bincount() would add them
+    # up as float64 weights, which round past 2**53 cents
+    sums = np.zeros(size, dtype=np.int64)
+    np.add.at(sums, keys, values)
+    return sums
+
+class SqliteStorage:
+    # transactions live in DB_FILE and are read through its indexes, so
+    # startup only reads the categories and years tables
+    schema = """
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS years (
+            year INTEGER PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS transactions (
+            id INTEGER PRIMARY KEY,
+            category_id INTEGER NOT NULL REFERENCES categories (id),
+            description TEXT NOT NULL,
+            cents INTEGER NOT NULL,
+            year INTEGER NOT NULL,
+            month INTEGER NOT NULL,
+            day INTEGER NOT NULL,
+            date INTEGER NOT NULL, -- year * 10000 + month * 100 + day
+            dupe_key INTEGER -- see mix_dupe_key(), NULL until backfilled
+        );
+    """
+    indexes = """
+        -- day and the implicit id keep month views in date, then entry order
+        CREATE INDEX IF NOT EXISTS transactions_year_month
+            ON transactions (year, month, day);
+        CREATE INDEX IF NOT EXISTS transactions_category_year
+            ON transactions (category_id, year, month);
+        CREATE INDEX IF NOT EXISTS transactions_date
+            ON transactions (date);
+        CREATE INDEX IF NOT EXISTS transactions_dupe_key
+            ON transactions (dupe_key);
+    """
+    search_schema = """
+        -- trigram index over the descriptions, without a copy of them
+        CREATE VIRTUAL TABLE IF NOT EXISTS descriptions USING fts5 (
+            description,
+            content = 'transactions',
+            content_rowid = 'id',
+            tokenize = 'trigram'
+        );
+        CREATE TRIGGER IF NOT EXISTS transactions_descriptions_insert
+            AFTER INSERT ON transactions BEGIN
+                INSERT INTO descriptions (rowid, description)
+                    VALUES (new.id, new.description);
+            END;
+        CREATE TRIGGER IF NOT EXISTS transactions_descriptions_delete
+            AFTER DELETE ON transactions BEGIN
+                INSERT INTO descriptions (descriptions, rowid, description)
+                    VALUES ('delete', old.id, old.description);
+            END;
+        CREATE TRIGGER IF NOT EXISTS transactions_descriptions_update
+            AFTER UPDATE OF description ON transactions BEGIN
+                INSERT INTO descriptions (descriptions, rowid, description)
+                    VALUES ('delete', old.id, old.description);
+                INSERT INTO descriptions (rowid, description)
+                    VALUES (new.id, new.description);
+            END;
+    """
+    insert_ta = "INSERT INTO transactions" \
+        + " (category_id, description, cents, year, month, day, date," \
+        + " dupe_key) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+    def __init__(self, path=DB_FILE):
+        self.path = path
+        self.db = None
+        self.category_ids = {}
+        self.day_totals = None # see range_stats()
+        self.searchable = False # see create_search_index()
+
+    def load(self):
+        migrate = not os.path.exists(self.path) and json_store_exists()
+        # load_data_in_background() connects on its loader thread
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.executescript(self.schema)
+        columns = [ row[1] for row in self.db.execute(
+            "PRAGMA table_info(transactions)"
+        ) ]
+        if "dupe_key" not in columns:
+            self.db.execute(
+                "ALTER TABLE transactions ADD COLUMN dupe_key INTEGER"
+            )
+        self.db.executescript(self.indexes)
+        self.searchable = self.create_search_index()
+        if migrate:
+            migrate_json_to_sqlite(self.db)
+        self.backfill_dupe_keys()
+        self.category_ids = {
+            name: id for id, name in self.db.execute(
+                "SELECT id, name FROM categories ORDER BY id"
+            )
+        }
+        data["categories"][:] = list(self.category_ids)
+        data["years"][:] = [
+            str(year) for (year,) in self.db.execute(
+                "SELECT year FROM years ORDER BY year"
+            )
+        ]
+        data["transactions"] = []
+
+    def create_search_index(self):
+        # False when this SQLite lacks FTS5 or its trigram tokenizer, and
+        # search() falls back to LIKE
+        exists = self.db.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'descriptions'"
+        ).fetchone()
+        try:
+            self.db.executescript(self.search_schema)
+        except sqlite3.OperationalError:
+            return False
+        if not exists:
+            # rows written before the index existed
+            with self.db:
+                self.db.execute(
+                    "INSERT INTO descriptions (descriptions) VALUES ('rebuild')"
+                )
+        return True
+
+    def backfill_dupe_keys(self, batch_size=100000):
+        # rows migrated or written before dupe_key existed
+        text_hashes = {}
+        def cached_hash(text):
+            if text not in text_hashes:
+                text_hashes[text] = text_hash(text)
+            return text_hashes[text]
+        while True:
+            rows = self.db.execute(
+                "SELECT transactions.id, date, cents, description, name"
+                " FROM transactions"
+                " JOIN categories ON categories.id = transactions.category_id"
+                " WHERE dupe_key IS NULL LIMIT ?",
+                (batch_size,),
+            ).fetchall()
+            if not rows:
+                return
+            ids, dates, cents, descs, cats = zip(*rows)
+            keys = mix_dupe_key(
+                np.array(dates),
+                np.array(cents),
+                np.array(
+                    [ cached_hash(normalize_description(d)) for d in descs ],
+                    dtype=np.uint64,
+                ),
+                np.array(
+                    [ cached_hash(c) for c in cats ],
+                    dtype=np.uint64,
+                ),
+            )
+            with self.db:
+                self.db.executemany(
+                    "UPDATE transactions SET dupe_key = ? WHERE id = ?",
+                    zip(keys.tolist(), ids),
+                )
+
+    def row(self, ta):
+        year, month, day = int(ta["year"]), int(ta["month"]), int(ta["day"])
+        return (
+            self.category_ids[ta["category"]],
+            ta["description"],
+            ta_cents(ta),
+            year,
+            month,
+            day,
+            year * 10000 + month * 100 + day,
+            ta_dupe_key(ta),
+        )
+
+    def save(self):
+        self.db.commit()
+
+    def load_head(self):
+        # load() reads no transactions either
+        pass
+
+    def close(self):
+        self.db.close()
+
+    def flush(self):
+        # every write commits before returning
+        pass
+
+    def poll(self):
+        return []
+
+    def add_cat(self, cat):
+        with self.db:
+            cursor = self.db.execute(
+                "INSERT INTO categories (name) VALUES (?)",
+                (cat,),
+            )
+        self.category_ids[cat] = cursor.lastrowid
+        data["categories"].append(cat)
+
+    def add_ta(self, ta):
+        row = self.row(ta)
+        with self.db:
+            cursor = self.db.execute(self.insert_ta, row)
+            self.db.execute(
+                "INSERT OR IGNORE INTO years (year) VALUES (?)",
+                (int(ta["year"]),),
+            )
+        if self.day_totals is not None:
+            self.day_totals.add(row[6], row[0], row[2])
+        return cursor.lastrowid, add_year(ta["year"])
+
+    def update_ta(self, ta_id, ta):
+        # in place, so the id stays
+        old = self.db.execute(
+            "SELECT date, category_id, cents FROM transactions WHERE id = ?",
+            (ta_id,),
+        ).fetchone()
+        if old is None:
+            raise KeyError(f"no transaction {ta_id}")
+        row = self.row(ta)
+        with self.db:
+            self.db.execute(
+                "UPDATE transactions SET category_id = ?, description = ?,"
+                " cents = ?, year = ?, month = ?, day = ?, date = ?,"
+                " dupe_key = ? WHERE id = ?",
+                row + (ta_id,),
+            )
+            self.db.execute(
+                "INSERT OR IGNORE INTO years (year) VALUES (?)",
+                (int(ta["year"]),),
+            )
+        if self.day_totals is not None:
+            self.day_totals.add(old[0], old[1], -old[2], count=-1)
+            self.day_totals.add(row[6], row[0], row[2])
+        return ta_id, add_year(ta["year"])
+
+    def check_id(self, ta_id):
+        if self.db.execute(
+            "SELECT 1 FROM transactions WHERE id = ?",
+            (ta_id,),
+        ).fetchone() is None:
+            raise KeyError(f"no transaction {ta_id}")
+
+    def delete_ta(self, ta_id):
+        # SQLite keeps freed pages for reuse, much like a tombstone, until
+        # a VACUUM compacts the file
+        old = self.db.execute(
+            "SELECT date, category_id, cents FROM transactions WHERE id = ?",
+            (ta_id,),
+        ).fetchone()
+        if old is None:
+            raise KeyError(f"no transaction {ta_id}")
+        with self.db:
+            self.db.execute("DELETE FROM transactions WHERE id = ?", (ta_id,))
+        if self.day_totals is not None:
+            self.day_totals.add(old[0], old[1], -old[2], count=-1)
+
+    def add_tas(self, tas):
+        rows = [ self.row(ta) for ta in tas ]
+        with self.db:
+            self.db.executemany(self.insert_ta, rows)
+            self.db.executemany(
+                "INSERT OR IGNORE INTO years (year) VALUES (?)",
+                { (row[3],) for row in rows },
+            )
+        if self.day_totals is not None:
+            for row in rows:
+                self.day_totals.add(row[6], row[0], row[2])
+        new_years = []
+        for ta in tas:
+            year_index = add_year(ta["year"])
+            if year_index is not None:
+                new_years.append((ta["year"], year_index))
+        return new_years
+
+    def stats(self, year, month=None, cat=None):
+        sql = "SELECT COUNT(*), COALESCE(SUM(cents), 0) FROM transactions" \
+            + " WHERE year = ?"
+        params = [ year ]
+        if month is not None:
+            sql += " AND month = ?"
+            params.append(month)
+        if cat is not None:
+            if cat not in self.category_ids:
+                return 0, 0
+            sql += " AND category_id = ?"
+            params.append(self.category_ids[cat])
+        return self.db.execute(sql, params).fetchone()
+
+    def range_stats(self, start=None, end=None, cat=None):
+        if self.day_totals is None:
+            # built on first use, so startup stays a read of two tables
+            self.day_totals = DayTotals()
+            rows = self.db.execute(
+                "SELECT year, month, day, category_id, COUNT(*), SUM(cents)"
+                " FROM transactions GROUP BY date, category_id"
+            ).fetchall()
+            years, months, days, cat_ids, counts, cents = \
+                np.array(rows, dtype=np.int64).reshape(-1, 6).T
+            self.day_totals.build(
+                day_numbers(years, months, days),
+                cat_ids,
+                cents,
+                counts,
+            )
+        cat_id = None
+        if cat is not None:
+            if cat not in self.category_ids:
+                return 0, 0
+            cat_id = self.category_ids[cat]
+        return self.day_totals.query(start, end, cat_id)
+
+    def month_sums(self, year=None):
+        sums = [ 0 ] * 12
+        for month, cents in self.db.execute(
+            "SELECT month, SUM(cents) FROM transactions"
+            " WHERE ? IS NULL OR year = ? GROUP BY month",
+            (year, year),
+        ):
+            sums[month - 1] = cents
+        return sums
+
+    def category_sums(self):
+        sums = dict(self.db.execute(
+            "SELECT category_id, SUM(cents) FROM transactions"
+            " GROUP BY category_id"
+        ))
+        return [
+            sums.get(self.category_ids[cat], 0) for cat in data["categories"]
+        ]
+
+    def month_ta_ids(self, year, month):
+        return [
+            ta_id for (ta_id,) in self.db.execute(
+                "SELECT id FROM transactions WHERE year = ? AND month = ?"
+                " ORDER BY day, id",
+                (year, month),
+            )
+        ]
+
+    def iter_tas(self, start=None, end=None, cats=None):
+        # pages by (date, id) instead of holding a cursor open, so rows
+        # added between pages cannot invalidate it
+        sql = "SELECT transactions.id, date, categories.name, description," \
+            " cents, year, month, day FROM transactions" \
+            " JOIN categories ON categories.id = transactions.category_id" \
+            " WHERE (date, transactions.id) > (?, ?)" \
+            " AND date BETWEEN ? AND ?"
+        params = [
+            0 if start is None else start,
+            99999999 if end is None else end,
+        ]
+        if cats is not None:
+            cat_ids = [
+                self.category_ids[cat] for cat in cats
+                if cat in self.category_ids
+            ]
+            sql += " AND category_id IN ({})".format(
+                ", ".join("?" * len(cat_ids))
+            )
+            params += cat_ids
+        sql += " ORDER BY date, transactions.id LIMIT ?"
+        after = (0, 0)
+        while True:
+            rows = self.db.execute(
+                sql,
+                after + tuple(params) + (EXPORT_BATCH_SIZE,),
+            ).fetchall()
+            for _, _, cat, desc, cents, year, month, day in rows:
+                yield {
+                    "category": cat,
+                    "description": desc,
+                    "cents": cents,
+                    "year": str(year),
+                    "month": str(month),
+                    "day": str(day),
+                }
+            if len(rows) < EXPORT_BATCH_SIZE:
+                return
+            after = rows[-1][1], rows[-1][0]
+
+    def search(self, query, start=None, end=None, cats=None):
+        # terms of three bytes or more go through the trigram index, the
+        # rest through LIKE, and text_matches() has the final say so the
+        # results are the same as TextIndex.search()'s
+        terms = query.casefold().split()
+        sql = "SELECT id, description FROM transactions" \
+            " WHERE date BETWEEN ? AND ?"
+        params = [
+            0 if start is None else start,
+            99999999 if end is None else end,
+        ]
+        long_terms = [ term for term in terms if len(term.encode()) >= 3 ]
+        if self.searchable and long_terms:
+            sql += " AND id IN (SELECT rowid FROM descriptions" \
+                " WHERE descriptions MATCH ?)"
+            params.append(" ".join(
+                '"{}"'.format(term.replace('"', '""')) for term in long_terms
+            ))
+        for term in terms:
+            if self.searchable and term in long_terms:
+                continue
+            sql += " AND description LIKE ? ESCAPE '\\'"
+            params.append("%{}%".format(re.sub(r"([%_\\])", r"\\\1", term)))
+        if cats is not None:
+            cat_ids = [
+                self.category_ids[cat] for cat in cats
+                if cat in self.category_ids
+            ]
+            sql += " AND category_id IN ({})".format(
+                ", ".join("?" * len(cat_ids))
+            )
+            params += cat_ids
+        sql += " ORDER BY date, id"
+        return [
+            ta_id for ta_id, desc in self.db.execute(sql, params)
+            if text_matches(desc, terms)
+        ]
+
+    def month_cat_stats(self, start=None, end=None, cats=None):
+        # one row per non-empty cell, so small enough to sort here
+        cat_order = {
+            self.category_ids[cat]: (i, cat)
+            for i, cat in enumerate(data["categories"])
+            if cats is None or cat in cats
+        }
+        rows = self.db.execute(
+            "SELECT year, month, category_id, COUNT(*), SUM(cents)"
+            " FROM transactions WHERE date BETWEEN ? AND ?"
+            " GROUP BY year, month, category_id",
+            (
+                0 if start is None else start // 100 * 100,
+                99999999 if end is None else end // 100 * 100 + 99,
+            ),
+        ).fetchall()
+        rows = [ row for row in rows if row[2] in cat_order ]
+        rows.sort(key=lambda row: (row[0], row[1], cat_order[row[2]][0]))
+        for year, month, cat_id, count, cents in rows:
+            yield year, month, cat_order[cat_id][1], count, cents
+
+    def mark(self):
+        return self.db.execute(
+            "SELECT COALESCE(MAX(id), 0) + 1 FROM transactions"
+        ).fetchone()[0]
+
+    def find_dupe(self, ta, before=None):
+        ta_id = self.db.execute(
+            "SELECT MIN(id) FROM transactions WHERE dupe_key = ?",
+            (ta_dupe_key(ta),),
+        ).fetchone()[0]
+        if ta_id is None or (before is not None and ta_id >= before):
+            return None
+        return ta_id
+
+    def load_year(self, year):
+        pass # read through the indexes
+
+    def get_ta(self, ta_id):
+        cat, desc, cents, year, month, day = self.db.execute(
+            "SELECT categories.name, description, cents, year, month, day"
+            " FROM transactions"
+            " JOIN categories ON categories.id = transactions.category_id"
+            " WHERE transactions.id = ?",
+            (ta_id,),
+        ).fetchone()
+        return {
+            "category": cat,
+            "description": desc,
+            "cents": cents,
+            "year": str(year),
+            "month": str(month),
+            "day": str(day),
+        }
+
+def migrate_json_to_sqlite(db):
+    # DATA_FILE plus its journal, inserted in one transaction and in the
+    # original order so equal days keep their entry order
+    tas = load_compacted(JsonStorage())
+    with db:
+        db.executemany(
+            "INSERT OR IGNORE INTO categories (name) VALUES (?)",
+            [ (cat,) for cat in data["categories"] + tas.categories ],
+        )
+        category_ids = dict(db.execute("SELECT name, id FROM categories"))
+        db.executemany(
+            "INSERT INTO years (year) VALUES (?)",
+            [ (int(year),) for year in data["years"] ],
+        )
+        years = tas.column("years").tolist()
+        months = tas.column("months").tolist()
+        days = tas.column("days").tolist()
+        db.executemany(
+            "INSERT INTO transactions"
+            " (category_id, description, cents, year, month, day, date)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                (
+                    category_ids[tas.categories[cat_id]],
+                    tas.descriptions[desc_id],
+                    cents,
+                    year,
+                    month,
+                    day,
+                    year * 10000 + month * 100 + day,
+                )
+                for year, month, day, cents, cat_id, desc_id in zip(
+                    years,
+                    months,
+                    days,
+                    tas.column("cents").tolist(),
+                    tas.column("cat_ids").tolist(),
+                    tas.column("desc_ids").tolist(),
+                )
+            ),
+        )
+
+class Shard:
+    # one year of ShardedStorage, indexed like JsonStorage indexes all of
+    # data["transactions"], tombstones included
+    def __init__(self, tas, deleted=()):
+        self.tas = tas
+        self.deleted = set(deleted) # rows, see ShardedStorage.shard()
+        self.dirty = False # changed since last written
+        self.date_index = DateIndex()
+        self.date_index.build(tas)
+        self.dupes = DupeIndex()
+        self.dupes.build(tas)
+        self.day_totals = DayTotals()
+        self.day_totals.build_tas(tas)
+        self.text_index = TextIndex()
+        self.text_index.build(tas.descriptions)
+        for i in self.deleted:
+            self.unindex(i)
+
+    def add(self, ta):
+        self.tas.append(ta)
+        i = len(self.tas) - 1
+        self.index(i)
+        self.text_index.update()
+        self.dirty = True
+        return i
+
+    def replace(self, i, ta):
+        self.unindex(i)
+        self.tas.set_row(i, ta)
+        self.index(i)
+        self.text_index.update()
+        self.dirty = True
+
+    def remove(self, i):
+        self.unindex(i)
+        self.deleted.add(i)
+        self.dirty = True
+
+    def index(self, i):
+        tas = self.tas
+        self.date_index.add(tas, i)
+        self.dupes.add(tas, i)
+        self.day_totals.add(
+            row_date(tas, i),
+            int(tas.columns["cat_ids"][i]),
+            int(tas.columns["cents"][i]),
+        )
+
+    def unindex(self, i):
+        tas = self.tas
+        self.date_index.remove(tas, i)
+        self.dupes.remove(tas, i)
+        self.day_totals.add(
+            row_date(tas, i),
+            int(tas.columns["cat_ids"][i]),
+            -int(tas.columns["cents"][i]),
+            count=-1,
+        )
+
+    def live(self):
+        # boolean array of the rows not deleted
+        keep = np.ones(len(self.tas), dtype=bool)
+        keep[list(self.deleted)] = False
+        return keep
+
+class ShardedStorage:
+    # one file per year in SHARDS_DIR plus MANIFEST_FILE with the
+    # categories, the years and each year's month x category totals, so
+    # startup reads the manifest and the current year only; other years
+    # load when first needed and the least recently used are evicted past
+    # SHARD_CACHE_SIZE; transaction ids are year << 32 | row in the year
+    def __init__(self):
+        self.rollup = Rollup() # categories by index in data["categories"]
+        self.category_ids = {}
+        self.shards = collections.OrderedDict() # year => Shard, LRU first
+        self.opened = set() # years loaded before, see shard()
+        self.writer = None
+
+    def load_head(self):
+        # load() reads the manifest and the current year only
+        pass
+
+    def load(self):
+        if not os.path.exists(MANIFEST_FILE) and json_store_exists():
+            migrate_json_to_shards()
+        os.makedirs(SHARDS_DIR, exist_ok=True)
+        manifest = { "categories": [], "years": [], "totals": {} }
+        try:
+            with open(MANIFEST_FILE, "r") as file:
+                manifest = json.load(file)
+        except FileNotFoundError:
+            pass
+        data["categories"][:] = manifest["categories"]
+        data["years"][:] = manifest["years"]
+        self.category_ids = {
+            cat: i for i, cat in enumerate(data["categories"])
+        }
+        self.rollup = Rollup()
+        self.rollup.reserve(0, len(data["categories"]))
+        for year, totals in manifest["totals"].items():
+            self.rollup.set_year(
+                int(year),
+                np.array(totals["counts"], dtype=np.int64).reshape(12, -1),
+                np.array(totals["cents"], dtype=np.int64).reshape(12, -1),
+            )
+        self.shards.clear()
+        self.writer = JsonWriter()
+        self.writer.start()
+        self.load_year(datetime.date.today().year)
+
+    def shard(self, year):
+        if year in self.shards:
+            self.shards.move_to_end(year)
+            return self.shards[year]
+        start = time.perf_counter()
+        # an evicted shard may still be on its way to the file
+        self.flush()
+        loaded = { "transactions": [] }
+        try:
+            with open(shard_file(year), "r") as file:
+                loaded = json.load(file)
+        except FileNotFoundError:
+            pass
+        tas = loaded["transactions"]
+        deleted = loaded.get("deleted", [])
+        compact = deleted and year not in self.opened
+        if compact:
+            # no ids of the year are out yet the first time it loads, so
+            # its tombstones can go; later loads keep them, rows and all
+            dropped = set(deleted)
+            tas = [ ta for i, ta in enumerate(tas) if i not in dropped ]
+            deleted = []
+        self.opened.add(year)
+        shard = Shard(TaStore.from_json(tas), deleted)
+        shard.dirty = bool(compact) or any( "cents" not in ta for ta in tas )
+        del tas, loaded
+        self.shards[year] = shard
+        self.sync_totals(year, shard)
+        report_timing(f"load shard {year}", time.perf_counter() - start)
+        while len(self.shards) > SHARD_CACHE_SIZE:
+            old_year, old_shard = self.shards.popitem(last=False)
+            if old_shard.dirty:
+                self.write_shard(old_year, old_shard)
+        return shard
+
+    def sync_totals(self, year, shard):
+        # the shard wins over the manifest, which a crash between their
+        # writes can leave behind
+        tas = shard.tas
+        if not len(tas) and year not in self.rollup.year_ids:
+            return
+        for cat in tas.categories:
+            if cat not in self.category_ids:
+                self.add_cat(cat)
+        shape = (12, len(data["categories"]))
+        cat_ids = np.array(
+            [ self.category_ids[cat] for cat in tas.categories ],
+            dtype=np.int64,
+        )
+        keep = shard.live()
+        keys = np.ravel_multi_index(
+            (
+                tas.column("months")[keep] - 1,
+                cat_ids[tas.column("cat_ids")[keep]],
+            ),
+            shape,
+        )
+        self.rollup.set_year(
+            year,
+            *group_by(keys, tas.column("cents")[keep], shape),
+        )
+
+    def load_year(self, year):
+        if str(year) in data["years"]:
+            self.shard(int(year))
+
+    def write_shard(self, year, shard):
+        self.writer.submit((
+            "file",
+            shard_file(year),
+            { "year": year, "deleted": sorted(shard.deleted) },
+            shard.tas.view(),
+        ))
+        shard.dirty = False
+
+    def write_manifest(self):
+        self.writer.submit((
+            "file",
+            MANIFEST_FILE,
+            manifest_head(self.rollup),
+            None,
+        ))
+
+    def save(self):
+        for year, shard in self.shards.items():
+            if shard.dirty:
+                self.write_shard(year, shard)
+        self.write_manifest()
+
+    def close(self):
+        for year, shard in self.shards.items():
+            if shard.dirty:
+                self.write_shard(year, shard)
+        self.writer.stop()
+
+    def flush(self):
+        self.writer.jobs.join()
+
+    def poll(self):
+        return self.writer.poll()
+
+    def add_cat(self, cat):
+        self.category_ids[cat] = len(data["categories"])
+        data["categories"].append(cat)
+        self.rollup.reserve(len(self.rollup.years), len(data["categories"]))
+        self.write_manifest()
+
+    def apply(self, ta):
+        year = int(ta["year"])
+        row = self.shard(year).add(ta)
+        self.rollup.add_cell(
+            year,
+            int(ta["month"]),
+            self.category_ids[ta["category"]],
+            ta_cents(ta),
+        )
+        return year << 32 | row, add_year(ta["year"])
+
+    def add_ta(self, ta):
+        # rewrites this year's file only, plus the manifest
+        ta_id, year_index = self.apply(ta)
+        self.write_shard(int(ta["year"]), self.shards[int(ta["year"])])
+        self.write_manifest()
+        return ta_id, year_index
+
+    def update_ta(self, ta_id, ta):
+        # in place within a year; moving it to another year gives it an id
+        # in that year instead
+        year, row = ta_id >> 32, ta_id & 0xFFFFFFFF
+        shard = self.check_id(ta_id)
+        if int(ta["year"]) != year:
+            self.delete_ta(ta_id)
+            return self.add_ta(ta)
+        self.uncount(year, shard, row)
+        shard.replace(row, ta)
+        self.rollup.add_cell(
+            year,
+            int(ta["month"]),
+            self.category_ids[ta["category"]],
+            ta_cents(ta),
+        )
+        self.write_shard(year, shard)
+        self.write_manifest()
+        return ta_id, None
+
+    def delete_ta(self, ta_id):
+        year, row = ta_id >> 32, ta_id & 0xFFFFFFFF
+        shard = self.check_id(ta_id)
+        self.uncount(year, shard, row)
+        shard.remove(row)
+        self.write_shard(year, shard)
+        self.write_manifest()
+
+    def check_id(self, ta_id):
+        year, row = ta_id >> 32, ta_id & 0xFFFFFFFF
+        if str(year) not in data["years"]:
+            raise KeyError(f"no transaction {ta_id}")
+        shard = self.shard(year)
+        if row in shard.deleted or not 0 <= row < len(shard.tas):
+            raise KeyError(f"no transaction {ta_id}")
+        return shard
+
+    def uncount(self, year, shard, row):
+        # the row out of the manifest totals
+        tas = shard.tas
+        self.rollup.add_cell(
+            year,
+            int(tas.columns["months"][row]),
+            self.category_ids[tas.categories[tas.columns["cat_ids"][row]]],
+            -int(tas.columns["cents"][row]),
+            count=-1,
+        )
+
+    def add_tas(self, tas):
+        # written by the save() import_statement() ends with, or on eviction
+        new_years = []
+        for ta in tas:
+            _, year_index = self.apply(ta)
+            if year_index is not None:
+                new_years.append((ta["year"], year_index))
+        return new_years
+
+    def stats(self, year, month=None, cat=None):
+        cat_id = None
+        if cat is not None:
+            if cat not in self.category_ids:
+                return 0, 0
+            cat_id = self.category_ids[cat]
+        return self.rollup.query(year, month, cat_id)
+
+    def range_stats(self, start=None, end=None, cat=None):
+        # whole years come from the totals, so only the years the range
+        # starts and ends in need loading
+        if cat is not None and cat not in self.category_ids:
+            return 0, 0
+        count = cents = 0
+        for year in self.rollup.years:
+            first, last = year * 10000 + 101, year * 10000 + 1231
+            if (start is not None and start > last) \
+                    or (end is not None and end < first):
+                continue
+            if (start is None or start <= first) \
+                    and (end is None or end >= last):
+                year_count, year_cents = self.rollup.query(
+                    year,
+                    cat_id=None if cat is None else self.category_ids[cat],
+                )
+            else:
+                shard = self.shard(year)
+                if cat is not None and cat not in shard.tas.category_ids:
+                    continue
+                year_count, year_cents = shard.day_totals.query(
+                    start,
+                    end,
+                    None if cat is None else shard.tas.category_ids[cat],
+                )
+            count += year_count
+            cents += year_cents
+        return count, cents
+
+    def month_sums(self, year=None):
+        return self.rollup.month_sums(year)
+
+    def category_sums(self):
+        return self.rollup.sums.sum(axis=(0, 1)).tolist()
+
+    def month_ta_ids(self, year, month):
+        return [
+            year << 32 | row
+            for row in self.shard(year).date_index.lookup(year, month)
+        ]
+
+    def iter_tas(self, start=None, end=None, cats=None):
+        for year in sorted(self.rollup.years):
+            if start is not None and start > year * 10000 + 1231 \
+                    or end is not None and end < year * 10000 + 101:
+                continue
+            shard = self.shard(year)
+            for _, ta in iter_index_tas(
+                shard.tas,
+                shard.date_index,
+                start,
+                end,
+                cats,
+            ):
+                yield ta
+
+    def month_cat_stats(self, start=None, end=None, cats=None):
+        return rollup_month_cat_stats(
+            self.rollup,
+            self.category_ids,
+            start,
+            end,
+            cats,
+        )
+
+    def search(self, query, start=None, end=None, cats=None):
+        # year by year like iter_tas(), so older years load as needed
+        ta_ids = []
+        for year in sorted(self.rollup.years):
+            if start is not None and start > year * 10000 + 1231 \
+                    or end is not None and end < year * 10000 + 101:
+                continue
+            shard = self.shard(year)
+            ta_ids += [
+                year << 32 | row for row in search_rows(
+                    shard.tas,
+                    shard.text_index,
+                    query,
+                    start,
+                    end,
+                    cats,
+                    shard.deleted,
+                ).tolist()
+            ]
+        return ta_ids
+
+    def mark(self):
+        # rows per year, see find_dupe(); deleted rows keep their row once
+        # a year has loaded, while a year loading for the first time drops
+        # them, so until then its live count is its row count
+        return {
+            year: len(self.shard(year).tas) if year in self.opened
+                else int(self.rollup.counts[y].sum())
+            for year, y in self.rollup.year_ids.items()
+        }
+
+    def find_dupe(self, ta, before=None):
+        year = int(ta["year"])
+        row = self.shard(year).dupes.lookup(ta_dupe_key(ta))
+        if row is None or (before is not None and row >= before.get(year, 0)):
+            return None
+        return year << 32 | row
+
+    def get_ta(self, ta_id):
+        return self.shard(ta_id >> 32).tas.row(ta_id & 0xFFFFFFFF)
+
+def shard_file(year):
+    return os.path.join(SHARDS_DIR, f"{year}.json")
+
+def manifest_head(rollup):
+    return {
+        "categories": list(data["categories"]),
+        "years": list(data["years"]),
+        "totals": {
+            str(year): {
+                "counts": rollup.counts[y].tolist(),
+                "cents": rollup.sums[y].tolist(),
+            }
+            for year, y in rollup.year_ids.items()
+        },
+    }
+
+def migrate_json_to_shards():
+    # DATA_FILE plus its journal, split by year in the original order so
+    # equal days keep their entry order
+    tas = load_compacted(JsonStorage())
+    for cat in tas.categories:
+        if cat not in data["categories"]:
+            data["categories"].append(cat)
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+    rollup = Rollup()
+    years = tas.column("years")
+    for year in np.unique(years).tolist():
+        rows = np.flatnonzero(years == year).tolist()
+        write_json_file(
+            shard_file(year),
+            { "year": year },
+            ( tas.row(i) for i in rows ),
+        )
+        shape = (12, len(data["categories"]))
+        cat_ids = np.array(
+            [ data["categories"].index(cat) for cat in tas.categories ],
+            dtype=np.int64,
+        )
+        keys = np.ravel_multi_index(
+            (
+                tas.columns["months"][rows] - 1,
+                cat_ids[tas.columns["cat_ids"][rows]],
+            ),
+            shape,
+        )
+        rollup.set_year(
+            year,
+            *group_by(keys, tas.columns["cents"][rows], shape),
+        )
+    write_json_file(MANIFEST_FILE, manifest_head(rollup))
+    data["transactions"] = []
+
+class BinaryStorage(JsonStorage):
+    # JsonStorage with BINARY_FILE as the snapshot, which is mapped rather
+    # than parsed and also holds the rollup, date index, duplicate keys and
+    # day totals, so loading does not grow with the transactions
+    journal_file = BINARY_JOURNAL_FILE
+
+    def new_writer(self):
+        return BinaryWriter(self.journal_file)
+
+    def read_head(self):
+        if not os.path.exists(BINARY_FILE):
+            return JsonStorage.read_head(self)
+        return read_binary_snapshot(BINARY_FILE)[0]
+
+    def load_snapshot(self):
+        if not os.path.exists(BINARY_FILE) and json_store_exists():
+            convert_json_to_binary()
+        if not os.path.exists(BINARY_FILE):
+            JsonStorage.load_snapshot(self)
+            return
+        head, sections = read_binary_snapshot(BINARY_FILE)
+        data["categories"][:] = head["categories"]
+        data["years"][:] = head["years"]
+        tas = TaStore.from_snapshot(
+            sections["records"],
+            head["size"],
+            head["store_categories"],
+            HeapStrings(sections["desc_offsets"], sections["heap"]),
+        )
+        data["transactions"] = tas
+        self.journal_seq = head["seq"]
+        self.journal_len = 0
+        # the small ones are copied, as they change in place
+        self.rollup.years = list(head["rollup_years"])
+        self.rollup.year_ids = {
+            year: i for i, year in enumerate(self.rollup.years)
+        }
+        self.rollup.counts = sections["rollup_counts"].copy()
+        self.rollup.sums = sections["rollup_sums"].copy()
+        self.date_index.load(sections["date_order"], {
+            tuple(bucket[:2]): bucket[2:] for bucket in head["date_buckets"]
+        })
+        self.dupes.build(tas, sections["dupe_keys"], lazy=True)
+        self.day_totals.first_day = head["day_first"]
+        self.day_totals.counts = sections["day_counts"].copy()
+        self.day_totals.sums = sections["day_sums"].copy()
+
+class BinaryWriter(JsonWriter):
+    def write_snapshot(self, head, tas, hash_tables):
+        write_binary_snapshot(BINARY_FILE, head, tas, hash_tables)
+        open(self.journal_file, "w").close()
+
+BINARY_MAGIC = b"EXPTRK1\n"
+BINARY_RECORD = np.dtype([
+    (name, dtype) for name, dtype in TaStore.column_types.items()
+]) # 20 bytes, packed
+
+def write_binary_snapshot(path, head, tas, hash_tables):
+    # BINARY_MAGIC, the length of a JSON header as 8 bytes little endian,
+    # the header, then 8-byte aligned sections the header lists as
+    # [ name, offset, dtype, shape ], with offsets counted from the end of
+    # the header; records have spare capacity so appends after loading
+    # only copy the pages they touch
+    n = len(tas)
+    records = np.zeros(n + max(1024, n // 8), dtype=BINARY_RECORD)
+    for name in TaStore.column_types:
+        records[name][:n] = tas.column(name)
+    encoded = [ desc.encode() for desc in tas.descriptions ]
+    desc_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([ len(desc) for desc in encoded ], out=desc_offsets[1:])
+    heap = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    del encoded
+    rollup = Rollup()
+    rollup.build(tas)
+    years = tas.column("years")
+    months = tas.column("months")
+    date_order = np.lexsort((tas.column("days"), months, years)) \
+        .astype(np.int32)
+    keys = years[date_order].astype(np.int32) * 16 + months[date_order]
+    bounds = np.concatenate(
+        ([ 0 ], np.flatnonzero(np.diff(keys)) + 1, [ n ])
+    ).tolist()
+    date_buckets = [ # [ year, month, start, stop ] in date_order
+        [
+            int(years[date_order[start]]),
+            int(months[date_order[start]]),
+            start,
+            stop,
+        ]
+        for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start
+    ]
+    day_totals = DayTotals()
+    day_totals.build_tas(tas)
+    sections = {
+        "records": records,
+        "desc_offsets": desc_offsets,
+        "heap": heap,
+        "rollup_counts": rollup.counts,
+        "rollup_sums": rollup.sums,
+        "date_order": date_order,
+        "dupe_keys": dupe_keys(tas, 0, n, *hash_tables),
+        "day_counts": day_totals.counts,
+        "day_sums": day_totals.sums,
+    }
+    head = dict(
+        head,
+        size=n,
+        store_categories=list(tas.categories),
+        rollup_years=rollup.years,
+        date_buckets=date_buckets,
+        day_first=day_totals.first_day,
+        sections=[],
+    )
+    offset = 0
+    for name, array in sections.items():
+        head["sections"].append(
+            [ name, offset, array.dtype.descr, list(array.shape) ]
+        )
+        offset += -(-array.nbytes // 8) * 8
+    header = json.dumps(head).encode()
+    header += b" " * (-len(header) % 8)
+    tmp_file = path + ".tmp"
+    with open(tmp_file, "wb") as file:
+        file.write(BINARY_MAGIC)
+        file.write(len(header).to_bytes(8, "little"))
+        file.write(header)
+        for array in sections.values():
+            file.write(array.tobytes())
+            file.write(b"\0" * (-array.nbytes % 8))
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_file, path)
+
+def read_binary_snapshot(path):
+    # (header, { name: array }) with every array a copy-on-write view of
+    # the mapped file, so nothing is read until it is used
+    with open(path, "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    if mapped[:len(BINARY_MAGIC)] != BINARY_MAGIC:
+        raise ValueError(f"{path} is not a binary snapshot")
+    header_len = int.from_bytes(mapped[8:16], "little")
+    head = json.loads(mapped[16:16 + header_len])
+    base = 16 + header_len
+    sections = {}
+    for name, offset, descr, shape in head["sections"]:
+        # descr is [ [ "", type ] ] for plain arrays
+        dtype = np.dtype(descr[0][1]) if descr[0][0] == "" \
+            else np.dtype([ tuple(field) for field in descr ])
+        sections[name] = np.frombuffer(
+            mapped,
+            dtype=dtype,
+            count=int(np.prod(shape)),
+            offset=base + offset,
+        ).reshape(shape)
+    return head, sections
+
+def convert_json_to_binary():
+    # DATA_FILE plus its journal into BINARY_FILE, with an empty
+    # BINARY_JOURNAL_FILE
+    load_compacted(JsonStorage())
+    binary_storage = BinaryStorage()
+    binary_storage.writer = binary_storage.new_writer()
+    binary_storage.writer.start()
+    binary_storage.save()
+    binary_storage.close()
+    check_writes(binary_storage)
+
+def convert_binary_to_json():
+    # BINARY_FILE plus its journal into DATA_FILE, with an empty
+    # JOURNAL_FILE
+    load_compacted(BinaryStorage())
+    json_storage = JsonStorage()
+    json_storage.writer = json_storage.new_writer()
+    json_storage.writer.start()
+    json_storage.save()
+    json_storage.close()
+    check_writes(json_storage)
+
+def json_store_exists():
+    # a store that never reached JOURNAL_COMPACT_THRESHOLD changes only
+    # has a journal
+    return os.path.exists(DATA_FILE) or os.path.exists(JOURNAL_FILE)
+
+def load_compacted(storage):
+    # storage loaded and closed again, leaving data["transactions"] without
+    # its deleted rows for a migration to copy
+    storage.load()
+    storage.close()
+    data["transactions"] = storage.compacted()[0]
+    return data["transactions"]
+
+def check_writes(storage):
+    for jobs, seconds, error in storage.poll():
+        if error:
+            raise error
+
+class RemoteStorage:
+    # the store a server.py on this machine owns, so several windows and
+    # scripts can share it; only the categories and years live here, kept
+    # in step with this client's own changes
+    def __init__(self, address=SERVER_ADDRESS):
+        host, port = address.rsplit(":", 1)
+        self.host, self.port = host.strip("[]"), int(port)
+        self.connection = self.connect()
+        self.lock = threading.Lock() # the loader thread shares connection
+
+    def connect(self):
+        return http.client.HTTPConnection(
+            self.host,
+            self.port,
+            timeout=SERVER_TIMEOUT,
+        )
+
+    def request(self, method, path, params=None, body=None):
+        # the decoded JSON answer; KeyError for 404, ValueError for other
+        # refusals and OSError when the server cannot be reached
+        if params:
+            path += "?" + urllib.parse.urlencode(params, doseq=True)
+        headers = {}
+        if body is not None:
+            body = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        with self.lock:
+            for attempt in range(2):
+                try:
+                    self.connection.request(method, path, body, headers)
+                    response = self.connection.getresponse()
+                    payload = response.read()
+                    break
+                except (http.client.RemoteDisconnected, BrokenPipeError):
+                    # a restarted server drops the kept-alive connection
+                    # before reading the request, so it is safe to resend
+                    self.connection.close()
+                    self.connection = self.connect()
+                    if attempt:
+                        raise
+        answer = json.loads(payload) if payload else None
+        if response.status == 404:
+            raise KeyError(answer["error"])
+        if response.status != 200:
+            raise ValueError(answer["error"])
+        return answer
+
+    def load_head(self):
+        head = self.request("GET", "/head")
+        data["categories"][:] = head["categories"]
+        data["years"][:] = head["years"]
+
+    def load(self):
+        self.load_head()
+
+    def save(self):
+        self.request("POST", "/save")
+
+    def close(self):
+        self.connection.close()
+
+    def flush(self):
+        self.request("POST", "/flush")
+
+    def poll(self):
+        return [] # the server writes, and reports failures, itself
+
+    def add_cat(self, cat):
+        self.request("POST", "/categories", body={ "name": cat })
+        data["categories"].append(cat)
+
+    def add_ta(self, ta):
+        answer = self.request("POST", "/transactions", body=ta)
+        return answer["id"], add_year(ta["year"])
+
+    def add_tas(self, tas):
+        self.request("POST", "/transactions/batch", body=tas)
+        new_years = []
+        for ta in tas:
+            year_index = add_year(ta["year"])
+            if year_index is not None:
+                new_years.append((ta["year"], year_index))
+        return new_years
+
+    def update_ta(self, ta_id, ta):
+        answer = self.request("PUT", f"/transactions/{ta_id}", body=ta)
+        return answer["id"], add_year(ta["year"])
+
+    def delete_ta(self, ta_id):
+        self.request("DELETE", f"/transactions/{ta_id}")
+
+    def check_id(self, ta_id):
+        self.get_ta(ta_id)
+
+    def get_ta(self, ta_id):
+        return self.request("GET", f"/transactions/{ta_id}")
+
+    def stats(self, year, month=None, cat=None):
+        return tuple(self.request("GET", "/stats", query_params(
+            year=year,
+            month=month,
+            category=cat,
+        )))
+
+    def range_stats(self, start=None, end=None, cat=None):
+        return tuple(self.request("GET", "/range", query_params(
+            start=start,
+            end=end,
+            category=cat,
+        )))
+
+    def month_sums(self, year=None):
+        return self.request("GET", "/month-sums", query_params(year=year))
+
+    def category_sums(self):
+        # by name, as the server may know categories this client does not
+        sums = self.request("GET", "/category-sums")
+        return [ sums.get(cat, 0) for cat in data["categories"] ]
+
+    def month_ta_ids(self, year, month):
+        return self.request("GET", "/month", query_params(
+            year=year,
+            month=month,
+        ))
+
+    def iter_tas(self, start=None, end=None, cats=None):
+        # JSON Lines on a connection of its own, as the caller may make
+        # other requests between rows
+        connection = self.connect()
+        try:
+            query = urllib.parse.urlencode(
+                query_params(start=start, end=end, category=cats),
+                doseq=True,
+            )
+            connection.request("GET", "/transactions?" + query)
+            response = connection.getresponse()
+            if response.status != 200:
+                raise ValueError(json.loads(response.read())["error"])
+            for line in response:
+                yield json.loads(line)
+        finally:
+            connection.close()
+
+    def month_cat_stats(self, start=None, end=None, cats=None):
+        return self.request("GET", "/month-cat-stats", query_params(
+            start=start,
+            end=end,
+            category=cats,
+        ))
+
+    def search(self, query, start=None, end=None, cats=None):
+        return self.request("GET", "/search", query_params(
+            q=query,
+            start=start,
+            end=end,
+            category=cats,
+        ))
+
+    def mark(self):
+        return self.request("GET", "/mark")
+
+    def find_dupe(self, ta, before=None):
+        return self.request("POST", "/dupes", body={
+            "transaction": ta,
+            "before": before,
+        })
+
+    def load_year(self, year):
+        pass # the server loads what it needs
+
+def query_params(**params):
+    # the ones given, for RemoteStorage.request(); sets become lists
+    return {
+        name: sorted(value) if isinstance(value, ( set, frozenset )) \
+            else value
+        for name, value in params.items()
+        if value is not None
+    }
+
+def new_storage():
+    if STORAGE == "remote":
+        return RemoteStorage()
+    if STORAGE == "sqlite":
+        return SqliteStorage()
+    if STORAGE == "shards":
+        return ShardedStorage()
+    if STORAGE == "binary":
+        return BinaryStorage()
+    return JsonStorage()
+
+@instrumented
+def load_data():
+    global storage
+    storage = new_storage()
+    storage.load()
+    forget_charts()
+    apply_pending()
+
+class Loader(threading.Thread):
+    # runs storage.load() off the Tk thread, see load_data_in_background()
+    def __init__(self):
+        threading.Thread.__init__(self, daemon=True)
+        self.start_time = time.perf_counter()
+        self.categories = list(data["categories"])
+        self.years = list(data["years"])
+        self.error = None
+
+    def run(self):
+        try:
+            storage.load()
+        except Exception as e:
+            self.error = e
+
+@instrumented
+def load_data_in_background():
+    # categories and years now, the transactions on a thread; until
+    # finish_loading() returns True only record_ta() may be called, and it
+    # sets the transaction aside in PENDING_FILE
+    global storage, loader
+    storage = new_storage()
+    storage.load_head()
+    loader = Loader()
+    loader.start()
+
+def is_loading():
+    return loader is not None
+
+def finish_loading(wait=False):
+    # True once loaded, with "cat_added" and "year_added" sent for what
+    # load_head() did not see and the pending transactions recorded
+    global loader
+    if loader is None:
+        return True
+    if loader.is_alive() and not wait:
+        return False
+    loader.join()
+    done, loader = loader, None
+    if done.error:
+        raise done.error
+    forget_charts()
+    report_timing("load_data", time.perf_counter() - done.start_time)
+    for i, cat in enumerate(data["categories"]):
+        if cat not in done.categories:
+            notify("cat_added", cat, i)
+    for i, year in enumerate(data["years"]):
+        if year not in done.years:
+            notify("year_added", year, i)
+    apply_pending()
+    notify("data_loaded")
+    return True
+
+@instrumented
+def apply_pending():
+    # records what record_ta() set aside while loading; the file goes only
+    # once those writes are on disk
+    try:
+        with open(PENDING_FILE, "r") as file:
+            lines = file.readlines()
+    except FileNotFoundError:
+        return
+    for line in lines:
+        try:
+            if not line.endswith("\n"):
+                raise ValueError("torn pending transaction")
+            ta = json.loads(line)
+        except ValueError:
+            break
+        record_ta(ta)
+    storage.flush()
+    os.remove(PENDING_FILE)
+
+@instrumented
+def save_data():
+    storage.save()
+
+@instrumented
+def close_data():
+    finish_loading(wait=True)
+    storage.close()
+
+def poll_writes():
+    if loader is not None:
+        return
+    for jobs, seconds, error in storage.poll():
+        report_timing("write", seconds)
+        notify("write_done", jobs, seconds, error)
+
+@instrumented
+def record_ta(ta):
+    if loader is not None:
+        with open(PENDING_FILE, "a") as file:
+            file.write(json.dumps(ta) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        return
+    ta_id, year_index = storage.add_ta(ta)
+    forget_charts(int(ta["year"]))
+    if year_index is not None:
+        notify("year_added", ta["year"], year_index)
+    notify("ta_added", ta_id)
+
+@instrumented
+def update_ta(ta_id, ta):
+    # replaces transaction ta_id with ta and returns its id, the same one
+    # unless the shards storage had to move it to another year; KeyError
+    # for ids that were never stored or are deleted
+    storage.check_id(ta_id)
+    old_year = int(get_ta(ta_id)["year"])
+    new_id, year_index = storage.update_ta(ta_id, ta)
+    forget_charts(old_year)
+    forget_charts(int(ta["year"]))
+    if year_index is not None:
+        notify("year_added", ta["year"], year_index)
+    notify("ta_updated", ta_id, new_id)
+    return new_id
+
+@instrumented
+def delete_ta(ta_id):
+    storage.check_id(ta_id)
+    forget_charts(int(get_ta(ta_id)["year"]))
+    storage.delete_ta(ta_id)
+    notify("ta_deleted", ta_id)
+
+@instrumented
+def record_cat(cat):
+    storage.add_cat(cat)
+    forget_charts()
+    notify("cat_added", cat, len(data["categories"]) - 1)
+
+@instrumented
+def record_tas(tas):
+    for year, year_index in storage.add_tas(tas):
+        notify("year_added", year, year_index)
+    forget_charts()
+    notify("tas_imported", len(tas))
+
+def import_statement(path, default_cat="Imported"):
+    # generator that imports a CSV or OFX statement one batch at a time,
+    # yielding progress after each batch and a summary once done
+    start = time.perf_counter()
+    result = {
+        "done": False,
+        "rows": 0,
+        "skipped": 0,
+        "duplicates": 0,
+        "errors": [],
+    }
+    batch = []
+    # rows already stored before this import started count as duplicates,
+    # repeated rows within the statement itself are kept
+    mark = storage.mark()
+    if path.lower().endswith(( ".ofx", ".qfx" )):
+        read_statement = read_ofx_statement
+    else:
+        read_statement = read_csv_statement
+    applied = False
+    try:
+        with open(path, newline="", encoding="utf-8-sig", errors="replace") \
+                as file:
+            for line, fields in read_statement(file):
+                ta, errmsg = statement_ta(fields, default_cat)
+                if errmsg:
+                    result["skipped"] += 1
+                    if len(result["errors"]) < 10:
+                        result["errors"].append(f"Line {line}: {errmsg}")
+                    continue
+                if storage.find_dupe(ta, before=mark) is not None:
+                    result["duplicates"] += 1
+                    continue
+                if ta["category"] not in data["categories"]:
+                    record_cat(ta["category"])
+                batch.append(ta)
+                if len(batch) == IMPORT_BATCH_SIZE:
+                    applied = True
+                    record_tas(batch)
+                    result["rows"] += len(batch)
+                    batch = []
+                    yield result
+        if batch:
+            applied = True
+            record_tas(batch)
+            result["rows"] += len(batch)
+    finally:
+        # one persistence step for the whole file; batches skip the journal,
+        # so it also runs when reading fails or the import is closed part
+        # way, or the rows applied so far would be lost
+        if applied:
+            save_data()
+    seconds = time.perf_counter() - start
+    report_timing("import", seconds)
+    result["done"] = True
+    result["rate"] = result["rows"] / seconds
+    yield result
+
+def statement_ta(fields, default_cat):
+    # validates one statement row with the entry form's rules
+    cat = fields.get("category") or default_cat
+    errmsg = check_ta(fields.get("description"), fields.get("amount", ""))
+    if not errmsg and cat not in data["categories"]:
+        errmsg = check_valid_str(cat)
+    if errmsg:
+        return None, errmsg
+    date = None
+    for date_format in ( "%Y-%m-%d", "%Y%m%d", "%m/%d/%Y", "%m/%d/%y" ):
+        try:
+            date = datetime.datetime.strptime(fields.get("date"), date_format)
+            break
+        except (TypeError, ValueError):
+            pass
+    if date is None:
+        return None, f"Unrecognized date {fields.get('date')!r}!"
+    return {
+        "category": cat,
+        "description": fields["description"],
+        "cents": parse_cents(fields["amount"]),
+        "year": str(date.year),
+        "month": str(date.month),
+        "day": str(date.day),
+    }, ""
+
+def read_csv_statement(file):
+    # needs date, description and amount columns, category is optional
+    reader = csv.reader(file)
+    header = [ name.strip().lower() for name in next(reader, []) ]
+    for row in reader:
+        if row:
+            yield reader.line_num, {
+                name: value.strip() for name, value in zip(header, row)
+            }
+
+OFX_TAG = re.compile(r"<(/?)(\w+)>([^<\r\n]*)")
+
+def read_ofx_statement(file):
+    # OFX 1.x is SGML without closing tags, so read <TAG>value pairs from
+    # each line rather than parsing the file as XML
+    fields = None
+    for line_num, line in enumerate(file, start=1):
+        for close, tag, value in OFX_TAG.findall(line):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                if close and fields is not None:
+                    yield line_num, fields
+                fields = None if close else {}
+            elif fields is not None and not close:
+                if tag == "DTPOSTED":
+                    fields["date"] = value.strip()[:8]
+                elif tag == "TRNAMT":
+                    # debits are negative in OFX but expenses are positive
+                    amount = value.strip().lstrip("+")
+                    fields["amount"] = amount[1:] \
+                        if amount.startswith("-") else "-" + amount
+                elif tag == "NAME" \
+                        or (tag == "MEMO" and "description" not in fields):
+                    fields["description"] = value.strip()
+
+EXPORT_FIELDS = {
+    "transactions": [
+        "year", "month", "day", "category", "description", "amount",
+    ],
+    "monthly": [ "year", "month", "category", "count", "amount" ],
+}
+
+def export_data(path, kind="transactions", start=None, end=None, cats=None):
+    # generator that streams transactions, or the month x category totals,
+    # to CSV or to JSON Lines one row at a time, yielding progress after
+    # each batch and a summary once done; start and end are dates as
+    # year * 10000 + month * 100 + day and cats a set of category names,
+    # None meaning no limit
+    start_time = time.perf_counter()
+    result = { "done": False, "rows": 0 }
+    with open(path, "w", newline="", encoding="utf-8") as file:
+        if path.lower().endswith(( ".jsonl", ".json" )):
+            write_row = lambda row: file.write(json.dumps(row) + "\n")
+        else:
+            writer = csv.DictWriter(file, fieldnames=EXPORT_FIELDS[kind])
+            writer.writeheader()
+            write_row = writer.writerow
+        for row in export_rows(kind, start, end, cats):
+            write_row(row)
+            result["rows"] += 1
+            if result["rows"] % EXPORT_BATCH_SIZE == 0:
+                yield result
+    seconds = time.perf_counter() - start_time
+    report_timing("export", seconds)
+    result["done"] = True
+    result["rate"] = result["rows"] / seconds if seconds else 0.0
+    yield result
+
+def export_rows(kind, start=None, end=None, cats=None):
+    if kind == "transactions":
+        for ta in storage.iter_tas(start, end, cats):
+            ta["amount"] = cents_to_str(ta["cents"])
+            yield { field: ta[field] for field in EXPORT_FIELDS[kind] }
+        return
+    # totals cover every month the date range touches
+    for year, month, cat, count, cents in \
+            storage.month_cat_stats(start, end, cats):
+        yield {
+            "year": year,
+            "month": month,
+            "category": cat,
+            "count": count,
+            "amount": cents_to_str(cents),
+        }
+
+def month_in_range(year, month, start=None, end=None):
+    return (start is None or year * 100 + month >= start // 100) \
+        and (end is None or year * 100 + month <= end // 100)
+
+def parse_date(text):
+    # YYYY-MM-DD as year * 10000 + month * 100 + day, None when blank
+    if not text.strip():
+        return None
+    date = datetime.datetime.strptime(text.strip(), "%Y-%m-%d")
+    return date.year * 10000 + date.month * 100 + date.day
+
+def query_stats(year, month=None, cat=None):
+    # (count, cents)
+    if not year:
+        return 0, 0
+    count, cents = storage.stats(int(year), month, cat)
+    return int(count), int(cents)
+
+def query_range(start=None, end=None, cat=None):
+    # (count, cents), start and end are dates as from parse_date(), both
+    # included
+    count, cents = storage.range_stats(start, end, cat)
+    return int(count), int(cents)
+
+def row_date(tas, i):
+    # ta_date() of row i of a TaStore
+    return int(tas.columns["years"][i]) * 10000 \
+        + int(tas.columns["months"][i]) * 100 + int(tas.columns["days"][i])
+
+def ta_date(ta):
+    return int(ta["year"]) * 10000 + int(ta["month"]) * 100 + int(ta["day"])
+
+def query_average(year, month=None, cat=None):
+    # cents, None without transactions to average
+    count, total = query_stats(year, month, cat)
+    if count == 0:
+        return None
+    return average_cents(total, count)
+
+def average_cents(total, count):
+    # rounded half up, in integers so no float creeps in
+    quotient, remainder = divmod(total, count)
+    return quotient + (2 * remainder >= count)
+
+def load_year(year):
+    # loads a year's transactions ahead of queries, for storages that
+    # keep only some years in memory
+    storage.load_year(year)
+
+def month_ta_ids(year, month):
+    # in date order, then in the order they were added
+    return storage.month_ta_ids(year, month)
+
+def month_tas(year, month):
+    for ta_id in month_ta_ids(year, month):
+        yield storage.get_ta(ta_id)
+
+def get_ta(ta_id):
+    return storage.get_ta(ta_id)
+
+def has_ta(ta_id):
+    # False once deleted
+    try:
+        storage.check_id(ta_id)
+    except KeyError:
+        return False
+    return True
+
+def find_dupe(ta):
+    # id of the first stored transaction that ta duplicates, or None
+    return storage.find_dupe(ta)
+
+def month_sums(year=None):
+    # cents per calendar month of one year, or summed over all years
+    return storage.month_sums(None if year is None else int(year))
+
+def category_sums():
+    # cents per category, aligned with data["categories"]
+    return storage.category_sums()
+
+def search_tas(query, start=None, end=None, cats=None):
+    # ids of the transactions whose description holds every term of query,
+    # ignoring case, in date order; terms under three bytes match the start
+    # of a word; start, end and cats as for export_data()
+    start_time = time.perf_counter()
+    ta_ids = storage.search(query, start, end, cats)
+    report_timing("search", time.perf_counter() - start_time)
+    return ta_ids
+
+def chart_series(chart, year=None):
+    # (bar labels, bar heights in cents) of the "monthly" chart, for one
+    # year or all of them, or of the "categories" chart, for all years;
+    # cached until a change touches them, see forget_charts()
+    key = (chart, year)
+    if key not in chart_cache:
+        if chart == "monthly":
+            labels = [ calendar.month_abbr[i] for i in range(1, 13) ]
+            cents = month_sums(year)
+        elif chart == "categories":
+            labels = list(data["categories"])
+            cents = category_sums()
+        else:
+            raise ValueError(f"unknown chart: {chart!r}")
+        chart_cache[key] = (labels, [ int(c) for c in cents ])
+    return chart_cache[key]
+
+def forget_charts(year=None):
+    # drops the cached series a change in year shows up in, or all of them
+    for key in list(chart_cache):
+        if year is None or key[1] is None or key[1] == year:
+            del chart_cache[key]
@@ -1,31 +1,211 @@
+import time
+start_time = time.perf_counter() # before the other imports, see main()
 import calendar
+import csv
 import datetime
-import json
-import matplotlib.pyplot as plt
+import importlib
+import os
 import re
+import sys
 import tkinter as tk
+import tkinter.filedialog
 import tkinter.messagebox
-import tkcalendar
-
-DATA_FILE = "data.json"
-data = {
-    "categories": [], # required for tk.OptionMenu()
-    "years": [], # will be sorted in non-descending order
-    "transactions": [],
-        # dict inside list
-        # contains { category, year, month, day, amount, description }
-}
+# matplotlib and tkcalendar are slow to import, see lazy_import()
+import core
+from core import (
+    cents_to_str,
+    chart_series,
+    check_ta,
+    check_valid_str,
+    close_data,
+    data,
+    delete_ta,
+    enable_diagnostics,
+    export_data,
+    find_dupe,
+    get_ta,
+    finish_loading,
+    import_statement,
+    instrumented,
+    is_loading,
+    load_data_in_background,
+    load_year,
+    month_numbers,
+    month_ta_ids,
+    parse_cents,
+    parse_date,
+    poll_writes,
+    query_average,
+    query_range,
+    query_stats,
+    record_cat,
+    record_ta,
+    report_timing,
+    search_tas,
+    subscribe,
+    unsubscribe,
+    update_ta,
+)
+import_time = time.perf_counter() - start_time
+
+WRITE_POLL_MS = 100 # how often the UI collects finished writes
+LOAD_POLL_MS = 50 # how often the UI checks whether loading is done
+DIAGNOSTICS_POLL_MS = 1000 # how often the diagnostics panel refreshes
 
 class App(tk.Tk):
     def __init__(self):
         tk.Tk.__init__(self)
         self._frame = None
+        self.importing = None # import_statement() generator while stepped
 
         self.title("Expense Tracker")
 
-        load_data()
+        # the transactions load on a thread while the window comes up, see
+        # poll_loading()
+        start = time.perf_counter()
+        load_data_in_background()
+        report_timing("startup load_head", time.perf_counter() - start)
+        self.build_menu()
+        self.status = tk.Label(self, anchor=tk.W, text="Loading transactions...")
+        self.status.pack(side=tk.BOTTOM, fill=tk.X)
         self.switch_frame(StartPage)
+        self.first_paint = self.bind("<Expose>", self.on_first_paint)
+
+        subscribe("write_done", self.on_write_done)
+        subscribe("data_loaded", self.on_data_loaded)
+        self.after(LOAD_POLL_MS, self.poll_loading)
+        self.after(WRITE_POLL_MS, self.poll_writes)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        # hidden from the menu, for when the window stalls
+        self.diagnostics_panel = None
+        self.bind("<Control-D>", self.show_diagnostics)
+
+    def show_diagnostics(self, event):
+        if self.diagnostics_panel is not None \
+                and self.diagnostics_panel.winfo_exists():
+            self.diagnostics_panel.lift()
+        else:
+            self.diagnostics_panel = DiagnosticsPanel(self)
+
+    def on_first_paint(self, event):
+        self.unbind("<Expose>", self.first_paint)
+        report_timing("startup first paint", time.perf_counter() - start_time)
+
+    def build_menu(self):
+        menu = tk.Menu(self)
+        file_menu = tk.Menu(menu, tearoff=0)
+        file_menu.add_command(
+            label="Import statement...",
+            command=instrumented(self.import_statement),
+        )
+        file_menu.add_command(
+            label="Export...",
+            command=instrumented(
+                lambda: still_loading() or ExportDialog(self),
+                "menu Export...",
+            ),
+        )
+        menu.add_cascade(label="File", menu=file_menu)
+        self.config(menu=menu)
+
+    def import_statement(self):
+        if still_loading():
+            return
+        path = tkinter.filedialog.askopenfilename(
+            title="Import statement",
+            filetypes=(
+                ( "Bank statements", "*.csv *.ofx *.qfx" ),
+                ( "All files", "*" ),
+            ),
+        )
+        if path:
+            self.step_import(import_statement(path))
 
+    def step_import(self, progress):
+        # one batch per tick keeps the window responsive during big imports
+        self.importing = progress
+        try:
+            result = next(progress)
+        except (OSError, ValueError, csv.Error) as e:
+            self.importing = None
+            self.status.config(text=f"Import failed: {e}")
+            tk.messagebox.showerror("Error", f"Import failed: {e}")
+            return
+        if not result["done"]:
+            self.status.config(text=f"Imported {result['rows']} rows...")
+            self.after(1, self.step_import, progress)
+            return
+        self.importing = None
+        text = "Imported {} transactions ({} skipped, {} duplicates)" \
+            " at {:.0f} rows/s".format(
+                result["rows"],
+                result["skipped"],
+                result["duplicates"],
+                result["rate"],
+            )
+        self.status.config(text=text)
+        tk.messagebox.showinfo(
+            "Information",
+            "\n".join([ text + "." ] + result["errors"]),
+        )
+
+    def step_export(self, progress):
+        # same batching as step_import()
+        try:
+            result = next(progress)
+        except OSError as e:
+            self.status.config(text=f"Export failed: {e}")
+            tk.messagebox.showerror("Error", f"Export failed: {e}")
+            return
+        if not result["done"]:
+            self.status.config(text=f"Exported {result['rows']} rows...")
+            self.after(1, self.step_export, progress)
+            return
+        text = "Exported {} rows at {:.0f} rows/s" \
+            .format(result["rows"], result["rate"])
+        self.status.config(text=text)
+        tk.messagebox.showinfo("Information", text + ".")
+
+    def poll_loading(self):
+        try:
+            loaded = finish_loading()
+        except Exception as e:
+            # nothing was loaded, so nothing may be saved over it either
+            tk.messagebox.showerror("Error", f"Loading failed: {e}")
+            self.destroy()
+            return
+        if not loaded:
+            self.after(LOAD_POLL_MS, self.poll_loading)
+
+    def on_data_loaded(self):
+        self.status.config(text="")
+
+    def poll_writes(self):
+        poll_writes()
+        self.after(WRITE_POLL_MS, self.poll_writes)
+
+    def on_write_done(self, jobs, seconds, error):
+        if error:
+            self.status.config(text=f"Saving failed: {error}")
+            tk.messagebox.showerror("Error", f"Saving failed: {error}")
+        else:
+            self.status.config(text="All changes saved")
+
+    def close(self):
+        # pending writes go out before the window does
+        self.status.config(text="Saving...")
+        self.update_idletasks()
+        if self.importing is not None:
+            # saves the batches applied so far, see import_statement()
+            self.importing.close()
+            self.importing = None
+        close_data()
+        poll_writes()
+        if os.environ.get("EXPENSE_TRACKER_DIAGNOSTICS"):
+            core.diagnostics.dump()
+        self.destroy()
+
+    @instrumented
     def switch_frame(self, frame_class):
         new_frame = frame_class(self)
         if self._frame is not None:
@@ -43,9 +223,6 @@ class StartPage(tk.Frame):
         self.ta_frame = StartTaFrame(parent=self)
         self.cat_frame = StartCatFrame(parent=self)
 
-    def refresh(self):
-        self.parent.switch_frame(StartPage)
-
 class StartTaFrame(tk.Frame):
     def __init__(self, parent):
         tk.Frame.__init__(self, parent)
@@ -80,20 +257,17 @@ class StartTaFrame(tk.Frame):
             if i < len(self.ta_entries) - 2:
                 tae[1] = build_grid_entry(self.frame, row=i + 1, col=1)
 
-        self.ta_cal = build_grid_cal(
-            parent=self.frame,
-            row=len(self.ta_entries) - 1,
-            col=1
-        )
+        # the calendar waits until the window is up, as tkcalendar is slow
+        # to import
+        self.ta_cal = None
+        self.first_paint = self.frame.bind("<Expose>", self.on_first_paint)
 
         self.ta_selected_cat = tk.StringVar()
-        self.cat_menu = build_grid_dropdown(
+        self.cat_menu = build_cat_grid_dropdown(
             parent=self.frame,
             shownopt=self.ta_selected_cat,
-            options=data["categories"],
             row=len(self.ta_entries),
             col=1,
-            errmsg="Create a category!",
         )
 
         build_grid_button(
@@ -104,17 +278,29 @@ class StartTaFrame(tk.Frame):
             callback=self.save_ta,
         )
 
+    def on_first_paint(self, event):
+        self.frame.unbind("<Expose>", self.first_paint)
+        self.after_idle(self.build_cal)
+
+    def build_cal(self):
+        self.ta_cal = build_grid_cal(
+            parent=self.frame,
+            row=len(self.ta_entries) - 1,
+            col=1
+        )
+
     def check_ta_input(self):
-        if not self.ta_entries[0][1].get():
-            return "Please provide a description for this transaction!"
-        try:
-            amt = float(self.ta_entries[1][1].get())
-            if amt * 100 > int(amt * 100):
-                return "There can only be two digits after the decimal!"
-        except ValueError:
-            return "The transaction amount must be a decimal number" \
-                + " (without units)!"
+        if self.ta_cal is None:
+            return "The calendar is still loading!"
+        errmsg = check_ta(
+            self.ta_entries[0][1].get(),
+            self.ta_entries[1][1].get(),
+        )
+        if errmsg:
+            return errmsg
         if not data["categories"]:
+            if is_loading():
+                return "The categories are still loading!"
             return "Must categorize this transaction!"
         return ""
 
@@ -124,31 +310,30 @@ class StartTaFrame(tk.Frame):
             tk.messagebox.showinfo("Information", f"Operation failed: {errmsg}")
             return
         year = self.ta_cal.get_displayed_month()[1]
-        if str(year) not in data["years"]:
-            added = False
-            for i, v in enumerate(data["years"]):
-                if year < int(v):
-                    data["years"].insert(i, str(year))
-                    added = True
-                    break
-            if not added:
-                data["years"].append(str(year))
-                added = True
-        data["transactions"].append({
+        ta = {
             "category": self.ta_selected_cat.get(),
             "description": self.ta_entries[0][1].get(),
-            "amount": self.ta_entries[1][1].get(),
+            "cents": parse_cents(self.ta_entries[1][1].get()),
             "year": str(year),
             "month": str(self.ta_cal.get_displayed_month()[0]),
             "day": re.search("/(.+?)/", self.ta_cal.get_date()).group(1)
-        })
-        save_data()
+        }
+        # rows still loading cannot be checked for duplicates
+        if not is_loading() and find_dupe(ta) is not None \
+                and not tk.messagebox.askyesno(
+            "Possible duplicate",
+            "A transaction with the same date, amount, description and"
+            " category already exists. Add it anyway?",
+        ):
+            return
+        record_ta(ta)
         tk.messagebox.showinfo(
             "Information",
             f"Transaction saved successfully!"
         )
 
-        self.parent.refresh()
+        for tae in self.ta_entries[:2]:
+            tae[1].delete(0, tk.END)
 
 class StartCatFrame(tk.Frame):
     def __init__(self, parent):
@@ -181,6 +366,8 @@ class StartCatFrame(tk.Frame):
         )
 
     def create_cat(self):
+        if still_loading():
+            return
         desired_cat = self.cat_to_create.get()
         errmsg = check_valid_str(desired_cat)
         if errmsg:
@@ -192,14 +379,13 @@ class StartCatFrame(tk.Frame):
                 "Operation failed: Category already exists!",
             )
             return
-        data["categories"].append(desired_cat)
-        save_data()
+        record_cat(desired_cat)
         tk.messagebox.showinfo(
             "Information",
             f"Saved {desired_cat} successfully!",
         )
 
-        self.parent.refresh()
+        self.cat_to_create.delete(0, tk.END)
 
 class StartStatsFrame(tk.Frame):
     def __init__(self, parent):
@@ -207,7 +393,7 @@ class StartStatsFrame(tk.Frame):
         self.pack(side=tk.RIGHT, anchor=tk.N)
         self.parent = parent
 
-        self.build()
+        build_loading(self, "Statistics Section")
 
     def build(self):
         self.frame = build_grid_frame(parent=self, anchor=tk.NE, cols=6)
@@ -325,13 +511,11 @@ class StartStatsFrame(tk.Frame):
             "month": tk.StringVar(),
             "year": tk.StringVar(),
         }
-        self.average_monthly_cat_menu = build_grid_dropdown(
+        self.average_monthly_cat_menu = build_cat_grid_dropdown(
             parent=self.frame,
             shownopt=self.average_monthly_cat_ta_amt_selected["cat"],
-            options=data["categories"],
             row=4,
             col=1,
-            errmsg="Create a category!",
         )
         build_month_grid_dropdown(
             parent=self.frame,
@@ -370,13 +554,11 @@ class StartStatsFrame(tk.Frame):
             "month": tk.StringVar(),
             "year": tk.StringVar(),
         }
-        self.total_monthly_cat_menu = build_grid_dropdown(
+        self.total_monthly_cat_menu = build_cat_grid_dropdown(
             parent=self.frame,
             shownopt=self.total_monthly_cat_ta_amt_selected["cat"],
-            options=data["categories"],
             row=5,
             col=1,
-            errmsg="Create a category!",
         )
         build_month_grid_dropdown(
             parent=self.frame,
@@ -468,13 +650,11 @@ class StartStatsFrame(tk.Frame):
             "cat": tk.StringVar(),
             "year": tk.StringVar(),
         }
-        build_grid_dropdown(
+        build_cat_grid_dropdown(
             parent=self.frame,
             shownopt=self.yearly_cat_average_ta_amt_selected["cat"],
-            options=data["categories"],
             row=8,
             col=1,
-            errmsg="Create a category!",
         )
         build_year_grid_dropdown(
             parent=self.frame,
@@ -506,13 +686,11 @@ class StartStatsFrame(tk.Frame):
             "cat": tk.StringVar(),
             "year": tk.StringVar(),
         }
-        build_grid_dropdown(
+        build_cat_grid_dropdown(
             parent=self.frame,
             shownopt=self.yearly_cat_total_ta_amt_selected["cat"],
-            options=data["categories"],
             row=9,
             col=1,
-            errmsg="Create a category!",
         )
         build_year_grid_dropdown(
             parent=self.frame,
@@ -569,98 +747,202 @@ class StartStatsFrame(tk.Frame):
             callback=self.graph_monthly_tas,
         )
 
+        build_grid_label(
+            parent=self.frame,
+            text="Date Range (From, To)",
+            row=12,
+            col=0,
+        )
+        # the date pickers wait for the window like StartTaFrame's calendar
+        self.range_dates = None
+        self.first_paint = self.frame.bind("<Expose>", self.on_first_paint)
+
+        build_grid_label(
+            parent=self.frame,
+            text="Date Range Total",
+            row=13,
+            col=0,
+        )
+        self.range_total_label = build_grid_label(
+            parent=self.frame,
+            text="<= Calculate!",
+            row=13,
+            col=5,
+        )
+        build_grid_button(
+            parent=self.frame,
+            text="Calculate",
+            row=13,
+            col=4,
+            callback=self.display_range_total,
+        )
+
+        build_grid_label(
+            parent=self.frame,
+            text="Date Range Category Total",
+            row=14,
+            col=0,
+        )
+        self.range_cat_selected = tk.StringVar()
+        build_cat_grid_dropdown(
+            parent=self.frame,
+            shownopt=self.range_cat_selected,
+            row=14,
+            col=1,
+        )
+        self.range_cat_total_label = build_grid_label(
+            parent=self.frame,
+            text="<= Calculate!",
+            row=14,
+            col=5,
+        )
+        build_grid_button(
+            parent=self.frame,
+            text="Calculate",
+            row=14,
+            col=4,
+            callback=self.display_range_cat_total,
+        )
+
+        # the graphs draw here rather than in a window of their own
+        self.chart = BarChart(parent=self.frame)
+        self.chart.grid(row=15, column=0, columnspan=6)
+        self.shown_chart = None
+        self.chart_refresh = None
+
+        subscribe_widget(
+            widget=self.frame,
+            event="ta_added",
+            callback=lambda ta_id: self.on_tas_changed(),
+        )
+        subscribe_widget(
+            widget=self.frame,
+            event="tas_imported",
+            callback=lambda count: self.on_tas_changed(),
+        )
+        subscribe_widget(
+            widget=self.frame,
+            event="ta_updated",
+            callback=lambda ta_id, new_id: self.on_tas_changed(),
+        )
+        subscribe_widget(
+            widget=self.frame,
+            event="ta_deleted",
+            callback=lambda ta_id: self.on_tas_changed(),
+        )
+        subscribe_widget(
+            widget=self.frame,
+            event="cat_added",
+            callback=lambda cat, index: self.refresh_chart(),
+        )
+
+    def on_tas_changed(self):
+        self.reset_results()
+        self.refresh_chart()
+
+    def reset_results(self):
+        for label in (
+            self.monthly_average_label,
+            self.monthly_total_label,
+            self.monthly_cat_average_label,
+            self.monthly_cat_total_label,
+            self.yearly_average_amt_label,
+            self.yearly_total_amt_label,
+            self.yearly_cat_average_label,
+            self.yearly_cat_total_label,
+            self.range_total_label,
+            self.range_cat_total_label,
+        ):
+            label.config(text="<= Calculate!")
+
+    def on_first_paint(self, event):
+        self.frame.unbind("<Expose>", self.first_paint)
+        self.after_idle(self.build_range_dates)
+
+    def build_range_dates(self):
+        self.range_dates = [
+            build_grid_date_entry(parent=self.frame, row=12, col=col)
+            for col in ( 2, 3 )
+        ]
+
     def graph_monthly_tas(self):
-        months = [ calendar.month_abbr[i + 1] for i in range(12) ]
-        amounts = [ 0 ] * len(months)
-        for ta in data["transactions"]:
-            amounts[int(ta["month"]) - 1] += float(ta["amount"])
-        plt.clf()
-        plt.bar(months, amounts)
-        plt.title("Monthly Transactions")
-        plt.xlabel("Month")
-        plt.ylabel("Transaction Amount (in USD)")
-        plt.grid(True)
-        plt.show()
+        year = self.monthly_tas_graph_year_selected.get()
+        self.show_chart(
+            "monthly",
+            int(year) if year else None,
+            f"Monthly Transactions in {year}" if year \
+                else "Monthly Transactions",
+            "Month",
+        )
 
     def graph_cat_vs_ta_amt(self):
-        amounts = [ 0 ] * len(data["categories"])
-        for ta in data["transactions"]:
-            i = data["categories"].index(ta["category"])
-            amounts[i] += float(ta["amount"])
-        plt.clf()
-        plt.bar(data["categories"], amounts)
-        plt.title("Transaction Amounts by Categories")
-        plt.xlabel("Category")
-        plt.ylabel("Transaction Amount (in USD)")
-        plt.grid(True)
-        plt.show()
+        self.show_chart(
+            "categories",
+            None,
+            "Transaction Amounts by Categories",
+            "Category",
+        )
+
+    def show_chart(self, chart, year, title, xlabel):
+        self.shown_chart = (chart, year, title, xlabel)
+        labels, cents = chart_series(chart, year)
+        self.chart.show(title, xlabel, labels, [ c / 100 for c in cents ])
+
+    def refresh_chart(self):
+        # once per batch of changes, with the series computed again
+        if self.chart_refresh is None:
+            self.chart_refresh = self.after_idle(self.redraw_chart)
+
+    def redraw_chart(self):
+        self.chart_refresh = None
+        if self.shown_chart is not None:
+            self.show_chart(*self.shown_chart)
 
     def calc_yearly_cat_total(self):
         year = self.yearly_cat_total_ta_amt_selected["year"].get()
         cat = self.yearly_cat_total_ta_amt_selected["cat"].get()
-        return [
-            float(ta["amount"]) for ta in data["transactions"] \
-            if ta["year"] == year and ta["category"] == cat
-        ]
+        return query_stats(year, cat=cat)
 
     def display_yearly_cat_total(self):
-        text = "${:.2f}".format(sum(self.calc_yearly_cat_total()))
+        text = "$" + cents_to_str(self.calc_yearly_cat_total()[1])
         self.yearly_cat_total_label.config(text=text)
 
     def calc_yearly_cat_average(self):
-        total = self.calc_yearly_cat_total()
-        if len(total) == 0:
-            return -1
-        return sum(total) / len(total)
+        year = self.yearly_cat_total_ta_amt_selected["year"].get()
+        cat = self.yearly_cat_total_ta_amt_selected["cat"].get()
+        return query_average(year, cat=cat)
 
     def display_yearly_cat_average(self):
         average = self.calc_yearly_cat_average()
-        text = "${:.2f}".format(average)
-        if average == -1:
-            text = "N/A"
+        text = "N/A" if average is None else "$" + cents_to_str(average)
         self.yearly_cat_average_label.config(text=text)
 
     def calc_yearly_total(self, year):
-        total = [
-            float(ta["amount"]) for ta in data["transactions"] \
-            if ta["year"] == year
-        ]
-        return total
+        return query_stats(year)
 
     def display_yearly_total(self):
         year = self.yearly_average_ta_amt_selected.get()
-        text = "${:.2f}".format(sum(self.calc_yearly_total(year)))
+        text = "$" + cents_to_str(self.calc_yearly_total(year)[1])
         self.yearly_total_amt_label.config(text=text)
 
     def calc_yearly_average(self):
         year = self.yearly_average_ta_amt_selected.get()
-        total = self.calc_yearly_total(year)
-        if len(total) == 0:
-            return -1
-        return sum(total) / len(total)
+        return query_average(year)
     
     def display_yearly_average(self):
         average = self.calc_yearly_average()
-        text = "${:.2f}".format(average)
-        if average == -1:
-            text = "N/A"
+        text = "N/A" if average is None else "$" + cents_to_str(average)
         self.yearly_average_amt_label.config(text=text)
 
     def calc_monthly_cat_total(self, month, year, category):
-        total = [
-            float(ta["amount"]) for ta in data["transactions"] \
-            if ta["year"] == year \
-            and calendar.month_name[int(ta["month"])] == month \
-            and ta["category"] == category
-        ]
-        return total
+        return query_stats(year, month=month_numbers[month], cat=category)
 
     def display_monthly_cat_total(self):
         month = self.total_monthly_cat_ta_amt_selected["month"].get()
         year = self.total_monthly_cat_ta_amt_selected["year"].get()
         cat = self.total_monthly_cat_ta_amt_selected["cat"].get()
-        text = "${:.2f}".format(
-            sum(self.calc_monthly_cat_total(month, year, cat))
+        text = "$" + cents_to_str(
+            self.calc_monthly_cat_total(month, year, cat)[1]
         )
         self.monthly_cat_total_label.config(text=text)
 
@@ -668,45 +950,51 @@ class StartStatsFrame(tk.Frame):
         month = self.average_monthly_cat_ta_amt_selected["month"].get()
         year = self.average_monthly_cat_ta_amt_selected["year"].get()
         cat = self.average_monthly_cat_ta_amt_selected["cat"].get()
-        total = self.calc_monthly_cat_total(month, year, cat)
-        if len(total) == 0:
-            return -1
-        return sum(total) / len(total)
+        return query_average(year, month=month_numbers[month], cat=cat)
 
     def display_monthly_cat_average(self):
         average = self.calc_monthly_cat_average()
-        text = "${:.2f}".format(average)
-        if average == -1:
-            text = "N/A"
+        text = "N/A" if average is None else "$" + cents_to_str(average)
         self.monthly_cat_average_label.config(text=text)
 
     def calc_monthly_total(self, month, year):
-        total = [
-            float(ta["amount"]) for ta in data["transactions"] \
-            if ta["year"] == year \
-            and calendar.month_name[int(ta["month"])] == month
-        ]
-        return total
+        return query_stats(year, month=month_numbers[month])
 
     def display_monthly_total(self):
         month = self.total_monthly_ta_amt_selected["month"].get()
         year = self.total_monthly_ta_amt_selected["year"].get()
-        text = "${:.2f}".format(sum(self.calc_monthly_total(month, year)))
+        text = "$" + cents_to_str(self.calc_monthly_total(month, year)[1])
         self.monthly_total_label.config(text=text)
 
     def calc_monthly_average(self):
         month = self.average_monthly_ta_amt_selected["month"].get()
         year = self.average_monthly_ta_amt_selected["year"].get()
-        total = self.calc_monthly_total(month, year)
-        if len(total) == 0:
-            return -1
-        return sum(total) / len(total)
+        return query_average(year, month=month_numbers[month])
+
+    def calc_range_total(self, cat=None):
+        start, end = (
+            int(date.get_date().strftime("%Y%m%d"))
+            for date in self.range_dates
+        )
+        return query_range(start, end, cat)
+
+    def display_range_total(self):
+        if self.range_dates is None:
+            return
+        count, total = self.calc_range_total()
+        text = "${} ({} transactions)".format(cents_to_str(total), count)
+        self.range_total_label.config(text=text)
+
+    def display_range_cat_total(self):
+        if self.range_dates is None:
+            return
+        count, total = self.calc_range_total(self.range_cat_selected.get())
+        text = "${} ({} transactions)".format(cents_to_str(total), count)
+        self.range_cat_total_label.config(text=text)
 
     def display_monthly_average(self):
         average = self.calc_monthly_average()
-        text = "${:.2f}".format(average)
-        if average == -1:
-            text = "N/A"
+        text = "N/A" if average is None else "$" + cents_to_str(average)
         self.monthly_average_label.config(text=text)
 
 class StartViewTaFrame(tk.Frame):
@@ -714,8 +1002,12 @@ class StartViewTaFrame(tk.Frame):
         tk.Frame.__init__(self, parent)
         self.pack(side=tk.BOTTOM)
         self.parent = parent
+        self.table = None
+        self.shown_ids = []
+        self.shown_month = None
+        self.shown_search = None
 
-        self.build()
+        build_loading(self, "View Transactions")
 
     def build(self):
         self.frame = build_grid_frame(parent=self, cols=4)
@@ -757,53 +1049,599 @@ class StartViewTaFrame(tk.Frame):
             callback=self.display_tas,
         )
 
+        build_grid_label(
+            parent=self.frame,
+            text="Search descriptions",
+            row=2,
+            col=0,
+        )
+        self.search_entry = build_grid_entry(parent=self.frame, row=2, col=1)
+        self.search_entry.bind("<Return>", lambda event: self.search())
+        # "All categories" first, then data["categories"] as they grow
+        self.search_cats = [ "All categories" ] + data["categories"]
+        self.search_cat_selected = tk.StringVar()
+        build_grid_dropdown(
+            parent=self.frame,
+            shownopt=self.search_cat_selected,
+            options=self.search_cats,
+            row=2,
+            col=2,
+        )
+        subscribe_widget(
+            widget=self.frame,
+            event="cat_added",
+            callback=self.add_search_cat,
+        )
+        build_grid_button(
+            parent=self.frame,
+            text="Search",
+            row=2,
+            col=3,
+            callback=self.search,
+        )
+        build_grid_label(
+            parent=self.frame,
+            text="Between (YYYY-MM-DD)",
+            row=3,
+            col=0,
+        )
+        self.search_dates = [
+            build_grid_entry(parent=self.frame, row=3, col=col)
+            for col in ( 1, 2 )
+        ]
+
+        build_grid_button(
+            parent=self.frame,
+            text="Edit",
+            row=5,
+            col=2,
+            callback=self.edit_selected,
+        )
+        build_grid_button(
+            parent=self.frame,
+            text="Delete",
+            row=5,
+            col=3,
+            callback=self.delete_selected,
+        )
+
+        subscribe_widget(
+            widget=self.frame,
+            event="ta_added",
+            callback=self.refresh_shown,
+        )
+        subscribe_widget(
+            widget=self.frame,
+            event="tas_imported",
+            callback=lambda count: self.refresh_shown(None),
+        )
+        subscribe_widget(
+            widget=self.frame,
+            event="ta_updated",
+            callback=lambda ta_id, new_id: self.refresh_shown(None),
+        )
+        subscribe_widget(
+            widget=self.frame,
+            event="ta_deleted",
+            callback=lambda ta_id: self.refresh_shown(None),
+        )
+
+    def add_search_cat(self, cat, index):
+        self.search_cats.insert(index + 1, cat)
+        add_grid_dropdown_option(
+            parent=self.frame,
+            shownopt=self.search_cat_selected,
+            options=self.search_cats,
+            row=2,
+            col=2,
+            defaultopt=None,
+            option=cat,
+            index=index + 1,
+        )
+
     def display_tas(self):
-        messages = ( "Category", "Date", "Description", "Amount")
-        month_tas = []
-        # get transactions that the user is asking for
-        for ta in data["transactions"]:
-            if calendar.month_name[int(ta["month"])] \
-                    != self.month_selected.get() \
-                    or ta["year"] != self.year_selected.get():
-                continue
-            month_tas.append(ta)
-        # sort transactions by date in month
-        for i in range(len(month_tas)):
-            swapped = False
-            for j in range(len(month_tas) - i - 1):
-                if int(month_tas[j]["day"]) > int(month_tas[j + 1]["day"]):
-                    month_tas[j], month_tas[j + 1] \
-                        = month_tas[j + 1], month_tas[j]
-                    swapped = True
-            if not swapped:
-                break
-        for i, m in enumerate(messages):
-            build_grid_label(
+        if not self.year_selected.get():
+            return
+        self.show_month(
+            int(self.year_selected.get()),
+            month_numbers[self.month_selected.get()],
+        )
+
+    def show_month(self, year, month, top=0):
+        # transactions that the user is asking for, already in date order
+        self.show_tas(month_ta_ids(year, month), top)
+        self.shown_month = (year, month)
+        self.shown_search = None
+
+    def search(self):
+        try:
+            start = parse_date(self.search_dates[0].get())
+            end = parse_date(self.search_dates[1].get())
+        except ValueError:
+            tk.messagebox.showinfo(
+                "Information",
+                "Operation failed: Dates must look like 2024-01-31!",
+            )
+            return
+        cat = self.search_cat_selected.get()
+        self.show_search(
+            self.search_entry.get(),
+            start,
+            end,
+            None if cat == self.search_cats[0] else { cat },
+        )
+
+    def show_search(self, query, start, end, cats, top=0):
+        self.show_tas(search_tas(query, start, end, cats), top)
+        self.shown_search = (query, start, end, cats)
+        self.shown_month = None
+
+    def show_tas(self, ta_ids, top):
+        self.shown_ids = ta_ids
+        if self.table is None:
+            self.table = VirtualTable(
                 parent=self.frame,
-                text=m,
+                headers=( "Category", "Date", "Description", "Amount" ),
+            )
+            self.table.grid(row=4, column=0, columnspan=4)
+        self.table.show(
+            len(ta_ids),
+            lambda i: self.format_ta(i, ta_ids[i]),
+            top=top,
+        )
+
+    def refresh_shown(self, ta_id):
+        # without an id, any month may have changed
+        if self.shown_search is not None:
+            self.show_search(*self.shown_search, top=self.table.top)
+        if self.shown_month is None:
+            return
+        if ta_id is not None:
+            ta = get_ta(ta_id)
+            if (int(ta["year"]), int(ta["month"])) != self.shown_month:
+                return
+        self.show_month(*self.shown_month, top=self.table.top)
+
+    def selected_id(self):
+        if self.table is None or self.table.selected is None:
+            tk.messagebox.showinfo(
+                "Information",
+                "Operation failed: Select a transaction first!",
+            )
+            return None
+        return self.shown_ids[self.table.selected]
+
+    def edit_selected(self):
+        ta_id = self.selected_id()
+        if ta_id is not None:
+            EditTaDialog(self, ta_id)
+
+    def delete_selected(self):
+        ta_id = self.selected_id()
+        if ta_id is None:
+            return
+        ta = get_ta(ta_id)
+        if tk.messagebox.askyesno(
+            "Delete transaction",
+            "Delete {} (${}) on {}-{}-{}?".format(
+                ta["description"],
+                cents_to_str(ta["cents"]),
+                ta["year"],
+                ta["month"],
+                ta["day"],
+            ),
+        ):
+            delete_ta(ta_id)
+
+    def format_ta(self, i, ta_id):
+        ta = get_ta(ta_id)
+        text = f"[Entry {i + 1}] "
+        return (
+            text + ta["category"],
+            text + "{} {} {}".format(
+                ta["year"],
+                calendar.month_name[int(ta["month"])],
+                ta["day"],
+            ),
+            text + ta["description"],
+            text + "$" + cents_to_str(ta["cents"]),
+        )
+
+class EditTaDialog(tk.Toplevel):
+    def __init__(self, parent, ta_id):
+        tk.Toplevel.__init__(self, parent)
+        self.ta_id = ta_id
+        self.title("Edit transaction")
+        self.transient(parent)
+
+        ta = get_ta(ta_id)
+        frame = build_grid_frame(self, cols=2)
+        self.entries = {}
+        for i, (label, text) in enumerate((
+            ( "Description", ta["description"] ),
+            ( "Amount (USD)", cents_to_str(ta["cents"]) ),
+            ( "Date (YYYY-MM-DD)", "{}-{:0>2}-{:0>2}".format(
+                ta["year"],
+                ta["month"],
+                ta["day"],
+            ) ),
+        )):
+            build_grid_label(parent=frame, text=label, row=i, col=0)
+            self.entries[label] = build_grid_entry(parent=frame, row=i, col=1)
+            self.entries[label].insert(0, text)
+        build_grid_label(parent=frame, text="Category", row=3, col=0)
+        self.cat_selected = tk.StringVar()
+        build_grid_dropdown(
+            parent=frame,
+            shownopt=self.cat_selected,
+            options=data["categories"],
+            row=3,
+            col=1,
+            defaultopt=ta["category"],
+        )
+        build_grid_button(
+            parent=frame,
+            text="Save",
+            row=4,
+            col=1,
+            callback=self.save,
+        )
+
+    def save(self):
+        desc = self.entries["Description"].get()
+        amount = self.entries["Amount (USD)"].get()
+        errmsg = check_ta(desc, amount)
+        try:
+            date = parse_date(self.entries["Date (YYYY-MM-DD)"].get())
+        except ValueError:
+            date = None
+        if not errmsg and date is None:
+            errmsg = "Dates must look like 2024-01-31!"
+        if errmsg:
+            tk.messagebox.showinfo(
+                "Information",
+                f"Operation failed: {errmsg}",
+                parent=self,
+            )
+            return
+        update_ta(self.ta_id, {
+            "category": self.cat_selected.get(),
+            "description": desc,
+            "cents": parse_cents(amount),
+            "year": str(date // 10000),
+            "month": str(date // 100 % 100),
+            "day": str(date % 100),
+        })
+        self.destroy()
+
+class ExportDialog(tk.Toplevel):
+    kinds = { "Transactions": "transactions", "Monthly totals": "monthly" }
+
+    def __init__(self, parent):
+        tk.Toplevel.__init__(self, parent)
+        self.parent = parent
+        self.title("Export")
+        self.transient(parent)
+
+        frame = build_grid_frame(self, cols=2)
+        build_grid_label(parent=frame, text="Export", row=0, col=0)
+        self.kind_selected = tk.StringVar()
+        build_grid_dropdown(
+            parent=frame,
+            shownopt=self.kind_selected,
+            options=list(self.kinds),
+            row=0,
+            col=1,
+        )
+        build_grid_label(parent=frame, text="From (YYYY-MM-DD)", row=1, col=0)
+        self.start_entry = build_grid_entry(parent=frame, row=1, col=1)
+        build_grid_label(parent=frame, text="To (YYYY-MM-DD)", row=2, col=0)
+        self.end_entry = build_grid_entry(parent=frame, row=2, col=1)
+        build_grid_label(
+            parent=frame,
+            text="Categories\n(none for all)",
+            row=3,
+            col=0,
+        )
+        self.cat_list = tk.Listbox(
+            frame,
+            selectmode=tk.MULTIPLE,
+            exportselection=False,
+            height=min(8, max(1, len(data["categories"]))),
+        )
+        self.cat_list.insert(tk.END, *data["categories"])
+        self.cat_list.grid(row=3, column=1, sticky=tk.NSEW, padx=5, pady=5)
+        build_grid_button(
+            parent=frame,
+            text="Export...",
+            row=4,
+            col=1,
+            callback=self.export,
+        )
+
+    def export(self):
+        try:
+            start = parse_date(self.start_entry.get())
+            end = parse_date(self.end_entry.get())
+        except ValueError:
+            tk.messagebox.showinfo(
+                "Information",
+                "Operation failed: Dates must look like 2024-01-31!",
+                parent=self,
+            )
+            return
+        selected = self.cat_list.curselection()
+        cats = { self.cat_list.get(i) for i in selected } if selected else None
+        path = tkinter.filedialog.asksaveasfilename(
+            parent=self,
+            title="Export",
+            defaultextension=".csv",
+            filetypes=(
+                ( "CSV", "*.csv" ),
+                ( "JSON Lines", "*.jsonl" ),
+            ),
+        )
+        if not path:
+            return
+        kind = self.kinds[self.kind_selected.get()]
+        self.destroy()
+        self.parent.step_export(export_data(path, kind, start, end, cats))
+
+class DiagnosticsPanel(tk.Toplevel):
+    # timings of button callbacks, persistence calls and report_timing()
+    # events since diagnostics were enabled, which opening this does
+    columns = "{:<44} {:>7} {:>9} {:>9} {:>9} {:>9} {:>9}  {}"
+
+    def __init__(self, parent):
+        tk.Toplevel.__init__(self, parent)
+        self.title("Diagnostics")
+        self.diagnostics = enable_diagnostics()
+        self.refresh_id = None
+
+        frame = build_grid_frame(self, cols=6)
+        self.trace_memory = tk.BooleanVar(
+            value=self.diagnostics.trace_memory,
+        )
+        tk.Checkbutton(
+            frame,
+            text="Trace memory (slow)",
+            variable=self.trace_memory,
+            command=lambda: self.diagnostics.set_trace_memory(
+                self.trace_memory.get(),
+            ),
+        ).grid(row=0, column=0, sticky=tk.W, padx=5, pady=5)
+        build_grid_label(parent=frame, text="Slower than (s)", row=0, col=1)
+        self.profile_entry = build_grid_entry(parent=frame, row=0, col=2)
+        self.profile_entry.insert(0, "0")
+        build_grid_button(
+            parent=frame,
+            text="Profile next interaction",
+            row=0,
+            col=3,
+            callback=self.profile_next,
+        )
+        build_grid_button(
+            parent=frame,
+            text="Dump JSON...",
+            row=0,
+            col=4,
+            callback=self.dump,
+        )
+        build_grid_button(
+            parent=frame,
+            text="Reset",
+            row=0,
+            col=5,
+            callback=self.reset,
+        )
+        self.text = tk.Text(self, width=120, height=30, font="TkFixedFont")
+        self.text.pack(fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.bind("<Destroy>", self.on_destroy)
+        self.refresh()
+
+    def refresh(self):
+        lines = [
+            self.columns.format(
+                "name",
+                "calls",
+                "mean ms",
+                "p50 ms",
+                "p95 ms",
+                "max ms",
+                "peak KiB",
+                "histogram <= " + " ".join(
+                    "{:g}".format(bound * 1000)
+                    for bound in core.DIAGNOSTICS_BUCKETS
+                ) + " ms, slower",
+            ),
+        ]
+        for name, stats in self.diagnostics.summary().items():
+            lines.append(self.columns.format(
+                name[:44],
+                stats["calls"],
+                "{:.2f}".format(stats["mean"] * 1000),
+                "{:.2f}".format(stats["p50"] * 1000),
+                "{:.2f}".format(stats["p95"] * 1000),
+                "{:.2f}".format(stats["max"] * 1000),
+                "" if stats["peak_bytes"] is None \
+                    else "{:.0f}".format(stats["peak_bytes"] / 1024),
+                " ".join(str(count) for count in stats["histogram"]),
+            ))
+        gauges = self.diagnostics.gauge_summary()
+        if gauges:
+            lines.append("")
+        for name, gauge in gauges.items():
+            lines.append("{:44} latest {:>8} max {:>8}".format(
+                name[:44],
+                gauge["latest"],
+                gauge["max"],
+            ))
+        if self.diagnostics.profile_after is not None:
+            lines += [ "", "Profiling the next interaction..." ]
+        elif self.diagnostics.profile is not None:
+            name, seconds, text = self.diagnostics.profile
+            lines += [
+                "",
+                "{} took {:.2f} ms, profile saved to {}".format(
+                    name,
+                    seconds * 1000,
+                    os.path.abspath(core.PROFILE_FILE),
+                ),
+                text,
+            ]
+        top = self.text.yview()[0]
+        self.text.delete("1.0", tk.END)
+        self.text.insert(tk.END, "\n".join(lines))
+        self.text.yview_moveto(top)
+        self.refresh_id = self.after(DIAGNOSTICS_POLL_MS, self.refresh)
+
+    def profile_next(self):
+        try:
+            slower_than = float(self.profile_entry.get())
+        except ValueError:
+            tk.messagebox.showinfo(
+                "Information",
+                "Operation failed: The time must be a number of seconds!",
+                parent=self,
+            )
+            return
+        self.diagnostics.profile_next(slower_than)
+
+    def dump(self):
+        path = tkinter.filedialog.asksaveasfilename(
+            parent=self,
+            title="Dump diagnostics",
+            initialfile=core.DIAGNOSTICS_FILE,
+            defaultextension=".json",
+            filetypes=(( "JSON", "*.json" ),),
+        )
+        if path:
+            self.diagnostics.dump(path)
+
+    def reset(self):
+        self.diagnostics.reset()
+
+    def on_destroy(self, event):
+        if event.widget is self and self.refresh_id is not None:
+            self.after_cancel(self.refresh_id)
+            self.refresh_id = None
+
+class BarChart(tk.Frame):
+    # a matplotlib Figure and canvas made on the first show(), then reused;
+    # showing the same bars again only changes their heights
+    def __init__(self, parent, size=(6, 3)):
+        tk.Frame.__init__(self, parent)
+        self.size = size
+        self.canvas = None
+        self.axes = None
+        self.bars = []
+        self.shown = None
+
+    def build(self):
+        figure = lazy_import("matplotlib.figure").Figure(
+            figsize=self.size,
+            tight_layout=True,
+        )
+        self.axes = figure.add_subplot()
+        backend = lazy_import("matplotlib.backends.backend_tkagg")
+        self.canvas = backend.FigureCanvasTkAgg(figure, master=self)
+        # draw_idle() runs it later, so it is timed on its own
+        self.canvas.draw = instrumented(self.canvas.draw, "BarChart.draw")
+        self.canvas.get_tk_widget().pack(fill=tk.BOTH, expand=True)
+
+    @instrumented
+    def show(self, title, xlabel, labels, heights):
+        if self.canvas is None:
+            self.build()
+        if self.shown == (title, xlabel, labels):
+            for bar, height in zip(self.bars, heights):
+                bar.set_height(height)
+            self.axes.relim()
+            self.axes.autoscale_view()
+        else:
+            self.axes.clear()
+            self.bars = self.axes.bar(labels, heights)
+            self.axes.set_title(title)
+            self.axes.set_xlabel(xlabel)
+            self.axes.set_ylabel("Transaction Amount (in USD)")
+            self.axes.grid(True)
+            self.shown = (title, xlabel, list(labels))
+        # drawn once Tk is idle, never blocking the window
+        self.canvas.draw_idle()
+
+class VirtualTable(tk.Frame):
+    # one listbox per column that only ever holds the rows in view;
+    # scrolling fetches the new window of rows through fetch(i)
+    def __init__(self, parent, headers, height=10):
+        tk.Frame.__init__(self, parent)
+        self.height = height
+        self.count = 0
+        self.top = 0
+        self.fetch = None
+        self.selected = None # row picked in any column, across scrolling
+
+        self.lists = []
+        for i, header in enumerate(headers):
+            build_grid_label(
+                parent=self,
+                text=header,
                 sticky=tk.N,
-                row=2,
+                row=0,
                 col=i,
             )
-            scrollbar = tk.Scrollbar(self.frame)
-            talist = tk.Listbox(self.frame, yscrollcommand=scrollbar.set)
-            talist.grid(row=3, column=i)
-            for j, ta in enumerate(month_tas):
-                key = m.lower()
-                text = f"[Entry {j + 1}] "
-                if key == "date":
-                    text += "{} {} {}".format(
-                        ta["year"],
-                        calendar.month_name[int(ta["month"])],
-                        ta["day"],
-                    )
-                else:
-                    if key == "amount":
-                        text += "$"
-                    text += ta[key]
-                talist.insert(tk.END, text)
-            scrollbar.config(command=talist.yview)
-    
+            talist = tk.Listbox(self, height=height, exportselection=False)
+            talist.grid(row=1, column=i)
+            for event in ( "<MouseWheel>", "<Button-4>", "<Button-5>" ):
+                talist.bind(event, self.on_wheel)
+            talist.bind("<<ListboxSelect>>", self.on_select)
+            self.lists.append(talist)
+        self.scrollbar = tk.Scrollbar(self, command=self.yview)
+        self.scrollbar.grid(row=1, column=len(headers), sticky=tk.NS)
+
+    def show(self, count, fetch, top=0):
+        self.count = count
+        self.fetch = fetch
+        self.selected = None
+        self.scroll_to(top)
+
+    def on_select(self, event):
+        picked = event.widget.curselection()
+        if picked:
+            self.selected = self.top + picked[0]
+            self.render()
+
+    def scroll_to(self, top):
+        self.top = max(0, min(top, self.count - self.height))
+        self.render()
+
+    def yview(self, *args):
+        if args[0] == tk.MOVETO:
+            self.scroll_to(round(float(args[1]) * self.count))
+        elif args[0] == tk.SCROLL:
+            step = self.height if args[2] == tk.PAGES else 1
+            self.scroll_to(self.top + int(args[1]) * step)
+
+    def on_wheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.scroll_to(self.top - 3)
+        else:
+            self.scroll_to(self.top + 3)
+        return "break"
+
+    def render(self):
+        bottom = min(self.count, self.top + self.height)
+        rows = [ self.fetch(i) for i in range(self.top, bottom) ]
+        for i, talist in enumerate(self.lists):
+            talist.delete(0, tk.END)
+            talist.insert(tk.END, *( row[i] for row in rows ))
+            if self.selected is not None \
+                    and self.top <= self.selected < bottom:
+                talist.selection_set(self.selected - self.top)
+        if self.count:
+            self.scrollbar.set(self.top / self.count, bottom / self.count)
+        else:
+            self.scrollbar.set(0, 1)
+
 def build_grid_frame(parent, anchor=tk.CENTER, cols=1):
     frame = tk.Frame(
         parent,
@@ -840,7 +1678,24 @@ def build_grid_dropdown(
     col,
     errmsg="",
     defaultopt=None,
+    event=None,
 ):
+    # with an event, options is the live list that event reports additions to
+    if event:
+        subscribe_widget(
+            widget=parent,
+            event=event,
+            callback=lambda option, index: add_grid_dropdown_option(
+                parent=parent,
+                shownopt=shownopt,
+                options=options,
+                row=row,
+                col=col,
+                defaultopt=defaultopt,
+                option=option,
+                index=index,
+            ),
+        )
     if not options:
         build_grid_label(parent=parent, text=errmsg, row=row, col=col)
         return
@@ -852,11 +1707,47 @@ def build_grid_dropdown(
     dropdown.grid(row=row, column=col, sticky=tk.NSEW, padx=5, pady=5)
     return dropdown
 
+def add_grid_dropdown_option(
+    parent,
+    shownopt,
+    options,
+    row,
+    col,
+    defaultopt,
+    option,
+    index,
+):
+    widget = parent.grid_slaves(row=row, column=col)[0]
+    if isinstance(widget, tk.OptionMenu):
+        # built after the option was added, so it has it already
+        if widget["menu"].index(tk.END) + 1 >= len(options):
+            return
+        widget["menu"].insert_command(
+            index,
+            label=option,
+            command=tk._setit(shownopt, option),
+        )
+        return
+    # first option, so swap the placeholder label for a real dropdown
+    widget.destroy()
+    build_grid_dropdown(
+        parent=parent,
+        shownopt=shownopt,
+        options=options,
+        row=row,
+        col=col,
+        defaultopt=defaultopt,
+    )
+
 def build_grid_button(parent, text, row, col, callback):
-    return tk.Button(parent, text=text, command=callback) \
+    name = callback.__qualname__
+    if "<lambda>" in name:
+        name = f"button {text}"
+    return tk.Button(parent, text=text, command=instrumented(callback, name)) \
         .grid(row=row, column=col, sticky=tk.NSEW, padx=5, pady=5)
 
 def build_grid_cal(parent, row, col):
+    tkcalendar = lazy_import("tkcalendar")
     cal = tkcalendar.Calendar(
         parent,
         showweeknumbers=False,
@@ -872,6 +1763,12 @@ def build_grid_cal(parent, row, col):
     cal.grid(row=row, column=col, sticky=tk.NSEW, padx=5, pady=5)
     return cal
 
+def build_grid_date_entry(parent, row, col):
+    tkcalendar = lazy_import("tkcalendar")
+    date_entry = tkcalendar.DateEntry(parent, date_pattern="yyyy-mm-dd")
+    date_entry.grid(row=row, column=col, sticky=tk.NSEW, padx=5, pady=5)
+    return date_entry
+
 def build_month_grid_dropdown(parent, shownopt, row, col):
     calendar_months = [ calendar.month_name[i + 1] for i in range(12) ]
     build_grid_dropdown(
@@ -884,6 +1781,8 @@ def build_month_grid_dropdown(parent, shownopt, row, col):
     )
 
 def build_year_grid_dropdown(parent, shownopt, row, col):
+    # picking a year loads it, if the storage only keeps some in memory
+    shownopt.trace_add("write", lambda *args: load_year(shownopt.get()))
     return build_grid_dropdown(
         parent=parent,
         shownopt=shownopt,
@@ -892,27 +1791,70 @@ def build_year_grid_dropdown(parent, shownopt, row, col):
         col=col,
         errmsg="Add a transaction!",
         defaultopt=str(datetime.datetime.now().year),
+        event="year_added",
     )
 
-def check_valid_str(test):
-    if re.match("^[A-Za-z0-9_\- ]+$", test):
-        return ""
-    return "Strings must only contain alphanumeric characters, underscores," \
-        + " dashes, and/or spaces!"
+def build_cat_grid_dropdown(parent, shownopt, row, col):
+    return build_grid_dropdown(
+        parent=parent,
+        shownopt=shownopt,
+        options=data["categories"],
+        row=row,
+        col=col,
+        errmsg="Create a category!",
+        event="cat_added",
+    )
 
-def save_data():
-    with open(DATA_FILE, "w") as file:
-        file.write(json.dumps(data, indent=4))
+def build_loading(frame, title):
+    # frame.build() once the transactions are in, a placeholder until then
+    if not is_loading():
+        frame.build()
+        return
+    placeholder = build_grid_frame(parent=frame, cols=1)
+    build_grid_label(parent=placeholder, text=title, row=0, col=0)
+    build_grid_label(
+        parent=placeholder,
+        text="Loading transactions...",
+        row=1,
+        col=0,
+    )
+
+    def on_data_loaded():
+        placeholder.destroy()
+        frame.build()
+    subscribe_widget(frame, "data_loaded", on_data_loaded)
+
+def still_loading():
+    if not is_loading():
+        return False
+    tk.messagebox.showinfo(
+        "Information",
+        "Still loading transactions, try again in a moment!",
+    )
+    return True
+
+def subscribe_widget(widget, event, callback):
+    # listen for as long as the widget exists
+    subscribe(event, callback)
+    widget.bind(
+        "<Destroy>",
+        lambda e: unsubscribe(event, callback),
+        add="+",
+    )
 
-def load_data():
-    try:
-        with open(DATA_FILE, "r") as file:
-            global data
-            data = json.load(file)
-    except FileNotFoundError:
-        pass
+def lazy_import(name):
+    if name not in sys.modules:
+        start = time.perf_counter()
+        importlib.import_module(name)
+        report_timing(f"import {name}", time.perf_counter() - start)
+    return sys.modules[name]
 
 def main():
+    if os.environ.get("EXPENSE_TRACKER_DIAGNOSTICS"):
+        enable_diagnostics()
+    if os.environ.get("EXPENSE_TRACKER_TIMING"):
+        core.timing_hook = core.print_timing
+    report_timing("startup imports", import_time)
     app = App()
     app.mainloop()
 
@@ -0,0 +1,532 @@
+import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import datetime
+import http
+import ipaddress
+import itertools
+import json
+import os
+import signal
+import sys
+import tempfile
+import time
+import urllib.parse
+
+import core # never tkinter, tkcalendar or matplotlib, like cli.py
+
+MAX_BODY = 64 * 2**20 # bytes of JSON one request may send
+WRITE_POLL_SECONDS = 1 # how often finished writes are checked for errors
+STREAM_SPOOL_SIZE = 16 * 2**20 # bytes of streamed rows kept in memory
+    # before they spill into a temporary file
+STREAM_CHUNK_SIZE = 2**20 # bytes per chunk of a streamed response
+TA_FIELDS = { "category", "description", "cents", "year", "month", "day" }
+PARALLEL_READ_STORAGES = { "json", "binary", "sqlite" }
+    # the shards storage loads and evicts years on reads, so there reads
+    # take turns like writes do
+
+class ReadWriteLock:
+    # any number of readers or a single writer; a waiting writer holds new
+    # readers back, so a steady stream of queries cannot starve it
+    def __init__(self):
+        self.readers = 0
+        self.writer = False
+        self.waiting_writers = 0
+        self.changed = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def read(self):
+        async with self.changed:
+            await self.changed.wait_for(
+                lambda: not self.writer and not self.waiting_writers
+            )
+            self.readers += 1
+        try:
+            yield
+        finally:
+            async with self.changed:
+                self.readers -= 1
+                self.changed.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def write(self):
+        async with self.changed:
+            self.waiting_writers += 1
+            try:
+                await self.changed.wait_for(
+                    lambda: not self.writer and not self.readers
+                )
+            finally:
+                self.waiting_writers -= 1
+            self.writer = True
+        try:
+            yield
+        finally:
+            async with self.changed:
+                self.writer = False
+                self.changed.notify_all()
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+def param(query, name, convert=int, default=None):
+    # a single query parameter, or default when missing
+    if name not in query:
+        return default
+    try:
+        return convert(query[name][-1])
+    except ValueError:
+        raise HttpError(400, f"Bad {name}: {query[name][-1]!r}")
+
+def cats_param(query):
+    # a set of the repeated category parameters, None meaning all
+    return set(query["category"]) if "category" in query else None
+
+def check_ta(ta):
+    # the rules the window and cli.py apply before recording
+    if not isinstance(ta, dict):
+        raise HttpError(400, "A transaction must be a JSON object!")
+    try:
+        if ta["category"] not in core.data["categories"]:
+            raise HttpError(400, f"No category {ta['category']!r}!")
+        if not isinstance(ta["description"], str) or not ta["description"]:
+            raise HttpError(400, "Please provide a description!")
+        if not isinstance(ta["cents"], int):
+            raise HttpError(400, "Amounts must be whole cents!")
+        datetime.date(int(ta["year"]), int(ta["month"]), int(ta["day"]))
+    except KeyError as e:
+        raise HttpError(400, f"Missing {e.args[0]}!")
+    except (TypeError, ValueError):
+        raise HttpError(400, "Not a valid date!")
+    return {
+        "category": ta["category"],
+        "description": ta["description"],
+        "cents": ta["cents"],
+        "year": str(int(ta["year"])),
+        "month": str(int(ta["month"])),
+        "day": str(int(ta["day"])),
+    }
+
+def check_id(ta_id):
+    try:
+        core.storage.check_id(ta_id)
+    except KeyError:
+        raise HttpError(404, f"No transaction {ta_id}!")
+
+# each route runs on a worker thread, "read" ones alongside each other
+# and "write" ones alone; the query is a dict of lists and the body the
+# decoded JSON, or None
+
+def get_head(query, body):
+    return {
+        "categories": list(core.data["categories"]),
+        "years": list(core.data["years"]),
+    }
+
+def post_category(query, body):
+    if not isinstance(body, dict) or not isinstance(body.get("name"), str):
+        raise HttpError(400, "Expected { \"name\": category }!")
+    if body["name"] in core.data["categories"]:
+        raise HttpError(400, f"Category {body['name']!r} already exists!")
+    errmsg = core.check_valid_str(body["name"])
+    if errmsg:
+        raise HttpError(400, errmsg)
+    core.storage.add_cat(body["name"])
+    return len(core.data["categories"]) - 1
+
+def post_ta(query, body):
+    ta_id, _ = core.storage.add_ta(check_ta(body))
+    return { "id": ta_id }
+
+def post_tas(query, body):
+    if not isinstance(body, list):
+        raise HttpError(400, "Expected a list of transactions!")
+    core.storage.add_tas([ check_ta(ta) for ta in body ])
+    # batches skip the json storages' journals, and the client saving
+    # after its last batch may never come
+    core.storage.save()
+    return len(body)
+
+def get_ta(query, body, ta_id):
+    check_id(ta_id)
+    return core.storage.get_ta(ta_id)
+
+def put_ta(query, body, ta_id):
+    check_id(ta_id)
+    new_id, _ = core.storage.update_ta(ta_id, check_ta(body))
+    return { "id": new_id }
+
+def delete_ta(query, body, ta_id):
+    check_id(ta_id)
+    core.storage.delete_ta(ta_id)
+    return None
+
+def get_stats(query, body):
+    count, cents = core.storage.stats(
+        param(query, "year"),
+        param(query, "month"),
+        param(query, "category", str),
+    )
+    return int(count), int(cents)
+
+def get_range(query, body):
+    count, cents = core.storage.range_stats(
+        param(query, "start"),
+        param(query, "end"),
+        param(query, "category", str),
+    )
+    return int(count), int(cents)
+
+def get_month_sums(query, body):
+    return [ int(cents) for cents in core.storage.month_sums(
+        param(query, "year"),
+    ) ]
+
+def get_category_sums(query, body):
+    return dict(zip(core.data["categories"], core.storage.category_sums()))
+
+def get_month(query, body):
+    return core.storage.month_ta_ids(
+        param(query, "year"),
+        param(query, "month"),
+    )
+
+def get_month_cat_stats(query, body):
+    return [
+        [ int(year), int(month), cat, int(count), int(cents) ]
+        for year, month, cat, count, cents in core.storage.month_cat_stats(
+            param(query, "start"),
+            param(query, "end"),
+            cats_param(query),
+        )
+    ]
+
+def get_search(query, body):
+    return core.storage.search(
+        param(query, "q", str, ""),
+        param(query, "start"),
+        param(query, "end"),
+        cats_param(query),
+    )
+
+def get_mark(query, body):
+    return core.storage.mark()
+
+def post_dupes(query, body):
+    # the category need not exist yet, as for an import that creates it
+    ta = body.get("transaction") if isinstance(body, dict) else None
+    if not isinstance(ta, dict) or not TA_FIELDS <= ta.keys():
+        raise HttpError(400, "Expected { \"transaction\", \"before\" }!")
+    before = body.get("before")
+    if isinstance(before, dict):
+        # the shards storage's mark() has year keys, which JSON made strings
+        try:
+            before = { int(year): rows for year, rows in before.items() }
+        except ValueError:
+            raise HttpError(400, "Expected years as the keys of \"before\"!")
+    return core.storage.find_dupe(ta, before)
+
+def post_save(query, body):
+    core.storage.save()
+    return None
+
+def post_flush(query, body):
+    core.storage.flush()
+    return None
+
+routes = {
+    ( "GET", "head" ): ( "read", get_head ),
+    ( "POST", "categories" ): ( "write", post_category ),
+    ( "POST", "transactions" ): ( "write", post_ta ),
+    ( "POST", "transactions/batch" ): ( "write", post_tas ),
+    ( "GET", "transactions/ID" ): ( "read", get_ta ),
+    ( "PUT", "transactions/ID" ): ( "write", put_ta ),
+    ( "DELETE", "transactions/ID" ): ( "write", delete_ta ),
+    ( "GET", "stats" ): ( "read", get_stats ),
+    ( "GET", "range" ): ( "read", get_range ),
+    ( "GET", "month-sums" ): ( "read", get_month_sums ),
+    ( "GET", "category-sums" ): ( "read", get_category_sums ),
+    ( "GET", "month" ): ( "read", get_month ),
+    ( "GET", "month-cat-stats" ): ( "read", get_month_cat_stats ),
+    ( "GET", "search" ): ( "read", get_search ),
+    ( "GET", "mark" ): ( "read", get_mark ),
+    ( "POST", "dupes" ): ( "read", post_dupes ),
+    ( "POST", "save" ): ( "write", post_save ),
+    ( "POST", "flush" ): ( "write", post_flush ),
+}
+
+def is_loopback(host):
+    if host == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host.strip("[]")).is_loopback
+    except ValueError:
+        return False
+
+class Server:
+    # HTTP/1.1 with JSON bodies on a loopback address; requests run on a
+    # thread pool under a ReadWriteLock, so reads overlap each other and
+    # every write has the store to itself
+    def __init__(self, workers):
+        self.lock = ReadWriteLock()
+        self.pool = concurrent.futures.ThreadPoolExecutor(workers)
+        self.parallel_reads = core.STORAGE in PARALLEL_READ_STORAGES
+
+    @contextlib.asynccontextmanager
+    async def locked(self, kind):
+        if kind == "read" and self.parallel_reads:
+            async with self.lock.read():
+                yield
+        else:
+            async with self.lock.write():
+                yield
+
+    async def run(self, func, *args):
+        # on the pool; the lock is held until func returns even if the
+        # client goes away first
+        future = asyncio.get_running_loop().run_in_executor(
+            self.pool,
+            func,
+            *args,
+        )
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            await asyncio.wait([ future ])
+            raise
+
+    async def warm(self):
+        # builds what reads would otherwise build lazily, so reads running
+        # at the same time only ever read
+        if not self.parallel_reads:
+            return
+        async with self.lock.write():
+            await self.run(lambda: (
+                core.storage.range_stats(),
+                core.storage.search("warm"),
+                core.storage.find_dupe({
+                    "category": "",
+                    "description": "",
+                    "cents": 0,
+                    "year": "2000",
+                    "month": "1",
+                    "day": "1",
+                }),
+            ))
+
+    async def poll_writes(self):
+        while True:
+            await asyncio.sleep(WRITE_POLL_SECONDS)
+            # only takes from the writer thread's queue, so needs no lock
+            for jobs, seconds, error in core.storage.poll():
+                core.report_timing("write", seconds)
+                if error:
+                    print(f"Saving failed: {error}", file=sys.stderr)
+
+    async def handle(self, reader, writer):
+        peer = writer.get_extra_info("peername")
+        if peer is None or not is_loopback(peer[0]):
+            writer.close()
+            return
+        try:
+            while await self.handle_request(reader, writer):
+                pass
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def handle_request(self, reader, writer):
+        # False once the connection is done with
+        line = await reader.readline()
+        if not line.strip():
+            return False
+        try:
+            method, target, version = line.decode("latin-1").split()
+        except ValueError:
+            await self.respond(writer, 400, { "error": "Bad request line" })
+            return False
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in ( b"\r\n", b"\n", b"" ):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        keep_alive = version == "HTTP/1.1" \
+            and headers.get("connection", "").lower() != "close"
+        length = int(headers.get("content-length", "0") or "0")
+        if length > MAX_BODY:
+            await self.respond(writer, 413, { "error": "Body too large" })
+            return False
+        body = await reader.readexactly(length)
+        start = time.perf_counter()
+        url = urllib.parse.urlsplit(target)
+        path = url.path.strip("/")
+        try:
+            # browsers on this machine could otherwise be tricked into
+            # talking to the server through a DNS name pointing here
+            host = headers.get("host", "").rpartition(":")[0] \
+                or headers.get("host", "")
+            if host and not is_loopback(host):
+                raise HttpError(403, "Only local clients are served")
+            ta_id = None
+            parts = path.split("/")
+            if len(parts) == 2 and parts[0] == "transactions" \
+                    and parts[1].isdigit():
+                ta_id = int(parts[1])
+                path = "transactions/ID"
+            if method == "GET" and path == "transactions":
+                await self.stream_tas(writer, url.query)
+                report_request(method, path, start)
+                return keep_alive
+            if ( method, path ) not in routes:
+                raise HttpError(404, f"No route {method} /{path}")
+            kind, handler = routes[( method, path )]
+            args = [ urllib.parse.parse_qs(url.query), None ]
+            if body:
+                try:
+                    args[1] = json.loads(body)
+                except ValueError:
+                    raise HttpError(400, "The body is not JSON")
+            if ta_id is not None:
+                args.append(ta_id)
+            async with self.locked(kind):
+                answer = await self.run(handler, *args)
+            status = 200
+        except HttpError as e:
+            status, answer = e.status, { "error": str(e) }
+        except (KeyError, IndexError) as e:
+            status, answer = 404, { "error": f"Not found: {e}" }
+        except Exception as e:
+            status, answer = 500, { "error": f"{type(e).__name__}: {e}" }
+        await self.respond(writer, status, answer, keep_alive)
+        report_request(method, path, start)
+        return keep_alive
+
+    async def respond(self, writer, status, answer, keep_alive=False):
+        payload = json.dumps(answer).encode()
+        writer.write(response_head(status, {
+            "Content-Type": "application/json",
+            "Content-Length": str(len(payload)),
+            "Connection": "keep-alive" if keep_alive else "close",
+        }) + payload)
+        await writer.drain()
+
+    async def stream_tas(self, writer, query_string):
+        # JSON Lines, spooled under one read lock so the rows all come from
+        # the same state of the store, then sent once it is released so a
+        # slow client holds up no writes
+        query = urllib.parse.parse_qs(query_string)
+        start, end = param(query, "start"), param(query, "end")
+        with tempfile.SpooledTemporaryFile(STREAM_SPOOL_SIZE) as spool:
+            async with self.locked("read"):
+                await self.run(
+                    spool_tas,
+                    spool,
+                    core.storage.iter_tas(start, end, cats_param(query)),
+                )
+            spool.seek(0)
+            writer.write(response_head(200, {
+                "Content-Type": "application/jsonl",
+                "Transfer-Encoding": "chunked",
+            }))
+            while True:
+                chunk = await self.run(spool.read, STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                writer.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                await writer.drain()
+            writer.write(b"0\r\n\r\n")
+            await writer.drain()
+
+def spool_tas(spool, tas):
+    # JSON Lines into spool, core.EXPORT_BATCH_SIZE rows at a time
+    while True:
+        batch = list(itertools.islice(tas, core.EXPORT_BATCH_SIZE))
+        if not batch:
+            return
+        spool.write("".join( json.dumps(ta) + "\n" for ta in batch ).encode())
+
+def response_head(status, headers):
+    lines = [ f"HTTP/1.1 {status} {http.HTTPStatus(status).phrase}" ]
+    lines += [ f"{name}: {value}" for name, value in headers.items() ]
+    return ( "\r\n".join(lines) + "\r\n\r\n" ).encode("latin-1")
+
+def report_request(method, path, start):
+    core.report_timing(f"server {method} /{path}", time.perf_counter() - start)
+
+async def serve(host, port, workers):
+    core.load_data()
+    server = Server(workers)
+    try:
+        await server.warm()
+        listener = await asyncio.start_server(server.handle, host, port)
+        poller = asyncio.create_task(server.poll_writes())
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in ( signal.SIGINT, signal.SIGTERM ):
+            with contextlib.suppress(NotImplementedError):
+                loop.add_signal_handler(signum, stop.set)
+        print("Serving the {} storage of {} on http://{}:{}".format(
+            core.STORAGE,
+            os.getcwd(),
+            host,
+            port,
+        ), flush=True)
+        async with listener:
+            await stop.wait()
+        poller.cancel()
+        # requests still running hold the lock until they are done
+        async with server.lock.write():
+            pass
+    finally:
+        server.pool.shutdown()
+        core.close_data()
+        for jobs, seconds, error in core.storage.poll():
+            if error:
+                print(f"Saving failed: {error}", file=sys.stderr)
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        description="Own the expense data and serve it to windows and"
+            " scripts on this machine, which use it with"
+            " EXPENSE_TRACKER_STORAGE=remote.",
+    )
+    parser.add_argument(
+        "--address",
+        default=core.SERVER_ADDRESS,
+        help="host:port on a loopback address, default %(default)s",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="threads answering requests, default %(default)s",
+    )
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    host, _, port = args.address.rpartition(":")
+    host = host.strip("[]")
+    if not is_loopback(host):
+        sys.exit(f"{host} is not a loopback address, the server only"
+            " serves this machine.")
+    if core.STORAGE == "remote":
+        sys.exit("The server needs a storage of its own, not remote.")
+    if os.environ.get("EXPENSE_TRACKER_TIMING"):
+        core.timing_hook = core.print_timing
+    if os.environ.get("EXPENSE_TRACKER_DIAGNOSTICS"):
+        core.enable_diagnostics()
+    try:
+        asyncio.run(serve(host, int(port), args.workers))
+    finally:
+        if core.diagnostics is not None:
+            core.diagnostics.dump()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,678 @@
+import csv
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import core
+
+def make_ta(day, description="coffee", cents=350, year="2024", category="Food"):
+    return {
+        "category": category,
+        "description": description,
+        "cents": cents,
+        "year": year,
+        "month": "3",
+        "day": str(day),
+    }
+
+def write_statement(rows, tail=""):
+    with open("statement.csv", "w") as file:
+        file.write("date,description,amount,category\n")
+        for day in range(1, rows + 1):
+            file.write(f"2024-03-{day:02},shop {day},1.50,Food\n")
+        file.write(tail)
+
+class StorageTest(unittest.TestCase):
+    # every test runs in a fresh directory with the storage it names
+    storage_name = "json"
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.TemporaryDirectory()
+        os.chdir(self.dir.name)
+        self.old_storage = core.STORAGE
+        core.STORAGE = self.storage_name
+        core.data["categories"].clear()
+        core.data["years"].clear()
+        core.listeners.clear()
+
+    def tearDown(self):
+        if core.storage is not None:
+            try:
+                core.close_data()
+            except Exception:
+                pass
+            core.storage = None
+        core.STORAGE = self.old_storage
+        os.chdir(self.cwd)
+        self.dir.cleanup()
+
+    def reload(self):
+        core.close_data()
+        core.load_data()
+
+    def stored(self):
+        # every live transaction, in date order
+        return [ core.get_ta(ta_id) for ta_id in self.ids() ]
+
+    def across_storages(self, session, storage_names):
+        # what session() returns on a fresh store of each storage, run in a
+        # directory of its own, checked against the json storage's
+        results = {}
+        for storage_name in [ "json" ] + storage_names:
+            os.mkdir(storage_name)
+            os.chdir(storage_name)
+            core.STORAGE = storage_name
+            core.data["categories"].clear()
+            core.data["years"].clear()
+            try:
+                results[storage_name] = session()
+            finally:
+                core.close_data()
+                core.storage = None
+                os.chdir("..")
+        for storage_name in storage_names:
+            self.assertEqual(
+                results[storage_name],
+                results["json"],
+                storage_name,
+            )
+        return results["json"]
+
+    def run_import(self, path="statement.csv"):
+        for result in core.import_statement(path):
+            pass
+        return result
+
+    def ids(self):
+        # of every live transaction, in date order
+        return [
+            ta_id
+            for year in core.data["years"]
+            for month in range(1, 13)
+            for ta_id in core.month_ta_ids(int(year), month)
+        ]
+
+    def descriptions(self):
+        return sorted(ta["description"] for ta in self.stored())
+
+class TotalsTest(unittest.TestCase):
+    def test_sums_stay_exact_past_float64(self):
+        cents = np.array([ 2**53, 1, 1 ], dtype=np.int64)
+        counts, sums = core.group_by(np.array([ 0, 0, 0 ]), cents, (1,))
+        self.assertEqual(( int(counts[0]), int(sums[0]) ), ( 3, 2**53 + 2 ))
+        totals = core.DayTotals()
+        totals.build(
+            np.array([ core.date_day(20240301) ] * 3),
+            np.array([ 0, 0, 0 ]),
+            cents,
+        )
+        self.assertEqual(totals.query(), ( 3, 2**53 + 2 ))
+
+class JournalTest(StorageTest):
+    def test_load_head_after_delete(self):
+        core.load_data()
+        core.record_cat("Food")
+        core.record_ta(make_ta(1, "first"))
+        core.record_ta(make_ta(2, "second", year="2025"))
+        core.delete_ta(0)
+        core.close_data()
+        core.load_data_in_background()
+        self.assertEqual(core.data["categories"], [ "Food" ])
+        self.assertEqual(core.data["years"], [ "2024", "2025" ])
+        self.assertTrue(core.finish_loading(wait=True))
+        self.assertEqual(self.descriptions(), [ "second" ])
+
+    def test_ids_across_compactions(self):
+        # deleted rows keep their ids until the session ends while the
+        # snapshots leave them out, so journal lines after a compaction
+        # have to be numbered as in the snapshot
+        core.load_data()
+        core.record_cat("Food")
+        for day in range(1, 6):
+            core.record_ta(make_ta(day, f"row {day}"))
+        core.save_data()
+        self.reload()
+        threshold = core.JOURNAL_COMPACT_THRESHOLD
+        core.JOURNAL_COMPACT_THRESHOLD = 4
+        try:
+            core.delete_ta(1)
+            core.update_ta(3, make_ta(4, "row 4 edited"))
+            core.record_ta(make_ta(6, "row 6"))
+            core.delete_ta(0) # compacts rows 0 and 1 away
+            core.update_ta(4, make_ta(5, "row 5 edited"))
+            core.delete_ta(2)
+            core.record_ta(make_ta(7, "row 7"))
+            core.update_ta(5, make_ta(6, "row 6 edited")) # compacts row 2
+            core.update_ta(6, make_ta(7, "row 7 edited"))
+            core.delete_ta(3)
+        finally:
+            core.JOURNAL_COMPACT_THRESHOLD = threshold
+        expected = [ "row 5 edited", "row 6 edited", "row 7 edited" ]
+        self.assertEqual(self.descriptions(), expected)
+        core.close_data()
+        core.load_data_in_background()
+        self.assertTrue(core.finish_loading(wait=True))
+        self.assertEqual(self.descriptions(), expected)
+
+    def test_journal_with_unknown_id(self):
+        core.load_data()
+        core.record_cat("Food")
+        core.record_ta(make_ta(1))
+        journal_file = core.storage.journal_file
+        core.close_data()
+        with open(journal_file, "a") as file:
+            file.write('{"op": "delete", "id": 5, "seq": 9}\n')
+        with self.assertRaisesRegex(ValueError, "transaction 5"):
+            core.load_data()
+        core.storage = None
+
+class BinaryJournalTest(JournalTest):
+    storage_name = "binary"
+
+class WriteMetricsTest(StorageTest):
+    def test_latency_and_queue_depth(self):
+        diagnostics = core.enable_diagnostics()
+        try:
+            core.load_data()
+            core.record_cat("Food")
+            core.record_ta(make_ta(1))
+            core.storage.flush()
+            latency = diagnostics.summary()["write latency"]
+            self.assertEqual(latency["calls"], 2)
+            self.assertGreaterEqual(
+                diagnostics.gauge_summary()["write queue depth"]["max"],
+                1,
+            )
+        finally:
+            core.disable_diagnostics()
+
+class SqliteTest(StorageTest):
+    def session(self):
+        core.load_data()
+        core.record_cat("Food")
+        core.record_cat("Rent")
+        for day in range(1, 9):
+            core.record_ta(make_ta(
+                day,
+                f"row {day}",
+                cents=100 * day,
+                year=str(2023 + day % 2),
+                category=( "Food", "Rent" )[day % 3 == 0],
+            ))
+        ids = self.ids()
+        core.update_ta(ids[0], make_ta(9, "row 2 edited", cents=5))
+        core.delete_ta(ids[-1])
+        core.save_data()
+        self.reload()
+        return {
+            "categories": list(core.data["categories"]),
+            "years": list(core.data["years"]),
+            "rows": sorted(
+                tuple(sorted(ta.items())) for ta in self.stored()
+            ),
+            "stats": [
+                core.query_stats(year, month, cat)
+                for year in ( 2023, 2024 )
+                for month in ( None, 3, 4 )
+                for cat in ( None, "Food", "Rent" )
+            ],
+            "category_sums": list(core.category_sums()),
+            "month_sums": list(core.month_sums(2024)),
+            "dupe": core.find_dupe(
+                make_ta(3, "row 3", cents=300, category="Rent"),
+            ) is not None,
+            "edited": core.get_ta(core.search_tas("edited")[0])["cents"],
+        }
+
+    def test_matches_json(self):
+        result = self.across_storages(self.session, [ "sqlite" ])
+        self.assertEqual(len(result["rows"]), 7)
+        self.assertTrue(result["dupe"])
+
+class RangeTest(StorageTest):
+    # month, year and leap day edges, where the Fenwick tree positions and
+    # the day numbering are easiest to get wrong
+    dates = [
+        20231231, 20240101, 20240131, 20240201, 20240229, 20240301,
+        20241231, 20250101, 20250228, 20250301,
+    ]
+    bounds = [
+        None, 20231231, 20240101, 20240131, 20240201, 20240228, 20240229,
+        20240301, 20241231, 20250101, 20250301, 20260101,
+    ]
+
+    def session(self):
+        core.load_data()
+        core.record_cat("Food")
+        core.record_cat("Rent")
+        for i, date in enumerate(self.dates):
+            core.record_ta({
+                "category": ( "Food", "Rent" )[i % 2],
+                "description": f"row {date}",
+                "cents": 10 ** (i % 4) + i,
+                "year": str(date // 10000),
+                "month": str(date // 100 % 100),
+                "day": str(date % 100),
+            })
+        # an edit and a delete move the totals after the trees are built
+        core.query_range()
+        ids = self.ids()
+        core.update_ta(ids[3], dict(core.get_ta(ids[3]), day="29"))
+        core.delete_ta(ids[6])
+        tas = self.stored()
+        results = []
+        for start in self.bounds:
+            for end in self.bounds:
+                for cat in ( None, "Rent" ):
+                    rows = [
+                        ta for ta in tas
+                        if (start is None or core.ta_date(ta) >= start)
+                        and (end is None or core.ta_date(ta) <= end)
+                        and cat in ( None, ta["category"] )
+                    ]
+                    expected = (
+                        len(rows),
+                        sum( ta["cents"] for ta in rows ),
+                    )
+                    self.assertEqual(
+                        core.query_range(start, end, cat),
+                        expected,
+                        ( core.STORAGE, start, end, cat ),
+                    )
+                    results.append(expected)
+        return results
+
+    def test_edges(self):
+        self.across_storages(
+            self.session,
+            [ "sqlite", "shards", "binary" ],
+        )
+
+class SearchTest(StorageTest):
+    texts = [
+        "Amazon Marketplace", "amazonia books", "Shell Oil", "shellfish bar",
+        "Café Olé", "Uber Eats", "Rent 100% paid", "rent_deposit",
+    ]
+    queries = {
+        # three bytes or more match anywhere, shorter terms a word start
+        "amaz": [ "Amazon Marketplace", "amazonia books" ],
+        "SHELL": [ "Shell Oil", "shellfish bar" ],
+        "ell": [ "Shell Oil", "shellfish bar" ],
+        "sh": [ "Shell Oil", "shellfish bar" ],
+        "el": [],
+        "o": [ "Shell Oil", "Café Olé" ],
+        "café": [ "Café Olé" ],
+        "olé": [ "Café Olé" ],
+        "ub ea": [ "Uber Eats" ],
+        "oil she": [ "Shell Oil" ],
+        "100%": [ "Rent 100% paid" ],
+        "t_d": [ "rent_deposit" ],
+        "marketplacex": [],
+    }
+
+    def session(self):
+        core.load_data()
+        core.record_cat("Food")
+        for day, description in enumerate(self.texts, start=1):
+            core.record_ta(make_ta(day, description))
+        # rows added after the index was built go through its additions
+        core.search_tas("warm")
+        core.record_ta(make_ta(20, "Amazon Fresh"))
+        found = {}
+        for query, expected in self.queries.items():
+            if query == "amaz":
+                expected = expected + [ "Amazon Fresh" ]
+            found[query] = [
+                core.get_ta(ta_id)["description"]
+                for ta_id in core.search_tas(query)
+            ]
+            self.assertEqual(found[query], expected, ( core.STORAGE, query ))
+        found["dated"] = [
+            core.get_ta(ta_id)["description"]
+            for ta_id in core.search_tas("amaz", 20240302, 20240319)
+        ]
+        self.assertEqual(found["dated"], [ "amazonia books" ])
+        return found
+
+    def test_terms(self):
+        self.across_storages(
+            self.session,
+            [ "sqlite", "shards", "binary" ],
+        )
+
+class MigrationTest(StorageTest):
+    # a store with a deleted row, opened with each of the other storages
+    def write_store(self, snapshot=True):
+        core.load_data()
+        core.record_cat("Food")
+        for day in range(1, 4):
+            core.record_ta(make_ta(day, f"row {day}"))
+        if snapshot:
+            core.save_data()
+        core.delete_ta(1)
+        core.close_data()
+
+    def check_migration(self, storage_name, snapshot=True):
+        self.write_store(snapshot)
+        core.STORAGE = storage_name
+        core.load_data()
+        self.assertEqual(self.descriptions(), [ "row 1", "row 3" ])
+        self.reload()
+        self.assertEqual(self.descriptions(), [ "row 1", "row 3" ])
+
+    def test_sqlite(self):
+        self.check_migration("sqlite")
+
+    def test_shards(self):
+        self.check_migration("shards")
+
+    def test_binary(self):
+        self.check_migration("binary")
+
+    def test_journal_only(self):
+        for storage_name in ( "sqlite", "shards", "binary" ):
+            with self.subTest(storage_name):
+                for path in ( core.DATA_FILE, core.JOURNAL_FILE ):
+                    if os.path.exists(path):
+                        os.remove(path)
+                core.STORAGE = "json"
+                self.check_migration(storage_name, snapshot=False)
+                core.close_data()
+
+    def test_binary_to_json(self):
+        core.STORAGE = "binary"
+        self.write_store()
+        core.convert_binary_to_json()
+        core.STORAGE = "json"
+        core.load_data()
+        self.assertEqual(self.descriptions(), [ "row 1", "row 3" ])
+
+class SnapshotFailureTest(StorageTest):
+    def setUp(self):
+        StorageTest.setUp(self)
+        self.threshold = core.JOURNAL_COMPACT_THRESHOLD
+        core.JOURNAL_COMPACT_THRESHOLD = 4
+
+    def tearDown(self):
+        core.JOURNAL_COMPACT_THRESHOLD = self.threshold
+        StorageTest.tearDown(self)
+
+    def fail_snapshots(self, times):
+        writer = core.storage.writer
+        write_snapshot = writer.write_snapshot
+        failures = [ times ]
+        def failing(*args):
+            if failures[0]:
+                failures[0] -= 1
+                raise OSError(28, "No space left on device")
+            write_snapshot(*args)
+        writer.write_snapshot = failing
+
+    def run_session(self, failures):
+        core.load_data()
+        core.record_cat("Food")
+        for day in range(1, 4):
+            core.record_ta(make_ta(day, f"row {day}"))
+        core.save_data()
+        self.reload()
+        self.fail_snapshots(failures)
+        core.delete_ta(0)
+        core.record_ta(make_ta(4, "row 4"))
+        core.record_ta(make_ta(5, "row 5")) # compacts row 0 away
+        core.update_ta(4, make_ta(6, "row 5 edited"))
+        core.storage.flush()
+        self.assertTrue(any( error for _, _, error in core.storage.poll() ))
+        self.reload()
+        self.assertEqual(
+            self.descriptions(),
+            [ "row 2", "row 3", "row 4", "row 5 edited" ],
+        )
+
+    def test_snapshot_retried(self):
+        self.run_session(1)
+
+    def test_journal_stands_in_for_snapshot(self):
+        self.run_session(100)
+        self.assertEqual(len(core.data["transactions"]), 5)
+
+class ImportTest(StorageTest):
+    def setUp(self):
+        StorageTest.setUp(self)
+        self.batch_size = core.IMPORT_BATCH_SIZE
+        core.IMPORT_BATCH_SIZE = 2
+
+    def tearDown(self):
+        core.IMPORT_BATCH_SIZE = self.batch_size
+        StorageTest.tearDown(self)
+
+    def test_closed_import_keeps_applied_batches(self):
+        write_statement(5)
+        core.load_data()
+        progress = core.import_statement("statement.csv")
+        self.assertEqual(next(progress)["rows"], 2)
+        progress.close()
+        # ids of the imported rows must match the files from here on
+        ids = self.ids()
+        core.delete_ta(ids[0])
+        core.update_ta(ids[1], make_ta(9, "edited"))
+        self.reload()
+        self.assertEqual(self.descriptions(), [ "edited" ])
+
+    def test_failed_import_keeps_applied_batches(self):
+        write_statement(4, '2024-03-09,"' + "x" * 200000 + '",1.50\n')
+        core.load_data()
+        with self.assertRaises(csv.Error):
+            for _ in core.import_statement("statement.csv"):
+                pass
+        core.delete_ta(self.ids()[3])
+        self.reload()
+        self.assertEqual(
+            self.descriptions(),
+            [ "shop 1", "shop 2", "shop 3" ],
+        )
+
+    def test_reimport_after_delete(self):
+        write_statement(3)
+        core.load_data()
+        self.run_import()
+        core.delete_ta(self.ids()[1])
+        result = self.run_import()
+        self.assertEqual(( result["rows"], result["duplicates"] ), ( 1, 2 ))
+        self.assertEqual(core.query_stats(2024), ( 3, 450 ))
+
+class ShardsImportTest(ImportTest):
+    storage_name = "shards"
+
+class StatementTest(StorageTest):
+    def session(self):
+        with open("statement.csv", "w", encoding="utf-8-sig") as file:
+            file.write(
+                "Date,Description,Amount,Category\n"
+                "2024-03-01,plain,1.50,Food\n"
+                '03/02/2024,"quoted, with comma",2,\n'
+                "20240303,no category column,0.05\n"
+                "3/4/24,short year,10.10,Rent\n"
+                "2024-13-01,bad date,1.00,Food\n"
+                "2024-03-05,bad amount,1.005,Food\n"
+                "2024-03-06,,1.00,Food\n"
+                "\n"
+            )
+        with open("statement.ofx", "w") as file:
+            file.write(
+                "OFXHEADER:100\n<OFX><BANKTRANLIST>\n"
+                "<STMTTRN>\n<TRNTYPE>DEBIT\n<DTPOSTED>20240307120000\n"
+                "<TRNAMT>-12.34\n<NAME>Debit name\n<MEMO>ignored\n"
+                "</STMTTRN>\n"
+                "<STMTTRN><DTPOSTED>20240308<TRNAMT>+5.00"
+                "<MEMO>Refund memo</STMTTRN>\n"
+                "</BANKTRANLIST></OFX>\n"
+            )
+        core.load_data()
+        core.record_cat("Food")
+        results = []
+        for path in ( "statement.csv", "statement.ofx" ):
+            result = self.run_import(path)
+            results.append(( result["rows"], result["skipped"] ))
+        return results, sorted(
+            tuple(sorted(ta.items())) for ta in self.stored()
+        )
+
+    def test_statement_formats(self):
+        results, rows = self.across_storages(
+            self.session,
+            [ "sqlite", "shards", "binary" ],
+        )
+        self.assertEqual(results, [ ( 4, 3 ), ( 2, 0 ) ])
+        self.assertEqual(
+            sorted(( ta["day"], ta["description"], ta["category"],
+                ta["cents"] ) for ta in map(dict, rows)),
+            [
+                ( "1", "plain", "Food", 150 ),
+                ( "2", "quoted, with comma", "Imported", 200 ),
+                ( "3", "no category column", "Imported", 5 ),
+                ( "4", "short year", "Rent", 1010 ),
+                ( "7", "Debit name", "Imported", 1234 ),
+                ( "8", "Refund memo", "Imported", -500 ),
+            ],
+        )
+
+class ExportTest(StorageTest):
+    def session(self):
+        core.load_data()
+        core.record_cat("Food")
+        core.record_cat("Rent")
+        core.record_ta(make_ta(2, 'quoted "name", comma', cents=-5))
+        core.record_ta(make_ta(1, "first", cents=1234))
+        core.record_ta(dict(make_ta(9, "april", category="Rent"), month="4"))
+        core.record_ta(make_ta(28, "old year", year="2023"))
+        exports = {}
+        for path, kind, start, end, cats in (
+            ( "all.csv", "transactions", None, None, None ),
+            ( "march.jsonl", "transactions", 20240301, 20240331, None ),
+            ( "rent.csv", "transactions", None, None, { "Rent" } ),
+            ( "monthly.csv", "monthly", 20240101, None, None ),
+            ( "monthly.jsonl", "monthly", None, None, { "Food" } ),
+        ):
+            for result in core.export_data(path, kind, start, end, cats):
+                pass
+            with open(path, newline="") as file:
+                exports[path] = ( result["rows"], file.read() )
+        return exports
+
+    def test_exports(self):
+        exports = self.across_storages(
+            self.session,
+            [ "sqlite", "shards", "binary" ],
+        )
+        self.assertEqual(exports["all.csv"], ( 4, (
+            "year,month,day,category,description,amount\r\n"
+            "2023,3,28,Food,old year,3.50\r\n"
+            "2024,3,1,Food,first,12.34\r\n"
+            '2024,3,2,Food,"quoted ""name"", comma",-0.05\r\n'
+            "2024,4,9,Rent,april,3.50\r\n"
+        ) ))
+        self.assertEqual(exports["march.jsonl"][0], 2)
+        first = exports["march.jsonl"][1].split("\n")[0]
+        self.assertEqual(json.loads(first), {
+            "year": "2024",
+            "month": "3",
+            "day": "1",
+            "category": "Food",
+            "description": "first",
+            "amount": "12.34",
+        })
+        self.assertEqual(exports["rent.csv"][0], 1)
+        self.assertEqual(exports["monthly.csv"], ( 2, (
+            "year,month,category,count,amount\r\n"
+            "2024,3,Food,2,12.29\r\n"
+            "2024,4,Rent,1,3.50\r\n"
+        ) ))
+        self.assertEqual(exports["monthly.jsonl"][0], 2)
+
+class ServerTest(StorageTest):
+    # a server.py over server_storage, used through the remote storage
+    server_storage = "shards"
+
+    def setUp(self):
+        StorageTest.setUp(self)
+        with socket.socket() as probe:
+            probe.bind(( "127.0.0.1", 0 ))
+            self.address = "127.0.0.1:{}".format(probe.getsockname()[1])
+        self.start_server()
+        core.record_cat("Food")
+
+    def start_server(self):
+        self.server = subprocess.Popen(
+            [ sys.executable, os.path.join(ROOT, "server.py"),
+                "--address", self.address ],
+            env=dict(os.environ, EXPENSE_TRACKER_STORAGE=self.server_storage),
+            stdout=subprocess.PIPE,
+            text=True,
+        )
+        self.server.stdout.readline() # "Serving ..." once it listens
+        core.storage = core.RemoteStorage(self.address)
+        core.storage.load()
+
+    def stop_server(self):
+        core.storage = None
+        self.server.terminate()
+        self.server.wait()
+        self.server.stdout.close()
+
+    def tearDown(self):
+        if core.storage is not None:
+            self.stop_server()
+        StorageTest.tearDown(self)
+
+class RemoteJsonTest(ServerTest):
+    server_storage = "json"
+
+    def test_batch_survives_restart(self):
+        core.record_tas([ make_ta(1, "row 1"), make_ta(2, "row 2") ])
+        core.record_ta(make_ta(3, "row 3"))
+        core.update_ta(2, make_ta(3, "row 3 edited"))
+        self.stop_server()
+        self.start_server()
+        self.assertEqual(
+            self.descriptions(),
+            [ "row 1", "row 2", "row 3 edited" ],
+        )
+
+    def test_stalled_stream_lets_writes_through(self):
+        core.record_tas([
+            make_ta(day % 28 + 1, f"row {day}") for day in range(60000)
+        ])
+        stream = core.storage.iter_tas()
+        timeout = core.SERVER_TIMEOUT
+        core.SERVER_TIMEOUT = 10
+        try:
+            next(stream) # and then read no more
+            core.RemoteStorage(self.address).add_ta(
+                make_ta(1, "written while streaming"),
+            )
+        finally:
+            core.SERVER_TIMEOUT = timeout
+            stream.close()
+        self.assertEqual(core.query_stats(2024)[0], 60001)
+
+class RemoteShardsImportTest(ServerTest):
+    # the shards storage's mark() has year keys
+    def test_reimport_skips_duplicates(self):
+        write_statement(2)
+        self.assertEqual(self.run_import()["rows"], 2)
+        result = self.run_import()
+        self.assertEqual(( result["rows"], result["duplicates"] ), ( 0, 2 ))
+        self.assertEqual(core.query_stats(2024), ( 2, 300 ))
+
+if __name__ == "__main__":
+    unittest.main()